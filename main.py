@@ -1,7 +1,9 @@
 import os
 import time
 import random
+import asyncio
 import logging
+from typing import Optional
 
 from dotenv import load_dotenv
 from telegram.request import HTTPXRequest
@@ -22,7 +24,14 @@ log = logging.getLogger("DeutschBuddy")
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 OPENAI_API_KEY     = os.getenv("OPENAI_API_KEY")
-OPENAI_MODEL       = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# پردازش موازی بین چت‌ها، ترتیبی درون هر چت (UPDATE_SHARDS نام قدیمی همین تنظیم است)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY") or os.getenv("UPDATE_SHARDS", "32"))
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1024"))
+# خلاصهٔ دوره‌ای مصرف مدل در لاگ (ثانیه؛ 0 = خاموش)
+STATS_LOG_INTERVAL = float(os.getenv("STATS_LOG_INTERVAL", "600"))
+# polling (پیش‌فرض)، webhook (سرور aiohttp؛ تنظیمات WEBHOOK_* در utils/webhook.py)
+# یا supervisor (چند پردازهٔ worker؛ تنظیمات WORKERS/SUPERVISOR_* در utils/supervisor.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
 
 if not TELEGRAM_BOT_TOKEN or not OPENAI_API_KEY:
     raise RuntimeError("Set TELEGRAM_BOT_TOKEN and OPENAI_API_KEY in .env")
@@ -32,14 +41,21 @@ def _mask(s: str) -> str:
     return (s[:6] + "..." + s[-4:]) if len(s) > 12 else "***"
 
 # ---------- Internal modules (بعد از load_dotenv) ----------
-from modules.onboarding import greet, handle_language_choice, onboarding_quickstart
+from modules.onboarding import greet, handle_language_choice, onboarding_quickstart, choose_goal
 from modules.level_test import start_level_test as level_start, handle_answer
 from modules.schreiben import schreiben_correct, schreiben_again
 from modules.wortschatz import vocab_daily, vocab_quiz_start, vocab_quiz_answer, vocab_quiz_again
 from modules.dictionary import lookup, dict_again
-from modules.grammar import grammar_tip, grammar_next, grammar_prev
-from modules.menu import open_menu, set_goal, show_profile, handle_menu_action
+from modules.grammar import grammar_tip, grammar_next, grammar_prev, grammar_cache_clear
+from modules.menu import open_menu, set_goal, show_profile, menu_schreiben, menu_grammar, menu_dict
+from modules.home import home_continue, home_schreiben
 from modules.daily import daily, daily_check_answer, daily_answer_callback, daily_again
+from modules.admin import show_stats, log_stats_periodically
+from utils.memory import flush as flush_user_state
+from utils.update_processor import ChatOrderedUpdateProcessor
+from utils.callback_router import CallbackRouter, noop
+from utils.ai_client import close_client as close_ai_client
+from utils.ai_routes import describe as describe_ai_routes
 
 # ---------- Error handler ----------
 def on_error(update, context):
@@ -51,8 +67,25 @@ def on_error(update, context):
     except Exception:
         pass
 
+# ---------- Lifecycle ----------
+async def on_startup(app: Application):
+    if STATS_LOG_INTERVAL > 0:
+        app.bot_data["stats_task"] = asyncio.create_task(log_stats_periodically(STATS_LOG_INTERVAL))
+
+async def on_shutdown(app: Application):
+    task = app.bot_data.pop("stats_task", None)
+    if task:
+        task.cancel()
+    # وضعیت کاربران در حافظه کش می‌شود؛ قبل از خروج همه را ذخیره کن
+    try:
+        n = flush_user_state()
+        log.info(f"User state flushed ({n} users).")
+    except Exception:
+        log.exception("User state flush on shutdown failed")
+    await close_ai_client()
+
 # ---------- Build application ----------
-def build_app() -> Application:
+def build_app(update_queue: Optional[asyncio.Queue] = None) -> Application:
     request = HTTPXRequest(
         http_version="1.1",
         connect_timeout=30.0,
@@ -61,13 +94,17 @@ def build_app() -> Application:
         pool_timeout=60.0,
     )
 
-    app = (
+    builder = (
         ApplicationBuilder()
         .token(TELEGRAM_BOT_TOKEN)
         .request(request)
-        .concurrent_updates(True)
-        .build()
+        .concurrent_updates(ChatOrderedUpdateProcessor(concurrency=UPDATE_CONCURRENCY, max_pending=UPDATE_MAX_PENDING))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
     )
+    if update_queue is not None:
+        builder = builder.update_queue(update_queue)
+    app = builder.build()
 
     # Commands (group=0 پیش‌فرض)
     app.add_handler(CommandHandler("start", greet))
@@ -77,34 +114,49 @@ def build_app() -> Application:
     app.add_handler(CommandHandler("dict", lookup))
     app.add_handler(CommandHandler("grammar", grammar_tip))
     app.add_handler(CommandHandler("daily", daily))
+    app.add_handler(CommandHandler("grammar_cache_clear", grammar_cache_clear))
+    app.add_handler(CommandHandler("stats", show_stats))
     app.add_handler(
         CommandHandler("schreiben", lambda u, c: u.message.reply_text("متن آلمانی‌ات را بفرست تا تصحیح کنم.")))
 
-    # Callback answers / specific callbacks (قرار بده قبل از الگوی کلی منو)
-    app.add_handler(CallbackQueryHandler(daily_answer_callback, pattern=r"^daily:opt:\d+$"))
-    app.add_handler(CallbackQueryHandler(grammar_next, pattern=r"^grammar:next$"))
-    app.add_handler(CallbackQueryHandler(grammar_prev, pattern=r"^grammar:prev$"))
-    app.add_handler(CallbackQueryHandler(handle_language_choice, pattern=r"^lang:(de|fa)$"))
-    app.add_handler(CallbackQueryHandler(set_goal, pattern=r"^goal:(lernen|review)$"))
-    app.add_handler(CallbackQueryHandler(handle_answer, pattern=r"^ans:\d+:\d+$"))
-    app.add_handler(CallbackQueryHandler(level_start, pattern=r"^level:start$"))
-    app.add_handler(CallbackQueryHandler(open_menu, pattern=r"^level:skip$"))
-    app.add_handler(CallbackQueryHandler(open_menu, pattern=r"^level:continue$"))
-    app.add_handler(CallbackQueryHandler(level_start, pattern=r"^level:redo$"))
-    app.add_handler(CallbackQueryHandler(show_profile, pattern=r"^menu:profile$"))
-    # Wortschatz callbacks
-    app.add_handler(CallbackQueryHandler(vocab_quiz_start, pattern=r"^vocab:quiz:start$"))
-    app.add_handler(CallbackQueryHandler(vocab_quiz_answer, pattern=r"^vocab:quiz:opt:\d+$"))
-    app.add_handler(CallbackQueryHandler(vocab_quiz_again, pattern=r"^vocab:again$"))
-    app.add_handler(CallbackQueryHandler(onboarding_quickstart, pattern=r"^onboard:start$"))
-    app.add_handler(CallbackQueryHandler(schreiben_again, pattern=r"^schreiben:again$"))
-    app.add_handler(CallbackQueryHandler(dict_again, pattern=r"^dict:again$"))
-    app.add_handler(CallbackQueryHandler(daily_again, pattern=r"^daily:again$"))
-
-    # در نهایت: هندلر کلی منو (باید آخرِ کالبک‌ها باشد)
-
-    app.add_handler(CallbackQueryHandler(handle_menu_action,
-                                                    pattern=r"^menu:(daily|schreiben|wortschatz|dict|grammar|profile|back)$"))
+    # همهٔ دکمه‌ها از یک CallbackQueryHandler و CallbackRouter (trie روی بخش‌های callback_data)؛
+    # nargs = تعداد بخش‌های بعد از الگو که در context.args می‌آیند
+    router = CallbackRouter()
+    router.add("lang:de", handle_language_choice)
+    router.add("lang:fa", handle_language_choice)
+    router.add("onboard:start", onboarding_quickstart)
+    router.add("goal:lernen", set_goal)
+    router.add("goal:review", set_goal)
+    router.add("goal:set", set_goal, nargs=1)     # دکمه‌های سؤال هدف
+    router.add("goal:choose", choose_goal)        # «تغییر هدف» → سؤال هدف
+    router.add("level:start", level_start)
+    router.add("level:redo", level_start)
+    router.add("level:skip", open_menu)
+    router.add("level:continue", open_menu)
+    router.add("ans", handle_answer, nargs=2)
+    router.add("menu:daily", daily)
+    router.add("menu:schreiben", menu_schreiben)
+    router.add("menu:wortschatz", vocab_daily)
+    router.add("menu:grammar", menu_grammar)
+    router.add("menu:dict", menu_dict)
+    router.add("menu:profile", show_profile)
+    router.add("menu:back", open_menu)
+    router.add("home:continue", home_continue)
+    router.add("home:daily", daily)
+    router.add("home:wortschatz", vocab_daily)
+    router.add("home:grammar", grammar_tip)
+    router.add("home:schreiben", home_schreiben)
+    router.add("daily:opt", daily_answer_callback, nargs=1)
+    router.add("daily:again", daily_again)
+    router.add("vocab:quiz:start", vocab_quiz_start)
+    router.add("vocab:quiz:opt", vocab_quiz_answer, nargs=1)
+    router.add("vocab:again", vocab_quiz_again)
+    router.add("grammar:next", grammar_next)
+    router.add("grammar:prev", grammar_prev)
+    router.add("schreiben:again", schreiben_again)
+    router.add("dict:again", dict_again)
+    router.add("noop", noop, nargs=1)  # دکمه‌های فقط‌نمایشی، مثل noop:vocabinfo
+    app.add_handler(CallbackQueryHandler(router.dispatch))
 
     # Message handlers — ترتیب مهم است!
     # 1) پاسخ تمرین روزانه (GAP) باید قبل از هر متن دیگری بررسی شود
@@ -125,7 +177,7 @@ def run_with_reconnect():
             log.info("===== DeutschBuddy starting (Polling) =====")
             log.info(f"TELEGRAM_BOT_TOKEN: {_mask(TELEGRAM_BOT_TOKEN)}")
             log.info(f"OPENAI_API_KEY   : {_mask(OPENAI_API_KEY)}")
-            log.info(f"OPENAI_MODEL     : {OPENAI_MODEL}")
+            log.info(f"AI routes:\n{describe_ai_routes()}")
 
             log.info("Bot is now polling… (Ctrl+C to stop)")
 
@@ -157,9 +209,49 @@ def run_with_reconnect():
             time.sleep(wait)
 
 
+def run_webhook():
+    # aiohttp فقط در حالت webhook لازم است
+    from utils.webhook import serve, make_update_queue
+
+    async def _run():
+        # صف باید داخل همان event loop ساخته شود
+        app = build_app(update_queue=make_update_queue())
+        await serve(app)
+
+    log.info("===== DeutschBuddy starting (Webhook) =====")
+    log.info(f"TELEGRAM_BOT_TOKEN: {_mask(TELEGRAM_BOT_TOKEN)}")
+    log.info(f"OPENAI_API_KEY   : {_mask(OPENAI_API_KEY)}")
+    log.info(f"AI routes:\n{describe_ai_routes()}")
+    asyncio.run(_run())
+
+def run_supervisor():
+    from utils.memory import STATE_BACKEND, open_store
+    from utils.supervisor import Supervisor, WORKERS, SUPERVISOR_INGRESS
+
+    if STATE_BACKEND == "json":
+        raise RuntimeError("BOT_MODE=supervisor needs STATE_BACKEND=sqlite (JSON state is single-process)")
+    # ساخت جدول/مهاجرت JSON یک بار، قبل از اینکه workerها هم‌زمان DB را باز کنند
+    open_store()
+
+    log.info("===== DeutschBuddy starting (Supervisor) =====")
+    log.info(f"TELEGRAM_BOT_TOKEN: {_mask(TELEGRAM_BOT_TOKEN)}")
+    log.info(f"OPENAI_API_KEY   : {_mask(OPENAI_API_KEY)}")
+    log.info(f"Workers: {WORKERS}, ingress: {SUPERVISOR_INGRESS}")
+    log.info(f"AI routes:\n{describe_ai_routes()}")
+
+    async def _run():
+        await Supervisor(build_app).run(TELEGRAM_BOT_TOKEN)
+
+    asyncio.run(_run())
+
 def main():
     try:
-        run_with_reconnect()
+        if BOT_MODE == "webhook":
+            run_webhook()
+        elif BOT_MODE == "supervisor":
+            run_supervisor()
+        else:
+            run_with_reconnect()
     except KeyboardInterrupt:
         log.info("Shutting down by user (Ctrl+C). Bye!")
 
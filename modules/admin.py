@@ -0,0 +1,32 @@
+# modules/admin.py
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from utils import metrics, ai_usage
+from utils.handler_guard import admin_only
+from utils.safe_telegram import safe_send
+
+log = logging.getLogger("Admin")
+
+def stats_text() -> str:
+    """جمع‌بندی مصرف مدل به تفکیک feature + بقیهٔ متریک‌ها (صف‌ها، کش‌ها، ...)."""
+    other = metrics.format_snapshot(skip_prefixes=("ai_tokens_total", "ai_cost_usd", "ai_requests_total",
+                                                   "ai_retries_total", "ai_errors_total", "ai_latency_seconds"))
+    return ai_usage.format_summary() + ("\n\n" + other if other else "")
+
+@admin_only
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats — فقط برای ADMIN_CHAT_IDS"""
+    await safe_send(update, context, stats_text(), parse_mode=None)
+
+async def log_stats_periodically(interval: float):
+    """هر interval ثانیه جمع‌بندی مصرف مدل را در لاگ می‌نویسد (تا زمان لغو task)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            log.info("\n%s", ai_usage.format_summary())
+        except Exception:
+            log.exception("Stats summary failed")
@@ -7,9 +7,9 @@ from typing import Dict, List, Tuple, Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ApplicationHandlerStop
 
-from utils.memory import get_user, set_user
+from utils.memory import get_user, set_user, update_user
 from utils.handler_guard import guard
-from utils.safe_telegram import safe_send
+from utils.safe_telegram import safe_send, safe_edit, QUIZ_EDIT_IN_PLACE
 from utils.session import touch_user
 
 log = logging.getLogger("Daily")
@@ -185,51 +185,58 @@ async def daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
     - تولید MCQ یا GAP بر اساس سطح
     - ذخیرهٔ تمرین در context.user_data["daily_current"]
     """
-    touch_user(update.effective_chat.id, "daily")
-
     chat_id = update.effective_chat.id
-    u = get_user(chat_id)
-    lang = u.get("language", "fa")
     tday = _today_iso()
 
     # آیا این نوبت «اضافی/آزمایشی» است؟
     extra_mode = context.user_data.get("daily_mode") == "extra"
 
-    # جلوگیری از چندبارگی رسمی در یک روز (اما اجازهٔ تمرین آزمایشی)
-    if u.get("last_daily") == tday and not extra_mode and context.user_data.get("daily_current") is None:
+    # همهٔ تغییرات وضعیت کاربر در یک تراکنش (یک نوشتن)
+    with update_user(chat_id) as u:
+        touch_user(chat_id, "daily", user=u)
+        lang = u.get("language", "fa")
+
+        # جلوگیری از چندبارگی رسمی در یک روز (اما اجازهٔ تمرین آزمایشی)
+        done_today = (u.get("last_daily") == tday and not extra_mode
+                      and context.user_data.get("daily_current") is None)
+
+        if not done_today:
+            # انتخاب نوع تمرین
+            mode_pick = "mcq" if random.random() < 0.6 else "gap"
+            task = _build_mcq(u) if mode_pick == "mcq" else _build_gap(u)
+
+            # ذخیرهٔ تمرین جاری
+            context.user_data["daily_current"] = task
+
+            # فقط در حالت «رسمی»، streak و last_daily را آپدیت کن
+            if not extra_mode:
+                streak = _update_streak(u)
+                u["daily_streak"] = streak
+                u["last_daily"] = tday
+            else:
+                streak = u.get("daily_streak", 0)
+
+    if done_today:
         msg = "✅ تمرین امروز انجام شده.\nمی‌خوای یک تمرین آزمایشی هم انجام بدی؟" if lang == "fa" \
               else "✅ Die heutige Übung ist erledigt.\nMöchtest du eine zusätzliche Trainingsübung?"
         await safe_send(update, context, msg, reply_markup=_again_or_back_kb(lang))
         return
 
-    # انتخاب نوع تمرین
-    mode_pick = "mcq" if random.random() < 0.6 else "gap"
-    task = _build_mcq(u) if mode_pick == "mcq" else _build_gap(u)
-
-    # ذخیرهٔ تمرین جاری
-    context.user_data["daily_current"] = task
-
-    # فقط در حالت «رسمی»، streak و last_daily را آپدیت کن
-    if not extra_mode:
-        streak = _update_streak(u)
-        set_user(chat_id, "daily_streak", streak)
-        set_user(chat_id, "last_daily", tday)
-    else:
-        streak = u.get("daily_streak", 0)
-
     footer = f"\n\n🔥 زنجیرهٔ روزانه: {streak}" if lang == "fa" else f"\n\n🔥 Tages-Streak: {streak}"
+    text = f"📅 *تمرین امروز*\n\n{task['question']}{footer}"
+    task["text"] = text  # برای ویرایش درجا: بازخورد فقط به همین متن اضافه می‌شود
 
     # ارسال تمرین
     if task["mode"] == "mcq":
         kb = _choices_keyboard(task["options"], lang)
-        await safe_send(update, context, f"📅 *تمرین امروز*\n\n{task['question']}{footer}", reply_markup=kb, parse_mode="Markdown")
+        await safe_send(update, context, text, reply_markup=kb, parse_mode="Markdown")
     else:
-        await safe_send(update, context, f"📅 *تمرین امروز*\n\n{task['question']}{footer}", reply_markup=_back_menu_keyboard(lang), parse_mode="Markdown")
+        await safe_send(update, context, text, reply_markup=_back_menu_keyboard(lang), parse_mode="Markdown")
 
 @guard()
 async def daily_again(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """کاربر یک تمرین آزمایشی (اضافی) می‌خواهد—استریک/تاریخ دست نمی‌خورند."""
-    touch_user(update.effective_chat.id, "daily")
+    # touch در خودِ daily و داخل همان تراکنش انجام می‌شود
     context.user_data["daily_mode"] = "extra"
     context.user_data["daily_current"] = None  # هرچه بود پاک شود
     await daily(update, context)
@@ -271,7 +278,13 @@ async def daily_answer_callback(update: Update, context: ContextTypes.DEFAULT_TY
               else (f"❌ Korrekte Antwort: *{correct_txt}*\n↔️ {de} → {fa}")
 
     # بعد از پاسخ، مسیر ادامه داشته باشد
-    await safe_send(update, context, msg, parse_mode="Markdown", reply_markup=_again_or_back_kb(lang))
+    if QUIZ_EDIT_IN_PLACE:
+        # متن همان پیام سؤال (با streak) + بازخورد؛ گزینه‌ها حذف می‌شوند تا دوباره جواب داده نشود
+        question = task.get("text") or f"📅 *تمرین امروز*\n\n{task['question']}"
+        await safe_edit(update, context, f"{question}\n\n{msg}",
+                        parse_mode="Markdown", reply_markup=_again_or_back_kb(lang))
+    else:
+        await safe_send(update, context, msg, parse_mode="Markdown", reply_markup=_again_or_back_kb(lang))
 
     # پاک کردن تمرین جاری و ریستِ حالت اضافه
     context.user_data["daily_current"] = None
@@ -1,18 +1,22 @@
 # modules/dictionary.py
+import os
 import re
 import json
 import logging
+import unicodedata
 from typing import Tuple, Optional, Dict, Any, List
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from utils.handler_guard import guard
+from utils.handler_guard import guard, circuit_message
 from utils.safe_telegram import safe_send
 from utils.ui import again_or_back_kb
 from utils.memory import get_user
 from utils.session import touch_user
-from utils.ai_client import chat_completion  # مرکزی: ریترا‌ی + بک‌آف
+from utils.ai_client import chat_completion, PRIORITY_INTERACTIVE, CircuitOpenError  # مرکزی: async + ریترا‌ی + بک‌آف
+from utils.ai_routes import route_for
+from utils.cache import DiskCache, make_key, fingerprint
 
 log = logging.getLogger("Dictionary")
 
@@ -32,6 +36,69 @@ SYSTEM = (
     "- Output must be pure JSON. No markdown, no extra text."
 )
 
+# کش نتیجهٔ parse‌شده (نه متن خام) با کلید واژهٔ نرمال‌شده + جهت ترجمه
+DICT_CACHE_TTL = float(os.getenv("DICT_CACHE_TTL_DAYS", "90")) * 86400
+DICT_CACHE_MAX = int(os.getenv("DICT_CACHE_MAX", "50000"))
+_dict_cache = DiskCache("dictionary", max_entries=DICT_CACHE_MAX, ttl=DICT_CACHE_TTL)
+PROMPT_VERSION = fingerprint(SYSTEM)
+
+_ARTICLES = {"der", "die", "das"}
+# فقط برای جستجو: کسی که روی کیبورد بدون umlaut «ae» تایپ کرده احتمالاً «ä» منظورش بوده.
+# روی کلید ذخیره اعمال نمی‌شود تا واژه‌های متفاوت (Maße/Masse) یکی نشوند.
+_UMLAUT_SPELLINGS = (("ae", "ä"), ("oe", "ö"), ("ue", "ü"))
+# ae/oe/ue بعد از یک مصوت یا q (Frauen، Feuer، Steuer، Quelle) umlaut نیست
+_NOT_UMLAUT = re.compile(r"(?<=[aeiouyq])(?:ae|oe|ue)")
+# ي/ك عربی → ی/ک فارسی؛ حذف کشیده و اعراب
+_FA_CHARS = str.maketrans({"ي": "ی", "ى": "ی", "ك": "ک", "ة": "ه", "ـ": None})
+_FA_DIACRITICS = re.compile(r"[\u064B-\u065F\u0670]")
+_ZW = re.compile(r"[\u200c\u200d\u200e\u200f\ufeff]")
+
+def _normalize_headword(q: str, q_lang: str) -> str:
+    """
+    فرم کانونی برای کلید کش:
+    - DE: حروف کوچک (بدون casefold؛ ß و ä/ö/ü دست نمی‌خورند)، حذف der/die/das ابتدایی
+    - FA: یکسان‌سازی ی/ک، حذف اعراب، کشیده و نیم‌فاصله (ZWNJ)
+    - هر دو: NFC، حذف علائم دو سر، فاصله‌های تکراری
+    """
+    s = unicodedata.normalize("NFC", q or "")
+    if q_lang == "FA":
+        s = _ZW.sub("", s.translate(_FA_CHARS))
+        s = _FA_DIACRITICS.sub("", s)
+    s = s.lower()
+    s = s.strip(" \t\n.,;:!?؟،«»\"'()[]")
+    words = s.split()
+    if q_lang == "DE" and len(words) > 1 and words[0] in _ARTICLES:
+        words = words[1:]
+    return " ".join(words)
+
+def _cache_key(q: str, q_lang: str) -> str:
+    return make_key(_normalize_headword(q, q_lang), q_lang, route_for("dictionary").model, PROMPT_VERSION)
+
+def _umlaut_variant(word: str) -> Optional[str]:
+    """
+    «Maedchen» → «mädchen»: فقط برای یک واژهٔ تنها که خودش umlaut/ß ندارد و همهٔ
+    ae/oe/ueهایش می‌توانند املای umlaut باشند؛ وگرنه (Frauen، Feuer) خواندن دوم بی‌فایده است.
+    """
+    if not word.isalpha() or any(c in word for c in "äöüß") or _NOT_UMLAUT.search(word):
+        return None
+    v = word
+    for typed, real in _UMLAUT_SPELLINGS:
+        v = v.replace(typed, real)
+    return v if v != word else None
+
+def _cached(q: str, q_lang: str, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+    """اول کلید خود واژه، بعد (برای DE) املای با umlaut؛ نوشتن فقط روی کلید اول است."""
+    keys = [_cache_key(q, q_lang)]
+    if q_lang == "DE":
+        variant = _umlaut_variant(_normalize_headword(q, q_lang))
+        if variant:
+            keys.append(_cache_key(variant, q_lang))
+    for key in keys:
+        data = _dict_cache.get(key, allow_stale=allow_stale)
+        if isinstance(data, dict):
+            return data
+    return None
+
 def _detect_lang(q: str) -> str:
     """Return 'DE' if latin-heavy, 'FA' if Persian/Arabic script present."""
     return "FA" if re.search(r"[آاآبپتثجچحخدذرزژسشصضطظعغفقکگلمنوهیۀء]", q) else "DE"
@@ -119,22 +186,40 @@ async def lookup(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     q_lang = _detect_lang(q)
-    user_prompt = _build_user_prompt(q, q_lang)
+    key = _cache_key(q, q_lang)
 
     try:
-        raw = chat_completion(
-            [
-                {"role": "system", "content": SYSTEM},
-                {"role": "user",   "content": user_prompt},
-            ],
-            temperature=0.2,
-        )
-        data = _coerce_json(raw)
+        data = _cached(q, q_lang)
         if isinstance(data, dict):
             out = _format_entry(data)
         else:
-            log.warning("Dictionary: non-JSON response; sending raw text.")
-            out = raw or "پاسخی دریافت نشد."
+            served: dict = {}
+            try:
+                raw = await chat_completion(
+                    [
+                        {"role": "system", "content": SYSTEM},
+                        {"role": "user",   "content": _build_user_prompt(q, q_lang)},
+                    ],
+                    chat_id=update.effective_chat.id,
+                    priority=PRIORITY_INTERACTIVE,
+                    feature="dictionary",
+                    served=served,
+                )
+            except CircuitOpenError:
+                # سرویس مدل فعلاً قطع است: نسخهٔ منقضیِ کش بهتر از هیچ است
+                data = _cached(q, q_lang, allow_stale=True)
+                if not isinstance(data, dict):
+                    raise
+                out = _format_entry(data)
+            else:
+                data = _coerce_json(raw)
+                if isinstance(data, dict):
+                    if not served.get("fallback"):  # پاسخ مدل جایگزین ۹۰ روز کش نشود
+                        _dict_cache.set(key, data)
+                    out = _format_entry(data)
+                else:
+                    log.warning("Dictionary: non-JSON response; sending raw text.")
+                    out = raw or "پاسخی دریافت نشد."
 
         lang = get_user(update.effective_chat.id).get("language", "fa")
         kb = again_or_back_kb(
@@ -145,8 +230,12 @@ async def lookup(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
         # ارسال ایمن و چندبخشی در صورت نیاز
-        await safe_send(update, context, out, parse_mode="Markdown", disable_web_page_preview=True, reply_markup=kb)
+        await safe_send(update, context, out, parse_mode="Markdown", reply_markup=kb)
 
+    except CircuitOpenError:
+        log.warning("Lookup skipped (AI circuit open): %s", q)
+        lang = get_user(update.effective_chat.id).get("language", "fa")
+        await safe_send(update, context, circuit_message(lang))
     except Exception:
         log.exception("Lookup failed for query: %s", q)
         await safe_send(update, context, "⚠️ خطا در دیکشنری. دوباره تلاش کن؛ اگر ادامه داشت اطلاع بده.")
@@ -1,5 +1,6 @@
 # modules/grammar.py
 import os
+import asyncio
 import logging
 from typing import Dict, List, Tuple, Optional
 
@@ -7,8 +8,9 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from dotenv import load_dotenv
 
-from utils.memory import get_user, set_user
-from utils.handler_guard import guard
+from utils.memory import update_user
+from utils.handler_guard import guard, admin_only
+from utils.cache import DiskCache, make_key, fingerprint
 from utils.safe_telegram import safe_send
 from utils.session import touch_user
 from utils.ui import back_menu_kb
@@ -106,75 +108,192 @@ def _header(lang: str, level: str, prev_t, cur_t, next_t) -> str:
         if next_t: lines.append(f"- Nächste: _{next_t}_")
         return "\n".join(lines)
 
-from utils.ai_client import chat_completion
+from utils.ai_client import chat_completion, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, CircuitOpenError
+from utils.ai_routes import route_for
+from utils.ai_scheduler import TokenBucket
+from utils import metrics
 
-def _ask_grammar(topic: str, lang_ui: str) -> str:
+# کش توضیحات گرامر: کلید = (topic, lang, model, prompt version)
+# PROMPT_VERSION از خود SYSTEM ساخته می‌شود؛ با تغییر پرامپت، ورودی‌های قدیمی دیگر خوانده نمی‌شوند.
+PROMPT_VERSION = fingerprint(SYSTEM)
+GRAMMAR_CACHE_TTL = float(os.getenv("GRAMMAR_CACHE_TTL_DAYS", "30")) * 86400
+GRAMMAR_CACHE_MAX = int(os.getenv("GRAMMAR_CACHE_MAX", "2000"))
+_grammar_cache = DiskCache("grammar", max_entries=GRAMMAR_CACHE_MAX, ttl=GRAMMAR_CACHE_TTL)
+
+# مدل از مسیر «grammar»؛ pre-generation هم با همین مدل می‌سازد تا کلیدها یکی باشند
+GRAMMAR_MODEL = route_for("grammar").model
+
+# پیش‌واکشی موضوع بعدی (و در صورت تنظیم، قبلی) در خط پس‌زمینه: next | both | off
+GRAMMAR_PREFETCH = os.getenv("GRAMMAR_PREFETCH", "next").strip().lower()
+# بودجهٔ پیش‌واکشی: حداکثر هم‌زمان و حداکثر در دقیقه (بیشتر از آن رد می‌شود، صف نمی‌شود)
+GRAMMAR_PREFETCH_MAX = int(os.getenv("GRAMMAR_PREFETCH_MAX", "4"))
+GRAMMAR_PREFETCH_RPM = float(os.getenv("GRAMMAR_PREFETCH_RPM", "30"))
+_prefetch_budget = TokenBucket(GRAMMAR_PREFETCH_RPM / 60.0, max(1.0, GRAMMAR_PREFETCH_RPM / 6.0))
+_prefetching: Dict[str, "asyncio.Task[str]"] = {}
+
+def _cache_key(topic: str, lang_ui: str, model: str = GRAMMAR_MODEL) -> str:
+    return make_key(" ".join(topic.split()).lower(), lang_ui, model, PROMPT_VERSION)
+
+async def _ask_grammar(topic: str, lang_ui: str, chat_id: Optional[int] = None) -> str:
+    key = _cache_key(topic, lang_ui)
+    cached = _grammar_cache.get(key)
+    if cached:
+        metrics.inc("grammar_cache_hits_total")
+        return cached
+    pending = _prefetching.get(key)
+    if pending is not None:
+        # همین موضوع در حال پیش‌واکشی است؛ به همان وصل شو
+        metrics.inc("grammar_prefetch_joined_total")
+        try:
+            body = await asyncio.shield(pending)
+            if body:
+                return body
+        except CircuitOpenError:
+            raise
+        except Exception:
+            pass  # پیش‌واکشی شکست خورد؛ درخواست عادی بفرست
+    metrics.inc("grammar_cache_misses_total")
+    try:
+        return await _generate(topic, lang_ui, chat_id=chat_id)
+    except CircuitOpenError:
+        # سرویس مدل فعلاً قطع است؛ اگر نسخهٔ منقضی داریم همان را نشان بده
+        stale = _grammar_cache.get(key, allow_stale=True)
+        if stale:
+            return stale
+        raise
+
+async def _generate(topic: str, lang_ui: str, chat_id: Optional[int] = None,
+                    priority: int = PRIORITY_INTERACTIVE, feature: Optional[str] = None,
+                    served: Optional[dict] = None) -> str:
+    served = {} if served is None else served
     user_prompt = (
         f"Interface language: {lang_ui}. "
         f"Explain the grammar topic '{topic}' with DE+FA as specified in the system message."
     )
-    return chat_completion(
+    body = await chat_completion(
         [{"role":"system","content":SYSTEM},{"role":"user","content":user_prompt}],
-        temperature=0.3
+        model=GRAMMAR_MODEL,
+        chat_id=chat_id,
+        priority=priority,
+        feature=feature or ("grammar" if priority != PRIORITY_BACKGROUND else "grammar_pregen"),
+        served=served,
     )
+    # پاسخ مدل جایگزین کش نمی‌شود تا بعد از برگشتن مدل اصلی دوباره ساخته شود
+    if body and not served.get("fallback"):
+        _grammar_cache.set(_cache_key(topic, lang_ui), body)
+    return body
+
+def is_warm(topic: str, lang_ui: str) -> bool:
+    """آیا توضیح تازهٔ این موضوع در کش هست؟"""
+    return _grammar_cache.is_fresh(_cache_key(topic, lang_ui))
+
+async def warm_topic(topic: str, lang_ui: str, force: bool = False) -> bool:
+    """
+    توضیح یک موضوع را از قبل در کش می‌سازد (برای pre-generation).
+    اگر ورودی تازه در کش باشد و force نباشد، یا مدل متنی برنگرداند یا پاسخ از مدل
+    جایگزین بود (در هر دو حالت چیزی کش نشد)، False برمی‌گرداند.
+    """
+    if not force and is_warm(topic, lang_ui):
+        return False
+    served: dict = {}
+    body = await _generate(topic, lang_ui, priority=PRIORITY_BACKGROUND, served=served)
+    return bool(body) and not served.get("fallback")
+
+def _prefetch(topic: Optional[str], lang_ui: str):
+    """ساخت توضیح یک موضوع در پس‌زمینه (کش مشترک) اگر تازه نیست و بودجه اجازه می‌دهد."""
+    if not topic:
+        return
+    key = _cache_key(topic, lang_ui)
+    if key in _prefetching or _grammar_cache.is_fresh(key):
+        return
+    if len(_prefetching) >= GRAMMAR_PREFETCH_MAX or _prefetch_budget.wait_time(1) > 0:
+        metrics.inc("grammar_prefetch_total", outcome="skipped")
+        return
+    _prefetch_budget.take(1)
+    metrics.inc("grammar_prefetch_total", outcome="started")
+    # chat_id=None: سهم هم‌زمانی خود کاربر برای درخواست‌های تعاملی‌اش آزاد می‌ماند
+    task = asyncio.ensure_future(_generate(topic, lang_ui, priority=PRIORITY_BACKGROUND, feature="grammar_prefetch"))
+    _prefetching[key] = task
+
+    def done(t: "asyncio.Task[str]", k=key):
+        _prefetching.pop(k, None)
+        if not t.cancelled() and t.exception() is not None:
+            metrics.inc("grammar_prefetch_total", outcome="failed")
+            log.warning("Grammar prefetch failed for %r: %s", topic, t.exception())
+    task.add_done_callback(done)
+
+def _prefetch_neighbours(lang: str, prev_t: Optional[str], next_t: Optional[str]):
+    if GRAMMAR_PREFETCH == "off":
+        return
+    _prefetch(next_t, lang)
+    if GRAMMAR_PREFETCH == "both":
+        _prefetch(prev_t, lang)
 
 @guard()
 async def grammar_tip(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    touch_user(update.effective_chat.id, "grammar")
+    chat_id = update.effective_chat.id
     text = (update.message.text or "").strip() if update.message else ""
     override = text.replace("/grammar", "", 1).strip()
 
-    u = get_user(update.effective_chat.id)
-    lang = u.get("language", "fa")
-    progress = _get_progress(u)
-    level = progress["level"]
-    index = progress["index"]
-
-    if override:
-        header = _header(lang, level, None, override, None)
-        body = _ask_grammar(override, lang)
-        await safe_send(update, context, f"{header}\n\n{body}", reply_markup=_nav_kb(lang, None, None), parse_mode="Markdown")
-        hist = progress.get("history", [])
-        hist.append((level, override))
-        progress["history"] = hist[-20:]
-        set_user(update.effective_chat.id, "grammar_progress", progress)
-        return
+    # touch + grammar_progress در یک تراکنش (یک نوشتن)
+    with update_user(chat_id) as u:
+        touch_user(chat_id, "grammar", user=u)
+        lang = u.get("language", "fa")
+        progress = _get_progress(u)
+        level = progress["level"]
+        index = progress["index"]
 
-    prev_t, cur_t, next_t = _current_triplet(level, index)
+        if override:
+            prev_t, cur_t, next_t = None, override, None
+            hist = progress.get("history", [])
+            hist.append((level, override))
+            progress["history"] = hist[-20:]
+        else:
+            prev_t, cur_t, next_t = _current_triplet(level, index)
+            hist = progress.get("history", [])
+            if not hist or hist[-1] != (level, cur_t):
+                hist.append((level, cur_t))
+                progress["history"] = hist[-20:]
+        u["grammar_progress"] = progress
+
+    # فراخوانی مدل بیرون از تراکنش: وضعیت کاربر چند ثانیه قفل/کهنه نمی‌ماند
+    body = await _ask_grammar(cur_t, lang, chat_id)
     header = _header(lang, level, prev_t, cur_t, next_t)
-    body = _ask_grammar(cur_t, lang)
-    hist = progress.get("history", [])
-    if not hist or hist[-1] != (level, cur_t):
-        hist.append((level, cur_t))
-        progress["history"] = hist[-20:]
-    set_user(update.effective_chat.id, "grammar_progress", progress)
     await safe_send(update, context, f"{header}\n\n{body}", reply_markup=_nav_kb(lang, prev_t, next_t), parse_mode="Markdown")
+    _prefetch_neighbours(lang, prev_t, next_t)
+
+def _step(chat_id: int, delta: int) -> Tuple[str, str, Optional[str], str, Optional[str]]:
+    """جابه‌جایی در مسیر گرامر (delta=+1/-1) در یک تراکنش؛ خروجی: lang, level, triplet."""
+    with update_user(chat_id) as u:
+        touch_user(chat_id, "grammar", user=u)
+        lang = u.get("language","fa")
+        p = _get_progress(u); level = p["level"]; index = p["index"]
+        topics = GRAMMAR_ROADMAP[level]
+        if 0 <= index + delta < len(topics):
+            p["index"] = index + delta
+            u["grammar_progress"] = p
+    prev_t, cur_t, next_t = _current_triplet(level, p["index"])
+    return lang, level, prev_t, cur_t, next_t
 
 @guard()
 async def grammar_next(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    touch_user(update.effective_chat.id, "grammar")
-    chat_id = update.effective_chat.id
-    u = get_user(chat_id); lang = u.get("language","fa")
-    p = _get_progress(u); level = p["level"]; index = p["index"]
-    topics = GRAMMAR_ROADMAP[level]
-    if index + 1 < len(topics):
-        p["index"] = index + 1
-        set_user(chat_id, "grammar_progress", p)
-    prev_t, cur_t, next_t = _current_triplet(level, p["index"])
+    lang, level, prev_t, cur_t, next_t = _step(update.effective_chat.id, +1)
     header = _header(lang, level, prev_t, cur_t, next_t)
-    body = _ask_grammar(cur_t, lang)
+    body = await _ask_grammar(cur_t, lang, update.effective_chat.id)
     await safe_send(update, context, f"{header}\n\n{body}", reply_markup=_nav_kb(lang, prev_t, next_t), parse_mode="Markdown")
+    _prefetch_neighbours(lang, prev_t, next_t)
 
 @guard()
 async def grammar_prev(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    touch_user(update.effective_chat.id, "grammar")
-    chat_id = update.effective_chat.id
-    u = get_user(chat_id); lang = u.get("language","fa")
-    p = _get_progress(u); level = p["level"]; index = p["index"]
-    if index - 1 >= 0:
-        p["index"] = index - 1
-        set_user(chat_id, "grammar_progress", p)
-    prev_t, cur_t, next_t = _current_triplet(level, p["index"])
+    lang, level, prev_t, cur_t, next_t = _step(update.effective_chat.id, -1)
     header = _header(lang, level, prev_t, cur_t, next_t)
-    body = _ask_grammar(cur_t, lang)
+    body = await _ask_grammar(cur_t, lang, update.effective_chat.id)
     await safe_send(update, context, f"{header}\n\n{body}", reply_markup=_nav_kb(lang, prev_t, next_t), parse_mode="Markdown")
+    _prefetch_neighbours(lang, prev_t, next_t)
+
+# مدیریتی: پاک‌کردن کش توضیحات (مثلاً بعد از ویرایش دستی یا تغییر مدل)
+@admin_only
+async def grammar_cache_clear(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    n = _grammar_cache.clear()
+    log.info("Grammar cache cleared by %s (%d entries)", update.effective_chat.id, n)
+    await safe_send(update, context, f"🧹 Grammar cache cleared: {n} entries (prompt version {PROMPT_VERSION}).", parse_mode=None)
@@ -5,6 +5,7 @@ from telegram.ext import ContextTypes
 from utils.memory import get_user
 from utils.session import touch_user, should_show_welcome_back
 from utils.safe_telegram import safe_send
+from utils.handler_guard import guard
 
 def _kb_home(lang: str) -> InlineKeyboardMarkup:
     rows = [
@@ -69,47 +70,39 @@ async def welcome_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
         header = "🏠 صفحهٔ خانه" if lang == "fa" else "🏠 Startseite"
         await safe_send(update, context, f"{header}\n\n{summary}", reply_markup=_kb_home(lang), parse_mode="Markdown")
 
-# کال‌بک‌های دکمه‌های خانه
-async def home_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    data = update.callback_query.data
+# کال‌بک‌های دکمه‌های خانه (مسیرها در main.py روی CallbackRouter ثبت می‌شوند؛
+# home:daily / home:wortschatz / home:grammar مستقیم به هندلر همان بخش می‌روند)
+def _schreiben_prompt(lang: str) -> str:
+    return "متن آلمانی‌ات را بفرست تا تصحیح کنم." if lang == "fa" else "Sende deinen deutschen Text zur Korrektur."
+
+@guard()
+async def home_continue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ادامه از آخرین بافت (last_context)."""
     chat_id = update.effective_chat.id
     u = get_user(chat_id)
-    lang = u.get("language","fa")
-    # لمس
+    lang = u.get("language", "fa")
     touch_user(chat_id)
 
-    if data == "home:continue":
-        # ادامه از آخرین بافت
-        ctx = u.get("last_context")
-        if ctx == "daily":
-            from modules.daily import daily
-            await daily(update, context)
-        elif ctx == "wortschatz":
-            from modules.wortschatz import vocab_daily
-            await vocab_daily(update, context)
-        elif ctx == "grammar":
-            from modules.grammar import grammar_tip
-            await grammar_tip(update, context)
-        elif ctx == "schreiben":
-            txt = "متن آلمانی‌ات را بفرست تا تصحیح کنم." if lang=="fa" else "Sende deinen deutschen Text zur Korrektur."
-            await safe_send(update, context, txt)
-        else:
-            # اگر چیزی ثبت نشده بود → منو
-            from modules.menu import open_menu
-            await open_menu(update, context)
-
-    elif data == "home:daily":
+    ctx = u.get("last_context")
+    if ctx == "daily":
         from modules.daily import daily
         await daily(update, context)
-
-    elif data == "home:wortschatz":
+    elif ctx == "wortschatz":
         from modules.wortschatz import vocab_daily
         await vocab_daily(update, context)
-
-    elif data == "home:grammar":
+    elif ctx == "grammar":
         from modules.grammar import grammar_tip
         await grammar_tip(update, context)
+    elif ctx == "schreiben":
+        await safe_send(update, context, _schreiben_prompt(lang))
+    else:
+        # اگر چیزی ثبت نشده بود → منو
+        from modules.menu import open_menu
+        await open_menu(update, context)
 
-    elif data == "home:schreiben":
-        txt = "متن آلمانی‌ات را بفرست تا تصحیح کنم." if lang=="fa" else "Sende deinen deutschen Text zur Korrektur."
-        await safe_send(update, context, txt)
+@guard()
+async def home_schreiben(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    touch_user(chat_id)
+    lang = get_user(chat_id).get("language", "fa")
+    await safe_send(update, context, _schreiben_prompt(lang))
@@ -3,6 +3,9 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 from utils.memory import get_user, set_user
 from utils.feedback import level_message
+from utils.safe_telegram import QUIZ_EDIT_IN_PLACE
+from utils.outbox import outbox
+from utils.handler_guard import guard
 
 QUEST_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "questions.json")
 
@@ -18,27 +21,30 @@ async def start_level_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["level_progress"] = {"q_index": 0, "correct": [], "answers": []}
     await send_next_question(update, context)
 
-async def send_next_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def send_next_question(update: Update, context: ContextTypes.DEFAULT_TYPE, prefix: str = ""):
+    """prefix: بازخورد سؤال قبلی که در همان ویرایش بالای سؤال بعدی می‌آید."""
     questions = load_questions()
     prog = context.user_data.get("level_progress", {"q_index": 0})
     i = prog["q_index"]
     if i >= len(questions):
-        await finish_level_test(update, context)
+        await finish_level_test(update, context, prefix=prefix)
         return
 
     q = questions[i]
     kb = [[InlineKeyboardButton(f"{_idx_to_letter(idx)}. {opt}", callback_data=f"ans:{i}:{idx}")] for idx, opt in enumerate(q["options"])]
     lang = get_user(update.effective_chat.id)["language"]
     pre = "Frage" if lang == "de" else "سؤال"
-    text = f"{pre} {i+1}/{len(questions)}:\n{q['question']}"
+    text = f"{prefix}{pre} {i+1}/{len(questions)}:\n{q['question']}"
     if update.callback_query:
-        await update.callback_query.edit_message_text(text=text, reply_markup=InlineKeyboardMarkup(kb))
+        await outbox.send(update.effective_chat.id, lambda: update.callback_query.edit_message_text(
+            text=text, reply_markup=InlineKeyboardMarkup(kb)))
     else:
-        await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(kb))
+        await outbox.send(update.effective_chat.id, lambda: update.message.reply_text(
+            text, reply_markup=InlineKeyboardMarkup(kb)))
 
+@guard()
 async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     _, i_str, opt_str = query.data.split(":")
     i, chosen = int(i_str), int(opt_str)
 
@@ -52,12 +58,16 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["level_progress"] = prog
 
     mark = "✅" if correct else "❌"
+    if QUIZ_EDIT_IN_PLACE:
+        # بازخورد + سؤال بعدی در یک edit_message_text
+        await send_next_question(update, context, prefix=f"{mark}\n\n")
+        return
     fb = f"{mark}"
-    await query.edit_message_text(text=fb)
+    await outbox.send(update.effective_chat.id, lambda: query.edit_message_text(text=fb))
     # send next
     await send_next_question(update, context)
 
-async def finish_level_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def finish_level_test(update: Update, context: ContextTypes.DEFAULT_TYPE, prefix: str = ""):
     prog = context.user_data.get("level_progress", {})
     if not prog:
         return
@@ -84,6 +94,8 @@ async def finish_level_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
         InlineKeyboardButton("مرور مباحث قبلی 🔁" if lang=="fa" else "Wiederholen 🔁", callback_data="goal:review")
     ]]
     if update.callback_query:
-        await update.callback_query.edit_message_text(text=f"{msg}\n\n{post}", reply_markup=InlineKeyboardMarkup(kb))
+        await outbox.send(update.effective_chat.id, lambda: update.callback_query.edit_message_text(
+            text=f"{prefix}{msg}\n\n{post}", reply_markup=InlineKeyboardMarkup(kb)))
     else:
-        await update.message.reply_text(f"{msg}\n\n{post}", reply_markup=InlineKeyboardMarkup(kb))
+        await outbox.send(update.effective_chat.id, lambda: update.message.reply_text(
+            f"{msg}\n\n{post}", reply_markup=InlineKeyboardMarkup(kb)))
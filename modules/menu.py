@@ -83,11 +83,13 @@ async def set_goal(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not query or not query.data.startswith("goal:"):
         return
 
-    await query.answer()
     chat_id = query.message.chat_id
     touch_user(chat_id, "menu")
 
-    _, goal = query.data.split(":")
+    # goal:lernen یا goal:set:lernen (دکمه‌های سؤال هدف در onboarding)
+    goal = query.data.split(":")[-1]
+    if goal not in ("lernen", "review"):
+        return
     set_user(chat_id, "goal", goal)
 
     lang = get_user(chat_id).get("language", "fa")
@@ -130,54 +132,27 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await safe_send(update, context, text, parse_mode="Markdown", reply_markup=_back_only_kb(lang))
 
-# ---- Router for menu buttons ----
-@guard()
-async def handle_menu_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """روتِ دکمه‌های منو → هر بخش را فراخوانی می‌کند و همیشه راه بازگشت دارد."""
-    query = update.callback_query
-    if not query or not query.data.startswith("menu:"):
-        return
-
-    await query.answer()
-    chat_id = query.message.chat_id
-    u = get_user(chat_id)
-    lang = u.get("language", "fa")
-    action = query.data.split(":", 1)[1]
-
-    touch_user(chat_id, action)
-
-    # --- Routing ---
-    if action == "daily":
-        from modules.daily import daily
-        await daily(update, context)
-        return
-
-    if action == "wortschatz":
-        from modules.wortschatz import vocab_daily
-        await vocab_daily(update, context)
-        return
-
-    if action == "schreiben":
-        await safe_send(update, context, _schreiben_prompt(lang), reply_markup=_back_only_kb(lang))
-        return
-
-    if action == "grammar":
-        # راهنمای کوتاه + بازگشت
-        await safe_send(update, context, _grammar_hint(lang), parse_mode="Markdown", reply_markup=_back_only_kb(lang))
-        return
-
-    if action == "dict":
-        await safe_send(update, context, _dict_hint(lang), parse_mode="Markdown", reply_markup=_back_only_kb(lang))
-        return
+# ---- Menu buttons (مسیرها در main.py روی CallbackRouter ثبت می‌شوند) ----
+# menu:daily / menu:wortschatz / menu:profile / menu:back مستقیم به daily، vocab_daily،
+# show_profile و open_menu می‌روند؛ این‌ها فقط راهنمای کوتاه + بازگشت هستند.
 
-    if action == "profile":
-        await show_profile(update, context)
-        return
+@guard()
+async def menu_schreiben(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    touch_user(chat_id, "schreiben")
+    lang = get_user(chat_id).get("language", "fa")
+    await safe_send(update, context, _schreiben_prompt(lang), reply_markup=_back_only_kb(lang))
 
-    if action == "back":
-        title, kb = _main_menu_kb(lang)
-        await safe_send(update, context, title, reply_markup=kb)
-        return
+@guard()
+async def menu_grammar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    touch_user(chat_id, "grammar")
+    lang = get_user(chat_id).get("language", "fa")
+    await safe_send(update, context, _grammar_hint(lang), parse_mode="Markdown", reply_markup=_back_only_kb(lang))
 
-    # ناشناخته
-    await safe_send(update, context, "❓ دستور ناشناخته است.", reply_markup=_back_only_kb(lang))
+@guard()
+async def menu_dict(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    touch_user(chat_id, "dict")
+    lang = get_user(chat_id).get("language", "fa")
+    await safe_send(update, context, _dict_hint(lang), parse_mode="Markdown", reply_markup=_back_only_kb(lang))
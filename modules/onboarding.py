@@ -23,22 +23,34 @@ def _kb_language_and_quickstart() -> InlineKeyboardMarkup:
         [InlineKeyboardButton("🚀 شروع سریع", callback_data="onboard:start")]
     ])
 
-def _kb_level_continue(lang: str, goal: str) -> InlineKeyboardMarkup:
+def _kb_level_continue(lang: str) -> InlineKeyboardMarkup:
     if lang == LANG_DE:
         return InlineKeyboardMarkup([
             [InlineKeyboardButton("Mit diesem Niveau starten ✅", callback_data="level:continue")],
             [InlineKeyboardButton("Einstufung erneut 🔁", callback_data="level:redo")],
-            [InlineKeyboardButton("Ziel ändern", callback_data=f"goal:set:{goal}")],
+            [InlineKeyboardButton("Ziel ändern", callback_data="goal:choose")],
             [InlineKeyboardButton("Hauptmenü ⬅️", callback_data="menu:back")],
         ])
     else:
         return InlineKeyboardMarkup([
             [InlineKeyboardButton("ادامه با همین سطح ✅", callback_data="level:continue")],
             [InlineKeyboardButton("تعیین سطح دوباره 🔁", callback_data="level:redo")],
-            [InlineKeyboardButton("تغییر هدف", callback_data=f"goal:set:{goal}")],
+            [InlineKeyboardButton("تغییر هدف", callback_data="goal:choose")],
             [InlineKeyboardButton("بازگشت به منو ⬅️", callback_data="menu:back")],
         ])
 
+def _goal_picker(lang: str) -> Tuple[str, InlineKeyboardMarkup]:
+    """سؤال هدف با دکمه‌های goal:set:lernen / goal:set:review."""
+    if lang == LANG_FA:
+        return "هدفت چیه؟", InlineKeyboardMarkup([
+            [InlineKeyboardButton("یادگیری 🔥", callback_data="goal:set:lernen"),
+             InlineKeyboardButton("مرور ♻️",   callback_data="goal:set:review")]
+        ])
+    return "Dein Ziel?", InlineKeyboardMarkup([
+        [InlineKeyboardButton("Lernen 🔥",   callback_data="goal:set:lernen"),
+         InlineKeyboardButton("Wiederholen ♻️", callback_data="goal:set:review")]
+    ])
+
 def _kb_level_offer(lang: str) -> InlineKeyboardMarkup:
     if lang == LANG_DE:
         return InlineKeyboardMarkup([
@@ -61,7 +73,6 @@ def post_language_welcome_text_kb(chat_id: int, lang: str) -> Tuple[str, InlineK
     """
     u = get_user(chat_id)
     level = u.get("level")
-    goal = u.get("goal") or "lernen"
 
     if level:
         if lang == LANG_DE:
@@ -72,7 +83,7 @@ def post_language_welcome_text_kb(chat_id: int, lang: str) -> Tuple[str, InlineK
             text = (f"✅ *تعیین‌سطح قبلی یافت شد*\n"
                     f"سطح آخر شما: **{level}**.\n\n"
                     f"می‌خوای با همین سطح ادامه بدی یا دوباره تست بدی؟")
-        return text, _kb_level_continue(lang, goal)
+        return text, _kb_level_continue(lang)
 
     # هنوز تعیین‌سطح نشده
     if lang == LANG_DE:
@@ -132,8 +143,6 @@ async def greet(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @guard()
 async def handle_language_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    if query:
-        await query.answer()
     chat_id = update.effective_chat.id
     data = (query.data if query else "").strip()
 
@@ -166,18 +175,7 @@ async def onboarding_quickstart(update: Update, context: ContextTypes.DEFAULT_TY
 
     # اگر هدف هنوز تعیین نشده، به جریان تنظیم هدف بفرست
     if "goal" not in u:
-        if lang == LANG_FA:
-            txt = "هدفت چیه؟"
-            kb = InlineKeyboardMarkup([
-                [InlineKeyboardButton("یادگیری 🔥", callback_data="goal:set:lernen"),
-                 InlineKeyboardButton("مرور ♻️",   callback_data="goal:set:review")]
-            ])
-        else:
-            txt = "Dein Ziel?"
-            kb = InlineKeyboardMarkup([
-                [InlineKeyboardButton("Lernen 🔥",   callback_data="goal:set:lernen"),
-                 InlineKeyboardButton("Wiederholen ♻️", callback_data="goal:set:review")]
-            ])
+        txt, kb = _goal_picker(lang)
         await safe_send(update, context, txt, reply_markup=kb)
         return
 
@@ -190,3 +188,13 @@ async def onboarding_quickstart(update: Update, context: ContextTypes.DEFAULT_TY
     # وگرنه → منوی اصلی
     from modules.menu import open_menu
     await open_menu(update, context)
+
+# ---------------------------
+# دکمه «تغییر هدف» (goal:choose)
+# ---------------------------
+@guard()
+async def choose_goal(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """سؤال هدف را دوباره نشان می‌دهد؛ انتخاب با goal:set:<x> در set_goal ذخیره می‌شود."""
+    lang = get_user(update.effective_chat.id).get("language", LANG_FA)
+    txt, kb = _goal_picker(lang)
+    await safe_send(update, context, txt, reply_markup=kb)
@@ -1,27 +1,33 @@
 # modules/schreiben.py
 import os
+import re
+import json
 import time
-import random
+import html
+import asyncio
 import logging
+import unicodedata
+from typing import Any, Dict, List, Optional
 from dotenv import load_dotenv
-from openai import OpenAI
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 
 from utils.session import touch_user
 from utils.memory import get_user
 from utils.safe_telegram import safe_send
-from utils.handler_guard import guard
+from utils.outbox import outbox
+from utils.handler_guard import guard, circuit_message
+from utils.ai_client import chat_completion, stream_chat_completion, PRIORITY_SCHREIBEN, CircuitOpenError
+from utils.ai_routes import route_for
+from utils.cache import DiskCache, make_key, fingerprint
+from utils.images import pick_photo, photo_data_url
+from utils.text_diff import render_diff_html, changed_ratio, pack_blocks
+from utils import metrics
 
 load_dotenv()
 log = logging.getLogger("Schreiben")
 
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-
-client = OpenAI(api_key=OPENAI_API_KEY)
-
 SYSTEM_TEXT = (
     "You are a precise German teacher (B1/B2). "
     "Always reply in a clear 4-part Markdown format:\n"
@@ -38,31 +44,125 @@ SYSTEM_IMAGE = (
     "Return Markdown with: Titel, short OCR-Text, Verbesserter Text, up to 3 Hinweise (DE), ترجمهٔ فارسی."
 )
 
+# حالت diff: مدل فقط متن تصحیح‌شده + کد نکته‌ها را (JSON) برمی‌گرداند و diff در ربات ساخته می‌شود
+SYSTEM_DIFF = (
+    "You are a precise German teacher (B1/B2). Correct the user's German text in exam style. "
+    "Respond ONLY with strict JSON (no code fences): "
+    '{"corrected": str, "hints": [{"code": str, "note": str}]}. '
+    "'corrected' is the full corrected text with the original line breaks. "
+    "'hints': at most 3 of the most important issues; 'code' is one of "
+    "ART, KASUS, KONJ, TEMPUS, WORTST, PRAEP, ADJ, GROSS, ORTH, KOMMA, WORT, STIL; "
+    "'note' is a very short German explanation (max 8 words). "
+    "No translation, no repetition of the original text."
+)
+
+# کد نکته → (DE, FA)
+HINT_CODES: Dict[str, tuple] = {
+    "ART":    ("Artikel/Genus", "حرف تعریف و جنس"),
+    "KASUS":  ("Kasus", "حالت دستوری (Akk/Dat/Gen)"),
+    "KONJ":   ("Konjugation", "صرف فعل"),
+    "TEMPUS": ("Zeitform", "زمان فعل"),
+    "WORTST": ("Wortstellung", "ترتیب کلمات / جای فعل"),
+    "PRAEP":  ("Präposition", "حرف اضافه"),
+    "ADJ":    ("Adjektivendung", "پایانهٔ صفت"),
+    "GROSS":  ("Groß-/Kleinschreibung", "حروف بزرگ و کوچک"),
+    "ORTH":   ("Rechtschreibung", "املا"),
+    "KOMMA":  ("Zeichensetzung", "نشانه‌گذاری"),
+    "WORT":   ("Wortwahl", "انتخاب واژه"),
+    "STIL":   ("Stil/Register", "سبک و لحن"),
+}
+
+# اندازهٔ هر بخش (و حد متن کوتاه)؛ متن بلندتر بخش‌بندی و موازی تصحیح می‌شود
 MAX_INPUT_CHARS = 1200
+# سقف کل متن پذیرفته‌شده (نامهٔ کامل Goethe B2 ≈ ۱۵۰۰–۲۵۰۰ نویسه)
+SCHREIBEN_MAX_CHARS = int(os.getenv("SCHREIBEN_MAX_CHARS", "8000"))
+# بخش‌های هم‌زمان هر کاربر (scheduler هم AI_MAX_PER_CHAT را اعمال می‌کند)
+SCHREIBEN_PARALLEL = int(os.getenv("SCHREIBEN_PARALLEL", "2"))
 TG_LIMIT = 4096
 
-def _truncate(s: str, limit: int = MAX_INPUT_CHARS) -> str:
-    s = (s or "").strip()
-    return s if len(s) <= limit else s[:limit] + " …"
+# استریم پاسخ: پیام موقت + ویرایش تدریجی (زمان تا اولین توکن = تأخیری که کاربر می‌بیند)
+SCHREIBEN_STREAM = os.getenv("SCHREIBEN_STREAM", "1") == "1"
+# فاصلهٔ ویرایش‌ها (ثانیه)؛ تلگرام ویرایش‌های خیلی سریع یک پیام را محدود می‌کند
+SCHREIBEN_EDIT_INTERVAL = float(os.getenv("SCHREIBEN_EDIT_INTERVAL", "1.5"))
+# تصحیح متن: markdown (پاسخ کامل مدل) یا diff (مدل فقط متن اصلاح‌شده؛ diff محلی، خروجی بسیار کوتاه‌تر)
+SCHREIBEN_MODE = os.getenv("SCHREIBEN_MODE", "markdown").strip().lower()
+# کمی کمتر از TG_LIMIT تا « …» و اختلاف Markdown جا شود
+_SEGMENT_LIMIT = TG_LIMIT - 96
 
-def _retry_chat(messages, temperature=0.3, max_attempts=3):
-    attempt = 0
-    while True:
-        try:
-            resp = client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=messages,
-                temperature=temperature
-            )
-            return (resp.choices[0].message.content or "").strip()
-        except Exception as e:
-            attempt += 1
-            if attempt >= max_attempts:
-                log.exception("OpenAI failed after %s attempts", attempt)
-                raise
-            base = min(10, 2 ** attempt)
-            jitter = random.uniform(0.2, 0.5) * base
-            time.sleep(base + jitter)
+# نتیجهٔ تصحیح عکس بر اساس file_unique_id (همان عکس دوباره فرستاده شود، فراخوانی vision تکرار نمی‌شود)
+SCHREIBEN_IMAGE_CACHE_TTL = float(os.getenv("SCHREIBEN_IMAGE_CACHE_TTL_DAYS", "7")) * 86400
+SCHREIBEN_IMAGE_CACHE_MAX = int(os.getenv("SCHREIBEN_IMAGE_CACHE_MAX", "5000"))
+_image_cache = DiskCache("schreiben_image", max_entries=SCHREIBEN_IMAGE_CACHE_MAX, ttl=SCHREIBEN_IMAGE_CACHE_TTL)
+
+# نتیجهٔ تصحیح متن بر اساس hash متن نرمال‌شده (ارسال دوبارهٔ همان انشا بعد از timeout، قالب‌های تکراری)
+SCHREIBEN_TEXT_CACHE_TTL = float(os.getenv("SCHREIBEN_TEXT_CACHE_TTL_DAYS", "7")) * 86400
+SCHREIBEN_TEXT_CACHE_MAX = int(os.getenv("SCHREIBEN_TEXT_CACHE_MAX", "20000"))
+_text_cache = DiskCache("schreiben_text", max_entries=SCHREIBEN_TEXT_CACHE_MAX, ttl=SCHREIBEN_TEXT_CACHE_TTL)
+
+def _image_cache_key(file_unique_id: str, caption: str, user_lang: str) -> str:
+    return make_key(file_unique_id, caption, user_lang, route_for("schreiben_image").model, fingerprint(SYSTEM_IMAGE))
+
+def _text_cache_key(txt: str, user_lang: str, diff: bool = False) -> str:
+    if diff:
+        return make_key(txt, user_lang, "diff", route_for("schreiben_diff").model, fingerprint(SYSTEM_DIFF))
+    return make_key(txt, user_lang, route_for("schreiben_text").model, fingerprint(SYSTEM_TEXT))
+
+_SPACES = re.compile(r"[ \t\u00a0]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+def _normalize_text(s: str) -> str:
+    """
+    NFC + یکسان‌سازی فاصله‌ها و خط‌های خالی. حروف بزرگ/کوچک و علائم دست نمی‌خورند
+    (برای تصحیح مهم‌اند)؛ فقط اختلاف‌هایی که پاسخ را عوض نمی‌کنند حذف می‌شوند.
+    """
+    s = unicodedata.normalize("NFC", s or "").replace("\r\n", "\n").replace("\r", "\n")
+    s = "\n".join(_SPACES.sub(" ", line).strip() for line in s.split("\n"))
+    return _BLANK_LINES.sub("\n\n", s).strip()
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…:;])\s+")
+
+def _split_long(piece: str, limit: int) -> List[str]:
+    """پاراگراف بلندتر از limit: روی مرز جمله، و جملهٔ خیلی بلند روی فاصله."""
+    out: List[str] = []
+    cur = ""
+    for sent in _SENTENCE_END.split(piece):
+        while len(sent) > limit:
+            cut = sent.rfind(" ", 0, limit)
+            cut = cut if cut > 0 else limit
+            if cur:
+                out.append(cur)
+                cur = ""
+            out.append(sent[:cut].strip())
+            sent = sent[cut:].strip()
+        if cur and len(cur) + 1 + len(sent) > limit:
+            out.append(cur)
+            cur = sent
+        else:
+            cur = f"{cur} {sent}" if cur else sent
+    if cur:
+        out.append(cur)
+    return out
+
+def _split_chunks(text: str, limit: int = MAX_INPUT_CHARS) -> List[str]:
+    """
+    بخش‌بندی برای تصحیح موازی: پاراگراف‌ها تا سقف limit کنار هم می‌مانند؛
+    پاراگراف بلندتر روی مرز جمله بریده می‌شود. ترتیب حفظ می‌شود.
+    """
+    chunks: List[str] = []
+    cur = ""
+    for par in (p.strip() for p in text.split("\n\n")):
+        if not par:
+            continue
+        pieces = [par] if len(par) <= limit else _split_long(par, limit)
+        for piece in pieces:
+            if cur and len(cur) + 2 + len(piece) > limit:
+                chunks.append(cur)
+                cur = piece
+            else:
+                cur = f"{cur}\n\n{piece}" if cur else piece
+    if cur:
+        chunks.append(cur)
+    return chunks
 
 def _next_actions_kb(lang: str) -> InlineKeyboardMarkup:
     again = "✍️ ارسال متن بعدی" if lang == "fa" else "✍️ Nächsten Text senden"
@@ -78,6 +178,267 @@ async def _answer_text(update: Update, context: ContextTypes.DEFAULT_TYPE, text:
     for i in range(0, len(text), TG_LIMIT):
         await safe_send(update, context, text[i:i+TG_LIMIT], parse_mode=parse_mode)
 
+def _parse_diff_reply(raw: str) -> Optional[Dict[str, Any]]:
+    """JSON حالت diff؛ اگر معتبر نبود None (و متن خام نمایش داده می‌شود)."""
+    raw = (raw or "").strip()
+    m = re.search(r"\{[\s\S]*\}", raw)
+    try:
+        data = json.loads(m.group(0) if m else raw)
+    except Exception:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("corrected"), str):
+        return None
+    hints = [h for h in (data.get("hints") or []) if isinstance(h, dict)]
+    return {"corrected": data["corrected"].strip(), "hints": hints[:3]}
+
+def _render_diff(original: str, data: Dict[str, Any], lang: str) -> List[str]:
+    """بلوک‌های HTML: diff هر پاراگراف، متن تمیز، نکته‌ها."""
+    corrected = data["corrected"]
+    if original.strip() == corrected.strip():
+        ok = "✅ متن درست است؛ اصلاحی لازم نبود." if lang == "fa" else "✅ Der Text ist korrekt – keine Änderungen nötig."
+        return [ok]
+    legend = "<s>خط‌خورده</s> = حذف · <b>پررنگ</b> = جدید" if lang == "fa" else "<s>durchgestrichen</s> = entfernt · <b>fett</b> = neu"
+    blocks = [f"✍️ <b>Korrektur</b>\n<i>{legend}</i>"]
+    src_pars, dst_pars = original.split("\n\n"), corrected.split("\n\n")
+    if len(src_pars) == len(dst_pars):
+        blocks += [render_diff_html(a, b) for a, b in zip(src_pars, dst_pars)]
+    else:
+        blocks.append(render_diff_html(original, corrected))
+    blocks.append("📝 <b>Verbesserter Text</b>\n" + html.escape(corrected, quote=False))
+    lines = []
+    for h in data.get("hints") or []:
+        code = str(h.get("code") or "").upper()
+        de, fa = HINT_CODES.get(code, (code or "Hinweis", ""))
+        label = f"<b>{html.escape(de)}</b>" + (f" ({fa})" if lang == "fa" and fa else "")
+        note = html.escape(str(h.get("note") or "").strip(), quote=False)
+        lines.append(f"• {label}" + (f": {note}" if note else ""))
+    if lines:
+        blocks.append("💡 <b>Hinweise</b>\n" + "\n".join(lines))
+    return blocks
+
+def _text_messages(txt: str, user_lang: str) -> List[Dict[str, str]]:
+    prompt = (
+        f"Interface language: {user_lang}.\n"
+        f"Correct and improve this German text in exam style (B1/B2), "
+        f"then provide up to 3 Hinweise and a Persian translation:\n"
+        f"{txt}"
+    )
+    return [
+        {"role": "system", "content": SYSTEM_TEXT},
+        {"role": "user", "content": prompt}
+    ]
+
+async def _correct_chunk(txt: str, user_lang: str, chat_id: int, diff_mode: bool):
+    """
+    تصحیح یک متن (یا یک بخش از متن بلند) بدون استریم، با کش محتوایی.
+    خروجی: dict در حالت diff، وگرنه متن Markdown (یا متن خام اگر JSON نامعتبر بود).
+    """
+    kind = "diff" if diff_mode else "text"
+    key = _text_cache_key(txt, user_lang, diff=diff_mode)
+    cached = _text_cache.get(key)
+    if cached:
+        metrics.inc("schreiben_cache_hits_total", kind=kind)
+        return cached
+    metrics.inc("schreiben_cache_misses_total", kind=kind)
+
+    # پاسخ مدل جایگزین (circuit مدل اصلی باز) کش نمی‌شود
+    served: Dict[str, Any] = {}
+    if not diff_mode:
+        # مدل/temperature/max_tokens/مهلت از مسیر feature (utils/ai_routes.py)
+        answer = await chat_completion(_text_messages(txt, user_lang), chat_id=chat_id,
+                                       priority=PRIORITY_SCHREIBEN, feature="schreiben_text", served=served)
+        if answer and not served.get("fallback"):
+            _text_cache.set(key, answer)
+        return answer
+
+    raw = await chat_completion(
+        [{"role": "system", "content": SYSTEM_DIFF}, {"role": "user", "content": txt}],
+        chat_id=chat_id, priority=PRIORITY_SCHREIBEN, feature="schreiben_diff", served=served,
+    )
+    data = _parse_diff_reply(raw)
+    if data is None:
+        log.warning("Schreiben diff: non-JSON response; sending raw text.")
+        return raw
+    if not served.get("fallback"):
+        _text_cache.set(key, data)
+    metrics.observe("schreiben_diff_changed_ratio", changed_ratio(txt, data["corrected"]))
+    return data
+
+async def _send_result(update: Update, context: ContextTypes.DEFAULT_TYPE, original: str, result,
+                       user_lang: str, title: Optional[str] = None, last: bool = True):
+    """نمایش نتیجهٔ _correct_chunk؛ فقط آخرین بخش دکمه‌های ادامه را می‌گیرد."""
+    if isinstance(result, dict):
+        blocks = _render_diff(original, result, user_lang)
+        if title:
+            blocks.insert(0, f"📄 <b>{html.escape(title)}</b>")
+        parts = pack_blocks(blocks, TG_LIMIT)
+        for i, part in enumerate(parts):
+            kb = _next_actions_kb(user_lang) if last and i == len(parts) - 1 else None
+            await safe_send(update, context, part, parse_mode="HTML", reply_markup=kb)
+        return
+    text = result or "متنی برای نمایش دریافت نشد. لطفاً دوباره ارسال کن."
+    # متن خامِ حالت diff (JSON نامعتبر) بدون parse_mode، تا Markdown ناقص پیام را نیندازد
+    markdown = SCHREIBEN_MODE != "diff"
+    if title:
+        text = (f"*{title}*\n\n" if markdown else f"{title}\n\n") + text
+    await _answer_text(update, context, text, parse_mode="Markdown" if markdown else None)
+    if last:
+        await safe_send(update, context, "ادامه می‌دیم؟", reply_markup=_next_actions_kb(user_lang))
+
+async def _correct_long(update: Update, context: ContextTypes.DEFAULT_TYPE, txt: str,
+                        user_lang: str, diff_mode: bool):
+    """
+    متن بلند: بخش‌بندی روی مرز پاراگراف/جمله، تصحیح موازی با سقف SCHREIBEN_PARALLEL،
+    و ارسال به ترتیب؛ هر بخش به محض آماده شدن خودش و بخش‌های قبلی فرستاده می‌شود.
+    """
+    chat_id = update.effective_chat.id
+    clipped = len(txt) > SCHREIBEN_MAX_CHARS
+    if clipped:
+        txt = txt[:SCHREIBEN_MAX_CHARS]
+        cut = txt.rfind("\n\n")
+        txt = txt[:cut] if cut > SCHREIBEN_MAX_CHARS // 2 else txt
+    chunks = _split_chunks(txt)
+    n = len(chunks)
+    metrics.observe("schreiben_chunks", n)
+
+    if user_lang == "fa":
+        note = f"⏳ متن طولانی است؛ در {n} بخش تصحیح می‌شود و هر بخش به‌ترتیب می‌رسد."
+        if clipped:
+            note += f"\n⚠️ فقط {SCHREIBEN_MAX_CHARS} نویسهٔ اول بررسی می‌شود."
+    else:
+        note = f"⏳ Langer Text: Korrektur in {n} Teilen, die nacheinander kommen."
+        if clipped:
+            note += f"\n⚠️ Nur die ersten {SCHREIBEN_MAX_CHARS} Zeichen werden korrigiert."
+    await safe_send(update, context, note, parse_mode=None)
+
+    sem = asyncio.Semaphore(max(1, SCHREIBEN_PARALLEL))
+
+    async def run(chunk: str):
+        async with sem:
+            return await _correct_chunk(chunk, user_lang, chat_id, diff_mode)
+
+    tasks = [asyncio.ensure_future(run(c)) for c in chunks]
+    try:
+        for i, (chunk, task) in enumerate(zip(chunks, tasks), 1):
+            title = f"Teil {i}/{n}"
+            try:
+                result = await task
+            except CircuitOpenError:
+                raise
+            except Exception:
+                # یک بخش ناموفق بقیه را از بین نمی‌برد
+                log.exception("Schreiben chunk %d/%d failed", i, n)
+                failed = ("⚠️ این بخش تصحیح نشد؛ می‌توانی همین بخش را جداگانه بفرستی." if user_lang == "fa"
+                          else "⚠️ Dieser Teil konnte nicht korrigiert werden; sende ihn bitte einzeln.")
+                await _answer_text(update, context, f"{title}\n\n{failed}", parse_mode=None)
+                if i == n:
+                    await safe_send(update, context, "ادامه می‌دیم؟", reply_markup=_next_actions_kb(user_lang))
+                continue
+            await _send_result(update, context, chunk, result, user_lang, title=title, last=(i == n))
+    finally:
+        for t in tasks:
+            t.cancel()
+
+async def _edit(msg: Message, text: str, parse_mode: Optional[str] = None,
+                reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """ویرایش امن: «not modified» نادیده؛ اگر Markdown نامعتبر بود، متن ساده."""
+    try:
+        # ویرایش‌های استریم هم از outbox می‌گذرند (سقف هر چت و کل ربات)
+        await outbox.send(msg.chat_id, lambda: msg.edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup))
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return
+        if not parse_mode:
+            raise
+        # متن ساده ممکن است همان متنی باشد که الان در پیام است (بخش‌های بسته‌شده)
+        try:
+            await outbox.send(msg.chat_id, lambda: msg.edit_text(text, reply_markup=reply_markup))
+        except BadRequest as e2:
+            if "not modified" not in str(e2).lower():
+                raise
+
+def _split_point(text: str, limit: int) -> int:
+    """نقطهٔ برش ترجیحاً روی خط‌جدید/فاصله، قبل از limit."""
+    if len(text) <= limit:
+        return len(text)
+    cut = text.rfind("\n", 0, limit)
+    if cut < limit // 2:
+        cut = text.rfind(" ", 0, limit)
+    return cut if cut > 0 else limit
+
+_FAILED_MSG_FA = "⚠️ خطایی در سرویس تصحیح رخ داد. دوباره تلاش کن؛ اگر ادامه داشت خبر بده."
+_FAILED_MSG_DE = "⚠️ Bei der Korrektur ist ein Fehler aufgetreten. Bitte erneut versuchen."
+
+async def _stream_failed(update: Update, context: ContextTypes.DEFAULT_TYPE, current: Message,
+                         partial: str, err: str, user_lang: str):
+    """پایان استریم ناموفق: خطا در همان پیام جاری؛ اگر جا نبود، متن نیمه‌کاره می‌ماند و خطا جدا می‌آید."""
+    kb = _next_actions_kb(user_lang)
+    if not partial:
+        await _edit(current, err, reply_markup=kb)
+    elif len(partial) + len(err) + 2 <= TG_LIMIT:
+        await _edit(current, f"{partial}\n\n{err}", reply_markup=kb)
+    else:
+        await _edit(current, partial)
+        await safe_send(update, context, err, reply_markup=kb)
+
+async def _stream_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, messages,
+                         user_lang: str, feature: str,
+                         served: Optional[Dict[str, Any]] = None) -> str:
+    """
+    پاسخ مدل را استریم می‌کند: یک پیام موقت می‌فرستد و آن را حداکثر هر
+    SCHREIBEN_EDIT_INTERVAL ثانیه ویرایش می‌کند. از TG_LIMIT که گذشت، پیام فعلی
+    بسته می‌شود و ادامه در پیام جدید می‌آید. در پایان هر بخش با Markdown نهایی
+    می‌شود و آخرین پیام دکمه‌های _next_actions_kb را می‌گیرد.
+    """
+    chat_id = update.effective_chat.id
+    placeholder = "⏳ در حال تصحیح…" if user_lang == "fa" else "⏳ Korrektur läuft…"
+    current = await outbox.send(chat_id, lambda: context.bot.send_message(chat_id=chat_id, text=placeholder))
+
+    done_parts = []        # (message, text) بخش‌های بسته‌شده
+    buf = ""               # متن بخش جاری
+    shown = ""
+    last_edit = time.monotonic()
+
+    try:
+        async for delta in stream_chat_completion(messages, chat_id=chat_id, priority=PRIORITY_SCHREIBEN,
+                                                  feature=feature, served=served):
+            buf += delta
+            # سرریز: بخش جاری را ببند و پیام تازه بساز
+            while len(buf) > _SEGMENT_LIMIT:
+                cut = _split_point(buf, _SEGMENT_LIMIT)
+                head, buf = buf[:cut].rstrip(), buf[cut:].lstrip()
+                await _edit(current, head)
+                done_parts.append((current, head))
+                first = buf or "…"
+                current = await outbox.send(chat_id, lambda: context.bot.send_message(chat_id=chat_id, text=first))
+                shown = buf
+                last_edit = time.monotonic()
+            if buf != shown and time.monotonic() - last_edit >= SCHREIBEN_EDIT_INTERVAL:
+                await _edit(current, buf + " ▌")
+                shown = buf
+                last_edit = time.monotonic()
+    except Exception as e:
+        # پیام موقت/متن نیمه‌کاره همان‌جا به پیام خطا تبدیل می‌شود (بدون «▌» و با دکمه‌ها)
+        if isinstance(e, CircuitOpenError):
+            log.warning("Schreiben stream skipped (AI circuit open)")
+            err = circuit_message(user_lang)
+        else:
+            log.exception("Schreiben stream failed")
+            err = _FAILED_MSG_FA if user_lang == "fa" else _FAILED_MSG_DE
+        await _stream_failed(update, context, current, buf.strip(), err, user_lang)
+        return ""
+
+    buf = buf.strip()
+    if not buf and not done_parts:
+        await _edit(current, "متنی برای نمایش دریافت نشد. لطفاً دوباره ارسال کن.",
+                    reply_markup=_next_actions_kb(user_lang))
+        return ""
+    # نهایی‌سازی با Markdown (در صورت خطای parse، متن ساده)
+    for msg, text in done_parts:
+        await _edit(msg, text, parse_mode="Markdown")
+    await _edit(current, buf or "…", parse_mode="Markdown", reply_markup=_next_actions_kb(user_lang))
+    return "\n".join([t for _, t in done_parts] + [buf])
+
 @guard()
 async def schreiben_correct(update: Update, context: ContextTypes.DEFAULT_TYPE):
     touch_user(update.effective_chat.id, "schreiben")
@@ -98,51 +459,78 @@ async def schreiben_correct(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         if has_photo:
-            # دریافت URL فایل تلگرام
+            photo = pick_photo(msg.photo)  # کوچک‌ترین سایزِ هنوز خوانا
+            cache, kind = _image_cache, "image"
+            cache_key = _image_cache_key(photo.file_unique_id, text_input, user_lang)
+        else:
+            txt = _normalize_text(text_input)
+            diff_mode = SCHREIBEN_MODE == "diff"
+            if len(txt) > MAX_INPUT_CHARS:
+                await _correct_long(update, context, txt, user_lang, diff_mode)
+                return
+            if diff_mode or not SCHREIBEN_STREAM:
+                await _send_result(update, context, txt, await _correct_chunk(txt, user_lang, chat_id, diff_mode), user_lang)
+                return
+            cache, kind = _text_cache, "text"
+            cache_key = _text_cache_key(txt, user_lang)
+
+        cached = cache.get(cache_key)
+        if cached:
+            # همین ورودی قبلاً تصحیح شده: فوری و بدون مصرف سهمیهٔ مدل
+            metrics.inc("schreiben_cache_hits_total", kind=kind)
+            await _answer_text(update, context, cached, parse_mode="Markdown")
+            await safe_send(update, context, "ادامه می‌دیم؟", reply_markup=_next_actions_kb(user_lang))
+            return
+        metrics.inc("schreiben_cache_misses_total", kind=kind)
+
+        if has_photo:
+            # دانلود با استخر HTTP ربات، کوچک‌سازی و ارسال inline (base64)
             try:
-                photo = msg.photo[-1]  # بزرگ‌ترین سایز
-                file = await context.bot.get_file(photo.file_id)
-                if not (TELEGRAM_BOT_TOKEN and getattr(file, "file_path", None)):
-                    raise RuntimeError("Telegram file token/path not available")
-                image_url = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file.file_path}"
+                image_url = await photo_data_url(context.bot, photo)
             except Exception:
-                log.exception("Failed to resolve Telegram file URL")
+                log.exception("Failed to download/prepare Telegram photo")
                 await safe_send(update, context, "⚠️ نتونستم عکس رو بگیرم. دوباره بفرست یا یک متن بنویس.")
                 return
 
             caption_hint = f"\nUser caption: {text_input}" if text_input else ""
             user_content = [
-                {"type": "input_text", "text": f"Interface language: {user_lang}.{caption_hint}\nExtract and correct."},
-                {"type": "input_image", "image_url": image_url}
+                {"type": "text", "text": f"Interface language: {user_lang}.{caption_hint}\nExtract and correct."},
+                {"type": "image_url", "image_url": {"url": image_url, "detail": "high"}}
             ]
             messages = [
                 {"role": "system", "content": SYSTEM_IMAGE},
                 {"role": "user", "content": user_content}
             ]
-            answer = _retry_chat(messages, temperature=0.2)
+            feature = "schreiben_image"
         else:
-            txt = _truncate(text_input, MAX_INPUT_CHARS)
-            prompt = (
-                f"Interface language: {user_lang}.\n"
-                f"Correct and improve this German text in exam style (B1/B2), "
-                f"then provide up to 3 Hinweise and a Persian translation:\n"
-                f"{txt}"
-            )
-            messages = [
-                {"role": "system", "content": SYSTEM_TEXT},
-                {"role": "user", "content": prompt}
-            ]
-            answer = _retry_chat(messages, temperature=0.3)
+            messages = _text_messages(txt, user_lang)
+            feature = "schreiben_text"
+
+        # پاسخ مدل جایگزین (circuit مدل اصلی باز) کش نمی‌شود
+        served: Dict[str, Any] = {}
+        if SCHREIBEN_STREAM:
+            answer = await _stream_answer(update, context, messages, user_lang, feature, served=served)
+            if answer.strip() and not served.get("fallback"):
+                cache.set(cache_key, answer)
+            return
 
+        # مدل/temperature/max_tokens/مهلت از مسیر feature (utils/ai_routes.py)
+        answer = await chat_completion(messages, chat_id=chat_id, priority=PRIORITY_SCHREIBEN, feature=feature,
+                                       served=served)
+        if answer and not served.get("fallback"):
+            cache.set(cache_key, answer)
         if not answer:
             answer = "متنی برای نمایش دریافت نشد. لطفاً دوباره ارسال کن."
 
         await _answer_text(update, context, answer, parse_mode="Markdown")
         await safe_send(update, context, "ادامه می‌دیم؟", reply_markup=_next_actions_kb(user_lang))
 
+    except CircuitOpenError:
+        log.warning("Schreiben skipped (AI circuit open)")
+        await safe_send(update, context, circuit_message(user_lang))
     except Exception:
         log.exception("Schreiben failed")
-        await safe_send(update, context, "⚠️ خطایی در سرویس تصحیح رخ داد. دوباره تلاش کن؛ اگر ادامه داشت خبر بده.")
+        await safe_send(update, context, _FAILED_MSG_FA if user_lang == "fa" else _FAILED_MSG_DE)
 
 @guard()
 async def schreiben_again(update: Update, context: ContextTypes.DEFAULT_TYPE):
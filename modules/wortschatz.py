@@ -7,9 +7,9 @@ from typing import List, Dict, Tuple, Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ApplicationHandlerStop
 
-from utils.memory import get_user, set_user
+from utils.memory import get_user, update_user
 from utils.handler_guard import guard
-from utils.safe_telegram import safe_send
+from utils.safe_telegram import safe_send, safe_edit, QUIZ_EDIT_IN_PLACE
 from utils.session import touch_user
 
 log = logging.getLogger("Wortschatz")
@@ -75,12 +75,12 @@ def _get_srs(user) -> Dict[str, Dict]:
     # Map: str(id) -> {"box": int, "due": "YYYY-MM-DD"}
     return user.get("srs", {}) or {}
 
-def _save_srs(chat_id: int, srs: Dict[str, Dict]):
+def _save_srs(user: Dict, srs: Dict[str, Dict]):
     # پاک‌سازی بیش از حد
     if len(srs) > 2000:
         keys = list(srs.keys())[-2000:]
         srs = {k: srs[k] for k in keys}
-    set_user(chat_id, "srs", srs)
+    user["srs"] = srs
 
 def _word_by_id(wid: int) -> Optional[Dict]:
     for w in WORDS:
@@ -104,14 +104,13 @@ def _due_words(user, on_date: dt.date) -> List[Dict]:
             continue
     return due
 
-def _mark_seen(chat_id: int, wid: int):
-    u = get_user(chat_id)
-    seen = list(_seen_set(u))
+def _mark_seen(user: Dict, wid: int):
+    seen = list(_seen_set(user))
     if wid not in seen:
         seen.append(wid)
         if len(seen) > 2000:
             seen = seen[-2000:]
-        set_user(chat_id, "seen_words", seen)
+        user["seen_words"] = seen
 
 def _schedule_next_due(curr_box: int) -> Tuple[int, str]:
     nxt_box = min(curr_box + 1, len(SRS_STEPS) - 1)
@@ -160,21 +159,8 @@ def _kb_finish(lang: str) -> InlineKeyboardMarkup:
         [InlineKeyboardButton(back,  callback_data="menu:back")],
     ])
 
-# =========================
-# نمایش روزانه + آماده‌سازی کوییز
-# =========================
-@guard()
-async def vocab_daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """
-    1) لیست واژگان روز (مرور موعددار + جدید بدون تکرار)
-    2) ذخیرهٔ جلسه برای کوییز
-    3) دکمهٔ «شروع کوییز» + «بازگشت»
-    """
-    touch_user(update.effective_chat.id, "wortschatz")
-
-    chat_id = update.effective_chat.id
-    user = get_user(chat_id)
-    lang = user.get("language", "fa")
+def _pick_daily(user) -> Tuple[List[Dict], int, int]:
+    """انتخاب واژگان امروز: اول موعددارهای SRS، بعد جدیدهای سطح‌محور."""
     level = _user_level(user)
     seen  = _seen_set(user)
 
@@ -206,6 +192,28 @@ async def vocab_daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     due_n = sum(1 for w in picked if w in due)
     new_n = len(picked) - due_n
+    return picked, due_n, new_n
+
+# =========================
+# نمایش روزانه + آماده‌سازی کوییز
+# =========================
+@guard()
+async def vocab_daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    1) لیست واژگان روز (مرور موعددار + جدید بدون تکرار)
+    2) ذخیرهٔ جلسه برای کوییز
+    3) دکمهٔ «شروع کوییز» + «بازگشت»
+    """
+    chat_id = update.effective_chat.id
+    with update_user(chat_id) as user:
+        touch_user(chat_id, "wortschatz", user=user)
+        picked, due_n, new_n = _pick_daily(user)
+
+        # پیشرفت شمارشی (صرفاً نمایش/رِکوردر ساده)
+        progress = user.get("progress", {})
+        progress["wortschatz"] = progress.get("wortschatz", 0) + len(picked)
+        user["progress"] = progress
+    lang = user.get("language", "fa")
 
     # متن
     header = "📚 واژگان امروز:" if lang == "fa" else "📚 Heutiger Wortschatz:"
@@ -217,11 +225,6 @@ async def vocab_daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ذخیرهٔ جلسهٔ امروز
     context.user_data["vocab_today"] = [w["id"] for w in picked]
 
-    # پیشرفت شمارشی (صرفاً نمایش/رِکوردر ساده)
-    progress = user.get("progress", {})
-    progress["wortschatz"] = progress.get("wortschatz", 0) + len(picked)
-    set_user(chat_id, "progress", progress)
-
     await safe_send(update, context, "\n".join(lines), reply_markup=_kb_start_quiz(lang, due_n, new_n))
 
 # =========================
@@ -294,8 +297,6 @@ async def vocab_quiz_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @guard()
 async def vocab_quiz_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """کال‌بک پاسخ کوییز: pattern → vocab:quiz:opt:<0-3>"""
-    touch_user(update.effective_chat.id, "wortschatz")
-
     cq = update.callback_query
     if not cq or not cq.data or not cq.data.startswith("vocab:quiz:opt:"):
         return
@@ -315,22 +316,26 @@ async def vocab_quiz_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     correct = (chosen == q["ans_idx"])
     chat_id = update.effective_chat.id
-    u = get_user(chat_id)
-    lang = u.get("language", "fa")
 
-    # به‌روزرسانی SRS
-    srs = _get_srs(u)
-    key = str(q["id"])
-    box = int(srs.get(key, {}).get("box", 0))
+    # touch + SRS + seen در یک تراکنش (یک نوشتن)
+    with update_user(chat_id) as u:
+        touch_user(chat_id, "wortschatz", user=u)
+        lang = u.get("language", "fa")
+
+        # به‌روزرسانی SRS
+        srs = _get_srs(u)
+        key = str(q["id"])
+        box = int(srs.get(key, {}).get("box", 0))
+        if correct:
+            nbox, due = _schedule_next_due(box)
+            srs[key] = {"box": nbox, "due": due}
+            _mark_seen(u, q["id"])
+        else:
+            nbox, due = _demote_box(box)
+            srs[key] = {"box": nbox, "due": due}
+        _save_srs(u, srs)
     if correct:
         state["score"] = int(state.get("score", 0)) + 1
-        nbox, due = _schedule_next_due(box)
-        srs[key] = {"box": nbox, "due": due}
-        _mark_seen(chat_id, q["id"])
-    else:
-        nbox, due = _demote_box(box)
-        srs[key] = {"box": nbox, "due": due}
-    _save_srs(chat_id, srs)
 
     # بازخورد کوتاه
     word = _word_by_id(q["id"])
@@ -340,13 +345,13 @@ async def vocab_quiz_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         corr_txt = word["de"]; pair_txt = f"{word['fa']} → {word['de']}"
 
     fb = ("✅ درست گفتی!" if correct else f"❌ پاسخ درست: *{corr_txt}*") + f"\n↔️ {pair_txt}"
-    await safe_send(update, context, fb, parse_mode="Markdown")
 
     # سؤال بعدی/اتمام
     state["i"] = i + 1
     if state["i"] < len(qs):
         nxt = qs[state["i"]]
-        await safe_send(update, context, f"🧠 سوال {state['i']+1}/{len(qs)}\n\n{nxt['q']}", reply_markup=_kb_options(nxt["options"], lang))
+        msg = f"🧠 سوال {state['i']+1}/{len(qs)}\n\n{nxt['q']}"
+        kb = _kb_options(nxt["options"], lang)
     else:
         total = len(qs)
         score = state["score"]
@@ -355,7 +360,14 @@ async def vocab_quiz_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         msg = (f"🏁 پایان کوییز!\nامتیاز: {score} از {total}\nمی‌خوای یک بستهٔ دیگر هم تمرین کنی؟")
         if lang != "fa":
             msg = f"🏁 Quiz beendet!\nPunkte: {score} / {total}\nLust auf ein weiteres Paket (Training)?"
-        await safe_send(update, context, msg, reply_markup=_kb_finish(lang))
+        kb = _kb_finish(lang)
+
+    if QUIZ_EDIT_IN_PLACE:
+        # بازخورد + سؤال بعدی در یک ویرایش همان پیام (دکمه‌های قبلی هم حذف می‌شوند)
+        await safe_edit(update, context, f"{fb}\n\n{msg}", parse_mode="Markdown", reply_markup=kb)
+    else:
+        await safe_send(update, context, fb, parse_mode="Markdown")
+        await safe_send(update, context, msg, reply_markup=kb)
 
     raise ApplicationHandlerStop
 
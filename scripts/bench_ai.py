@@ -0,0 +1,105 @@
+# scripts/bench_ai.py
+"""
+بنچمارک توان عملیاتی لایهٔ مدل (ai_client + scheduler + ریترای) روی سرور آزمایشی.
+
+    python -m scripts.mock_openai --rate-429 0.05 --rate-5xx 0.02 &
+    python -m scripts.bench_ai --requests 500 --concurrency 100
+    python -m scripts.bench_ai --mix dictionary=6,grammar=2,schreiben_text=2 --stream
+
+به‌طور پیش‌فرض به http://127.0.0.1:8089/v1 وصل می‌شود؛ در پایان توان عملیاتی،
+صدک‌های latency و جمع‌بندی مصرف (همان /stats) چاپ می‌شود.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+
+log = logging.getLogger("BenchAI")
+
+_SYSTEMS = {
+    "dictionary": "You are a precise DE↔FA lexicographer. Always respond as strict, valid JSON.",
+    "grammar": "You are a patient, structured German grammar tutor.",
+    "schreiben_text": "You are a precise German teacher (B1/B2).",
+}
+
+def _parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Throughput benchmark for the AI client against a mock server.")
+    ap.add_argument("--base-url", default="http://127.0.0.1:8089/v1")
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=50, help="simulated users in flight")
+    ap.add_argument("--chats", type=int, default=1000, help="distinct chat_ids (per-chat caps apply)")
+    ap.add_argument("--mix", default="dictionary=6,grammar=2,schreiben_text=2", help="feature=weight,...")
+    ap.add_argument("--stream", action="store_true", help="use streaming for schreiben_text")
+    ap.add_argument("--duplicates", type=float, default=0.0, help="fraction of identical prompts (single-flight)")
+    return ap.parse_args(argv)
+
+def _parse_mix(spec: str):
+    out = []
+    for part in spec.split(","):
+        name, _, w = part.partition("=")
+        if name.strip():
+            out.append((name.strip(), float(w or 1)))
+    return out
+
+async def _run(args) -> int:
+    from utils import metrics
+    from utils.ai_client import chat_completion, stream_chat_completion, close_client, PRIORITY_SCHREIBEN
+    from utils.ai_usage import format_summary
+
+    mix = _parse_mix(args.mix)
+    names, weights = [n for n, _ in mix], [w for _, w in mix]
+    sem = asyncio.Semaphore(max(1, args.concurrency))
+    latencies, failures = [], {}
+
+    async def one(i: int):
+        feature = random.choices(names, weights)[0]
+        text = "Vereinbarung" if random.random() < args.duplicates else f"query #{i}"
+        messages = [{"role": "system", "content": _SYSTEMS.get(feature, "")},
+                    {"role": "user", "content": text}]
+        chat_id = random.randrange(args.chats)
+        async with sem:
+            t0 = time.monotonic()
+            try:
+                if args.stream and feature.startswith("schreiben"):
+                    async for _ in stream_chat_completion(messages, chat_id=chat_id,
+                                                          priority=PRIORITY_SCHREIBEN, feature=feature):
+                        pass
+                else:
+                    await chat_completion(messages, chat_id=chat_id, feature=feature)
+                latencies.append(time.monotonic() - t0)
+            except Exception as e:
+                failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+
+    t_start = time.monotonic()
+    try:
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+    finally:
+        await close_client()
+    elapsed = time.monotonic() - t_start
+
+    ok = len(latencies)
+    print(f"\n{ok}/{args.requests} ok in {elapsed:.1f}s → {ok / elapsed:.1f} req/s (concurrency {args.concurrency})")
+    if latencies:
+        print("end-to-end latency: p50={:.2f}s p95={:.2f}s p99={:.2f}s max={:.2f}s".format(
+            metrics.percentile(latencies, 0.50), metrics.percentile(latencies, 0.95),
+            metrics.percentile(latencies, 0.99), max(latencies)))
+    if failures:
+        print("failures:", ", ".join(f"{k}={v}" for k, v in sorted(failures.items())))
+    print()
+    print(format_summary())
+    print()
+    print(metrics.format_snapshot(skip_prefixes=("ai_tokens", "ai_cost", "ai_requests", "ai_latency")))
+    return 1 if failures else 0
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    args = _parse_args(argv)
+    os.environ["OPENAI_BASE_URL"] = args.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock-key")
+    return asyncio.run(_run(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
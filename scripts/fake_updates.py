@@ -0,0 +1,84 @@
+# scripts/fake_updates.py
+"""
+ارسال آپدیت‌های ساختگی تلگرام به webhook محلی (BOT_MODE=webhook، WEBHOOK_URL خالی).
+
+    python -m scripts.fake_updates --count 500 --concurrency 50 --chats 100
+    python -m scripts.fake_updates --text "/grammar" --secret "$WEBHOOK_SECRET"
+
+کدهای پاسخ (200/403/503/...) و نرخ پذیرش چاپ می‌شوند؛ برای تست اعتبارسنجی
+secret، پر شدن صف (503) و زمان پاسخ سرور. پاسخ ربات به chat_idهای ساختگی
+در لاگ به‌صورت خطای ارسال دیده می‌شود که طبیعی است.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+_ids = itertools.count(int(time.time()))
+
+def fake_message(chat_id: int, text: str) -> dict:
+    return {
+        "update_id": next(_ids),
+        "message": {
+            "message_id": random.randrange(1, 1 << 30),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Test"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test", "language_code": "de"},
+            "text": text,
+            **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]}
+               if text.startswith("/") else {}),
+        },
+    }
+
+def _parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="POST fake Telegram updates to the local webhook.")
+    ap.add_argument("--url", default=f"http://127.0.0.1:{os.getenv('WEBHOOK_PORT', '8443')}/"
+                                     f"{os.getenv('WEBHOOK_PATH', 'telegram').strip('/')}")
+    ap.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    ap.add_argument("--count", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--chats", type=int, default=50, help="distinct fake chat_ids")
+    ap.add_argument("--text", default="/menu", help="message text (command or free text)")
+    return ap.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    headers = {"Content-Type": "application/json"}
+    if args.secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = args.secret
+
+    def post(_):
+        body = json.dumps(fake_message(random.randrange(1, args.chats + 1), args.text)).encode("utf-8")
+        req = urllib.request.Request(args.url, data=body, headers=headers, method="POST")
+        t0 = time.monotonic()
+        try:
+            with urllib.request.urlopen(req, timeout=10) as r:
+                status = r.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception as e:
+            status = type(e).__name__
+        return status, time.monotonic() - t0
+
+    t_start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        results = list(pool.map(post, range(args.count)))
+    elapsed = time.monotonic() - t_start
+
+    codes = {}
+    for status, _ in results:
+        codes[status] = codes.get(status, 0) + 1
+    lat = sorted(t for _, t in results)
+    print(f"{args.count} updates in {elapsed:.2f}s → {args.count / elapsed:.0f}/s")
+    print("status:", ", ".join(f"{k}={v}" for k, v in sorted(codes.items(), key=str)))
+    print(f"response time: p50={lat[len(lat) // 2] * 1000:.1f}ms p99={lat[int(len(lat) * 0.99) - 1] * 1000:.1f}ms")
+    return 0 if set(codes) <= {200} else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+# scripts/mock_openai.py
+"""
+سرور آزمایشی سازگار با endpoint چت OpenAI (فقط کتابخانهٔ استاندارد)، برای تست بار
+و تست ریترای/تایم‌اوت بدون هزینهٔ واقعی.
+
+    python -m scripts.mock_openai                                  # 127.0.0.1:8089
+    python -m scripts.mock_openai --latency lognormal:0.8,0.5 --rate-429 0.05 --rate-5xx 0.02
+    python -m scripts.mock_openai --ttft uniform:0.3,1.2 --token-delay 0.02 --rate-hang 0.01
+
+ربات یا اسکریپت‌ها را با این تنظیمات به آن وصل کنید:
+
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1  OPENAI_API_KEY=mock-key
+
+پاسخ‌ها بر اساس پرامپت سیستم انتخاب می‌شوند: JSON دیکشنری، صفحهٔ گرامر، تصحیح
+Schreiben (متن/عکس)؛ probe‌های circuit breaker (max_tokens=1) «pong» می‌گیرند.
+GET /stats شمارنده‌های سرور و POST /config تغییر تنظیمات در حین اجرا را فراهم می‌کند.
+
+توزیع‌های latency: fixed:S | uniform:A,B | normal:MEAN,SD | lognormal:MEDIAN,SIGMA | exp:MEAN
+"""
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger("MockOpenAI")
+
+
+# ---------- latency distributions ----------
+def parse_dist(spec: str):
+    """'uniform:0.2,1.5' → تابعی که یک نمونه (ثانیه، نامنفی) برمی‌گرداند."""
+    kind, _, args = (spec or "fixed:0").partition(":")
+    p = [float(x) for x in args.split(",") if x.strip()] or [0.0]
+    kind = kind.strip().lower()
+    if kind == "fixed":
+        fn = lambda: p[0]
+    elif kind == "uniform":
+        fn = lambda: random.uniform(p[0], p[1])
+    elif kind == "normal":
+        fn = lambda: random.gauss(p[0], p[1])
+    elif kind == "lognormal":
+        # MEDIAN,SIGMA: دُم بلند شبیه latency واقعی API
+        fn = lambda: random.lognormvariate(math.log(max(p[0], 1e-6)), p[1])
+    elif kind == "exp":
+        fn = lambda: random.expovariate(1.0 / max(p[0], 1e-6))
+    else:
+        raise ValueError(f"unknown latency distribution: {spec}")
+    return lambda: max(0.0, fn())
+
+
+# ---------- canned responses ----------
+_DICT_ENTRY = {
+    "headword": "Vereinbarung",
+    "lang": "DE",
+    "pos": "Nomen",
+    "gender": "die",
+    "plural_or_forms": "die Vereinbarungen",
+    "pronunciation": "/fɛɐ̯ˈʔaɪ̯nbaːʁʊŋ/",
+    "senses": [
+        {"gloss": "agreement", "translations": ["توافق", "قرار"],
+         "example_de": "Wir haben eine Vereinbarung getroffen.", "example_fa": "ما به توافق رسیدیم."},
+        {"gloss": "arrangement", "translations": ["ترتیب", "هماهنگی"],
+         "example_de": "Nach Vereinbarung ist der Termin flexibel.", "example_fa": "طبق هماهنگی، زمان قرار منعطف است."},
+    ],
+}
+
+_GRAMMAR_PAGE = (
+    "1) **Perfekt mit haben/sein** — گذشتهٔ نقلی\n\n"
+    "2) **Regel (DE):** Perfekt = haben/sein (konjugiert) + Partizip II am Satzende.\n"
+    "توضیح فارسی: برای بیشتر فعل‌ها haben؛ برای حرکت و تغییر حالت sein.\n\n"
+    "3) **Beispiele:**\n"
+    "- Ich habe Deutsch gelernt. — من آلمانی یاد گرفته‌ام.\n"
+    "- Wir sind nach Berlin gefahren. — ما به برلین رفتیم.\n\n"
+    "4) **Übung:** Ergänze: Er ___ gestern spät nach Hause ___ (kommen)."
+)
+
+_SCHREIBEN_ANSWER = (
+    "1) **Titel (DE)**: Korrektur\n\n"
+    "2) **Verbesserter Text**:\n"
+    "Sehr geehrte Damen und Herren, ich möchte mich für die Stelle bewerben, "
+    "die Sie auf Ihrer Webseite ausgeschrieben haben.\n\n"
+    "3) **Hinweise (DE)**:\n"
+    "- Verb am Satzende im Nebensatz.\n"
+    "- „Sie“ in der Anrede großschreiben.\n"
+    "- Komma vor „die“.\n\n"
+    "4) **ترجمهٔ فارسی**: خانم‌ها و آقایان محترم، مایلم برای شغلی که در وب‌سایت‌تان آگهی کرده‌اید درخواست بدهم."
+)
+
+def _system_text(messages) -> str:
+    for m in messages or []:
+        if m.get("role") == "system" and isinstance(m.get("content"), str):
+            return m["content"]
+    return ""
+
+def canned_reply(body: dict) -> str:
+    if body.get("max_tokens") == 1:
+        return "pong"
+    system = _system_text(body.get("messages")).lower()
+    if "lexicographer" in system:
+        return json.dumps(_DICT_ENTRY, ensure_ascii=False)
+    if "grammar tutor" in system:
+        return _GRAMMAR_PAGE
+    if "german teacher" in system:
+        return _SCHREIBEN_ANSWER
+    return "OK (mock)"
+
+def _count_tokens(messages) -> int:
+    chars = 0
+    for m in messages or []:
+        c = m.get("content")
+        if isinstance(c, str):
+            chars += len(c)
+        elif isinstance(c, list):
+            chars += sum(len(p.get("text") or "") + (0 if p.get("type") == "text" else 4000) for p in c)
+    return max(1, chars // 4)
+
+
+# ---------- server ----------
+class MockState:
+    def __init__(self, args):
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "stream": 0, "ok": 0, "429": 0, "5xx": 0, "hang": 0, "inflight": 0, "peak_inflight": 0}
+        self.configure(vars(args))
+
+    def configure(self, cfg: dict):
+        """تنظیمات (هم از CLI و هم از POST /config)."""
+        if "latency" in cfg:
+            self.latency = parse_dist(cfg["latency"])
+        if "ttft" in cfg:
+            self.ttft = parse_dist(cfg["ttft"]) if cfg["ttft"] else None
+        for k in ("token_delay", "rate_429", "rate_5xx", "rate_hang", "retry_after", "hang_seconds", "chunk_chars"):
+            if k in cfg and cfg[k] is not None:
+                setattr(self, k, float(cfg[k]) if k != "chunk_chars" else int(cfg[k]))
+
+    def bump(self, key: str, n: int = 1):
+        with self.lock:
+            self.counters[key] += n
+            if key == "inflight":
+                self.counters["peak_inflight"] = max(self.counters["peak_inflight"], self.counters["inflight"])
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "MockOpenAI/1.0"
+    protocol_version = "HTTP/1.1"   # keep-alive، مثل API واقعی
+    state: MockState = None         # در make_server مقداردهی می‌شود
+
+    def log_message(self, fmt, *args):
+        log.debug("%s " + fmt, self.address_string(), *args)
+
+    # ----- helpers -----
+    def _json(self, status: int, payload: dict, headers: dict = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int, message: str, etype: str, headers: dict = None):
+        self._json(status, {"error": {"message": message, "type": etype, "code": None}}, headers)
+
+    def _read_body(self) -> dict:
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"{}")
+
+    # ----- routes -----
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/stats", "/v1/stats"):
+            with self.state.lock:
+                return self._json(200, dict(self.state.counters))
+        if self.path.rstrip("/") in ("/models", "/v1/models"):
+            return self._json(200, {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}]})
+        self._error(404, f"not found: {self.path}", "invalid_request_error")
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if path in ("/config", "/v1/config"):
+            self.state.configure(self._read_body())
+            return self._json(200, {"ok": True})
+        if path not in ("/chat/completions", "/v1/chat/completions"):
+            return self._error(404, f"not found: {self.path}", "invalid_request_error")
+        try:
+            body = self._read_body()
+        except Exception:
+            return self._error(400, "invalid JSON body", "invalid_request_error")
+
+        st = self.state
+        st.bump("requests")
+        st.bump("inflight")
+        try:
+            roll = random.random()
+            if roll < st.rate_429:
+                st.bump("429")
+                return self._error(429, "Rate limit reached (mock)", "rate_limit_error",
+                                   {"Retry-After": f"{st.retry_after:g}"})
+            roll -= st.rate_429
+            if roll < st.rate_5xx:
+                st.bump("5xx")
+                time.sleep(st.latency() * 0.2)
+                return self._error(random.choice((500, 502, 503)), "Upstream error (mock)", "server_error")
+            roll -= st.rate_5xx
+            if roll < st.rate_hang:
+                # برای تست تایم‌اوت و مهلت سخت کلاینت
+                st.bump("hang")
+                time.sleep(st.hang_seconds)
+                return self._error(504, "Gateway timeout (mock)", "server_error")
+
+            text = canned_reply(body)
+            prompt_tokens = _count_tokens(body.get("messages"))
+            completion_tokens = max(1, len(text) // 4)
+            max_tokens = body.get("max_tokens")
+            if max_tokens and completion_tokens > max_tokens:
+                completion_tokens = max_tokens
+                text = text[: max_tokens * 4]
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": (prompt_tokens // 2) if prompt_tokens > 1024 else 0},
+            }
+            meta = {
+                "id": f"chatcmpl-mock{random.getrandbits(40):x}",
+                "created": int(time.time()),
+                "model": body.get("model") or "gpt-4o-mini",
+            }
+            if body.get("stream"):
+                st.bump("stream")
+                self._stream(text, usage, meta, bool((body.get("stream_options") or {}).get("include_usage")))
+            else:
+                time.sleep(st.latency())
+                self._json(200, {
+                    **meta, "object": "chat.completion",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": text}}],
+                    "usage": usage,
+                })
+            st.bump("ok")
+        except (BrokenPipeError, ConnectionResetError):
+            log.debug("client went away")
+        finally:
+            st.bump("inflight", -1)
+
+    def _stream(self, text: str, usage: dict, meta: dict, include_usage: bool):
+        st = self.state
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(obj):
+            line = ("data: " + (obj if isinstance(obj, str) else json.dumps(obj, ensure_ascii=False)) + "\n\n").encode("utf-8")
+            self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(delta: dict, finish=None):
+            return {**meta, "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+        time.sleep((st.ttft or st.latency)())
+        send(chunk({"role": "assistant", "content": ""}))
+        step = max(1, st.chunk_chars)
+        for i in range(0, len(text), step):
+            send(chunk({"content": text[i:i + step]}))
+            if st.token_delay:
+                time.sleep(st.token_delay)
+        send(chunk({}, finish="stop"))
+        if include_usage:
+            send({**meta, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def _parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Local OpenAI chat-completions stand-in with fault injection.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", default="lognormal:0.6,0.4", help="full-response latency distribution")
+    ap.add_argument("--ttft", default="", help="time-to-first-token distribution for streams (default: --latency)")
+    ap.add_argument("--token-delay", type=float, default=0.01, help="seconds between stream chunks")
+    ap.add_argument("--chunk-chars", type=int, default=12, help="characters per stream chunk")
+    ap.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    ap.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on 429")
+    ap.add_argument("--rate-5xx", type=float, default=0.0, help="fraction of requests answered with 500/502/503")
+    ap.add_argument("--rate-hang", type=float, default=0.0, help="fraction of requests that stall (timeout testing)")
+    ap.add_argument("--hang-seconds", type=float, default=120.0, help="how long a stalled request hangs")
+    ap.add_argument("--seed", type=int, help="random seed for reproducible runs")
+    return ap.parse_args(argv)
+
+def make_server(args) -> ThreadingHTTPServer:
+    handler = type("BoundHandler", (Handler,), {"state": MockState(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    args = _parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+    server = make_server(args)
+    log.info("Mock OpenAI listening on http://%s:%d/v1 (latency=%s, 429=%.2f, 5xx=%.2f, hang=%.2f)",
+             args.host, args.port, args.latency, args.rate_429, args.rate_5xx, args.rate_hang)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        with server.RequestHandlerClass.state.lock:
+            log.info("Stopped. %s", server.RequestHandlerClass.state.counters)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
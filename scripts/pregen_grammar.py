@@ -0,0 +1,83 @@
+# scripts/pregen_grammar.py
+"""
+ساخت از پیشِ توضیحات کل مسیر گرامر (GRAMMAR_ROADMAP) برای هر دو زبان رابط.
+
+    python -m scripts.pregen_grammar                     # فقط موارد ناموجود/منقضی
+    python -m scripts.pregen_grammar --concurrency 8
+    python -m scripts.pregen_grammar --force             # بازسازی همه
+    python -m scripts.pregen_grammar --base-url http://127.0.0.1:8089/v1   # سرور آزمایشی
+
+قابل ادامه است: هر توضیح بلافاصله بعد از تولید در کش ذخیره می‌شود و اجرای بعدی
+موارد تازه را رد می‌کند. اگر حتی یک مورد شکست بخورد، کد خروج 1 است.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+
+log = logging.getLogger("PregenGrammar")
+
+LANGS = ("fa", "de")
+
+def _parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Pre-generate grammar explanations into the cache.")
+    ap.add_argument("--concurrency", type=int, default=4, help="parallel LLM calls (default: 4)")
+    ap.add_argument("--levels", nargs="*", help="subset of levels, e.g. A1 A2")
+    ap.add_argument("--langs", nargs="*", default=list(LANGS), choices=LANGS, help="UI languages")
+    ap.add_argument("--force", action="store_true", help="regenerate even fresh entries")
+    ap.add_argument("--base-url", help="OpenAI-compatible endpoint (e.g. local mock server)")
+    return ap.parse_args(argv)
+
+async def _run(args) -> int:
+    # بعد از تنظیم env ایمپورت شود تا ai_client آدرس درست را بخواند
+    from modules.grammar import GRAMMAR_ROADMAP, warm_topic, is_warm
+    from utils.ai_client import close_client
+
+    levels = [l.upper() for l in (args.levels or GRAMMAR_ROADMAP.keys())]
+    jobs = [(lvl, topic, lang)
+            for lvl in levels if lvl in GRAMMAR_ROADMAP
+            for topic in GRAMMAR_ROADMAP[lvl]
+            for lang in args.langs]
+    sem = asyncio.Semaphore(max(1, args.concurrency))
+    stats = {"generated": 0, "skipped": 0, "failed": 0}
+
+    async def one(lvl: str, topic: str, lang: str):
+        async with sem:
+            t0 = time.monotonic()
+            try:
+                made = await warm_topic(topic, lang, force=args.force)
+            except Exception as e:
+                stats["failed"] += 1
+                log.error("FAIL %s | %s | %s: %s", lvl, lang, topic, e)
+                return
+            if made:
+                stats["generated"] += 1
+                log.info("OK   %s | %s | %s (%.1fs)", lvl, lang, topic, time.monotonic() - t0)
+            elif is_warm(topic, lang):
+                stats["skipped"] += 1
+            else:
+                # پاسخ خالی یا از مدل جایگزین؛ چیزی کش نشد و اجرای بعدی دوباره امتحان می‌کند
+                stats["failed"] += 1
+                log.error("FAIL %s | %s | %s: empty reply or fallback model (not cached)", lvl, lang, topic)
+
+    t_start = time.monotonic()
+    try:
+        await asyncio.gather(*(one(*j) for j in jobs))
+    finally:
+        await close_client()
+    log.info("Done in %.1fs: %d generated, %d fresh/skipped, %d failed (of %d)",
+             time.monotonic() - t_start, stats["generated"], stats["skipped"], stats["failed"], len(jobs))
+    return 1 if stats["failed"] else 0
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    args = _parse_args(argv)
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock-key")
+    return asyncio.run(_run(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,268 @@
-import os, time, random, logging
+import os, json, time, random, asyncio, hashlib, logging
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
+
+from utils import metrics, ai_usage
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from utils.ai_routes import OPENAI_MODEL, Route, route_for
+from utils.ai_scheduler import (
+    AIScheduler, PRIORITY_INTERACTIVE, PRIORITY_SCHREIBEN, PRIORITY_BACKGROUND,
+)
 
 load_dotenv()
 log = logging.getLogger("AI")
 
-_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# مدل هر feature (و OPENAI_MODEL پیش‌فرض) در utils/ai_routes.py تعیین می‌شود
+# مدل جایگزین وقتی circuit مدل اصلی باز است (خالی = بدون جایگزین، فقط fail-fast)
+AI_FALLBACK_MODEL = os.getenv("AI_FALLBACK_MODEL") or None
+# برای سرور آزمایشی/پراکسی (مثلاً http://127.0.0.1:8089/v1)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+# استخر اتصال مشترک؛ همهٔ هندلرها از همین کلاینت استفاده می‌کنند
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "64"))
+AI_MAX_KEEPALIVE   = int(os.getenv("AI_MAX_KEEPALIVE", "32"))
+AI_CONNECT_TIMEOUT = float(os.getenv("AI_CONNECT_TIMEOUT", "10"))
+AI_READ_TIMEOUT    = float(os.getenv("AI_READ_TIMEOUT", "90"))
+
+_client: Optional[AsyncOpenAI] = None
+# سقف سراسری/هر چت + نرخ درخواست/توکن + خط‌های اولویت (utils/ai_scheduler.py)
+scheduler = AIScheduler.from_env()
+
+# تخمین خروجی برای رزرو در سطل توکن؛ بعد از پاسخ با usage واقعی اصلاح می‌شود
+_EST_COMPLETION_TOKENS = 700
+_EST_IMAGE_TOKENS = 1000
+
+def _estimate_tokens(messages) -> int:
+    chars, images = 0, 0
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    chars += len(part.get("text") or "")
+                else:
+                    images += 1
+    return chars // 4 + images * _EST_IMAGE_TOKENS + _EST_COMPLETION_TOKENS
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """برای 429: مدت توقف پیشنهادی سرویس (یا پیش‌فرض)."""
+    if getattr(e, "status_code", None) != 429:
+        return None
+    try:
+        return float(e.response.headers.get("retry-after"))
+    except Exception:
+        return 5.0
+
+def _is_provider_failure(e: Exception) -> bool:
+    """فقط خطاهای سمت سرویس (timeout/اتصال/429/5xx) در circuit breaker شمرده می‌شوند، نه 4xxِ درخواست بد."""
+    status = getattr(e, "status_code", None)
+    return status is None or status == 429 or status >= 500
+
+# ---------- Circuit breakers (یکی برای هر مدل) ----------
+_breakers: Dict[str, CircuitBreaker] = {}
+
+def _breaker(model: str) -> CircuitBreaker:
+    cb = _breakers.get(model)
+    if cb is None:
+        async def probe(m=model):
+            await get_client().chat.completions.create(
+                model=m, messages=[{"role": "user", "content": "ping"}], max_tokens=1,
+            )
+        cb = _breakers[model] = CircuitBreaker.from_env(model, probe)
+    return cb
+
+def _route(model: str) -> str:
+    """مدل اصلی اگر circuit آن بسته است؛ وگرنه fallback؛ وگرنه fail-fast."""
+    if _breaker(model).allow():
+        return model
+    if AI_FALLBACK_MODEL and AI_FALLBACK_MODEL != model and _breaker(AI_FALLBACK_MODEL).allow():
+        metrics.inc("ai_fallback_total", model=model, fallback=AI_FALLBACK_MODEL)
+        return AI_FALLBACK_MODEL
+    metrics.inc("ai_fastfail_total", model=model)
+    raise CircuitOpenError(f"OpenAI circuit open for {model}")
+
+def circuit_states() -> Dict[str, str]:
+    return {m: cb.state for m, cb in _breakers.items()}
+
+metrics.register_gauge("ai_circuits", circuit_states)
+
+def get_client() -> AsyncOpenAI:
+    """کلاینت AsyncOpenAI با استخر اتصال httpx (تنبل؛ در اولین استفاده داخل event loop ساخته می‌شود)."""
+    global _client
+    if _client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=AI_MAX_CONNECTIONS,
+                max_keepalive_connections=AI_MAX_KEEPALIVE,
+                keepalive_expiry=60.0,
+            ),
+            timeout=httpx.Timeout(AI_READ_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+        )
+        _client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=OPENAI_BASE_URL,
+            http_client=http_client,
+            max_retries=0,  # ریترای را خودمان با asyncio.sleep انجام می‌دهیم
+        )
+    return _client
+
+async def close_client():
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.close()
+
+# single-flight: درخواست‌های هم‌زمانِ یکسان (model, messages, temperature) یک فراخوانی مشترک دارند
+class _Flight:
+    """
+    یک فراخوانی مشترک. priority و feature بالاترین اولویتِ منتظرها را نگه می‌دارند:
+    اگر کاربر به یک prefetch/pregen بپیوندد، فراخوانی به خط تعاملی می‌رود و
+    توکن‌ها به feature همان کاربر نوشته می‌شوند.
+    """
+    __slots__ = ("task", "priority", "feature", "ticket", "target", "attempts")
+
+    def __init__(self, priority: int, feature: str, model: str):
+        self.task: Optional["asyncio.Task[str]"] = None
+        self.priority = priority
+        self.feature = feature
+        self.ticket: Dict[str, object] = {}   # جای درخواست در صف scheduler (برای promote)
+        self.target = model                    # مدلی که واقعاً صدا زده شد (شاید fallback)
+        self.attempts = 0
+
+    def join(self, priority: int, feature: str):
+        if priority < self.priority:
+            self.priority, self.feature = priority, feature
+            scheduler.promote(self.ticket, priority)
+            metrics.inc("ai_flight_promoted_total", feature=feature)
+
+_inflight: Dict[str, _Flight] = {}
 
-def chat_completion(messages, temperature=0.3, max_attempts=3):
+def _flight_key(model: str, messages, temperature: float, max_tokens: Optional[int]) -> str:
+    raw = json.dumps([model, messages, temperature, max_tokens], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
+def _flight_done(key: str, task: "asyncio.Task[str]"):
+    flight = _inflight.get(key)
+    if flight is not None and flight.task is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()  # جلوگیری از «exception was never retrieved» وقتی همهٔ منتظرها رفته‌اند
+
+def _resolve(feature: str, model, temperature, max_tokens, timeout):
+    """پارامترهای صریح بر جدول مسیرها (utils/ai_routes.py) مقدم‌اند."""
+    r: Route = route_for(feature)
+    return (
+        model or r.model,
+        r.temperature if temperature is None else temperature,
+        max_tokens or r.max_tokens,
+        time.monotonic() + (timeout or r.timeout),
+    )
+
+def _remaining(deadline: float) -> float:
+    return deadline - time.monotonic()
+
+async def chat_completion(messages, temperature: Optional[float] = None, max_attempts=3,
+                          model: Optional[str] = None,
+                          chat_id: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE,
+                          feature: str = "other", max_tokens: Optional[int] = None,
+                          timeout: Optional[float] = None,
+                          served: Optional[Dict[str, object]] = None) -> str:
+    """
+    فراخوانی مرکزی مدل. اگر همین درخواست الان در جریان باشد، به همان نتیجه
+    متصل می‌شود و درخواست دوم فرستاده نمی‌شود. لغو شدن یک منتظر، فراخوانی
+    مشترک را برای بقیه لغو نمی‌کند.
+    هر تلاش از scheduler اسلات می‌گیرد (priority + chat_id)؛ در زمان بک‌آف اسلات آزاد است.
+    feature هم مسیر (مدل، max_tokens، temperature، مهلت) را تعیین می‌کند و هم برای
+    حسابداری توکن/هزینه/latency است (dictionary، grammar، schreiben_text، ...).
+    بعد از مهلت سخت (صف + ریترای‌ها) asyncio.TimeoutError بالا می‌رود؛ منتظری که به
+    فراخوانی دیگری پیوسته هم مهلت خودش را دارد. latency/خطا برای هر فراخواننده با
+    feature خودش ثبت می‌شود و توکن‌ها یک بار.
+    اگر served داده شود، مدلی که واقعاً جواب داد در served["model"] و اینکه fallback
+    بوده یا نه در served["fallback"] نوشته می‌شود؛ پاسخ fallback نباید زیر کلید مدل
+    اصلی کش شود.
+    """
+    model, temperature, max_tokens, deadline = _resolve(feature, model, temperature, max_tokens, timeout)
+    key = _flight_key(model, messages, temperature, max_tokens)
+    t0 = time.monotonic()
+    flight = _inflight.get(key)
+    leader = flight is None
+    if leader:
+        flight = _Flight(priority, feature, model)
+        flight.task = asyncio.ensure_future(_within_deadline(
+            _complete(messages, temperature, max_attempts, model, chat_id, flight, max_tokens, deadline),
+            deadline, feature, model,
+        ))
+        _inflight[key] = flight
+        flight.task.add_done_callback(lambda t, k=key: _flight_done(k, t))
+        metrics.inc("ai_calls_total")
+    else:
+        metrics.inc("ai_dedup_total", feature=feature)
+        flight.join(priority, feature)
+    try:
+        if leader:
+            text = await asyncio.shield(flight.task)
+        else:
+            text = await asyncio.wait_for(asyncio.shield(flight.task), max(0.0, _remaining(deadline)))
+    except Exception as e:
+        ai_usage.record_call(feature, flight.target, time.monotonic() - t0,
+                             max(1, flight.attempts) if leader else 1, error=e)
+        raise
+    ai_usage.record_call(feature, flight.target, time.monotonic() - t0, flight.attempts if leader else 1)
+    _mark_served(served, model, flight.target)
+    return text
+
+def _mark_served(served: Optional[Dict[str, object]], model: str, target: str):
+    if served is not None:
+        served["model"] = target
+        served["fallback"] = target != model
+
+async def _within_deadline(coro, deadline: float, feature: str, model: str) -> str:
+    t0 = time.monotonic()
+    try:
+        return await asyncio.wait_for(coro, max(0.0, _remaining(deadline)))
+    except asyncio.TimeoutError:
+        metrics.inc("ai_deadline_exceeded_total", feature=feature, model=model)
+        log.warning(f"OpenAI call for {feature} exceeded its deadline after {time.monotonic() - t0:.1f}s")
+        raise
+
+async def _complete(messages, temperature: float, max_attempts: int, model: str,
+                    chat_id: Optional[int], flight: _Flight,
+                    max_tokens: Optional[int], deadline: float) -> str:
+    """priority و feature در هر تلاش از flight خوانده می‌شوند (ممکن است promote شده باشند)."""
+    est = _estimate_tokens(messages)
     attempt = 0
     while True:
+        flight.attempts = attempt + 1
+        target = _route(model)
+        flight.target = target
         try:
-            resp = _client.chat.completions.create(
-                model=_MODEL,
-                messages=messages,
-                temperature=temperature
-            )
-            return resp.choices[0].message.content.strip()
+            async with scheduler.slot(flight.priority, chat_id, tokens=est, ticket=flight.ticket) as slot:
+                t_call = time.monotonic()
+                try:
+                    resp = await get_client().chat.completions.create(
+                        model=target,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        timeout=max(1.0, _remaining(deadline)),
+                    )
+                except Exception as e:
+                    _breaker(target).record(not _is_provider_failure(e), time.monotonic() - t_call)
+                    raise
+                _breaker(target).record(True, time.monotonic() - t_call)
+                if getattr(resp, "usage", None):
+                    slot["tokens"] = resp.usage.total_tokens
+            ai_usage.record_usage(flight.feature, target, getattr(resp, "usage", None))
+            return (resp.choices[0].message.content or "").strip()
         except Exception as e:
+            pause = _retry_after(e)
+            if pause:
+                scheduler.throttle(pause)
             attempt += 1
             if attempt >= max_attempts:
                 log.exception(f"OpenAI failed after {attempt} attempts")
@@ -27,5 +270,97 @@ def chat_completion(messages, temperature=0.3, max_attempts=3):
             base = min(10, 2 ** attempt)
             jitter = random.uniform(0.2, 0.5) * base
             wait = base + jitter
+            if wait >= _remaining(deadline):
+                # ریترای بعدی به مهلت نمی‌رسد؛ همین حالا شکست بخور
+                raise
             log.warning(f"OpenAI error: {e}. retrying in {wait:.1f}s (attempt {attempt})")
-            time.sleep(wait)
+            await asyncio.sleep(wait)
+
+async def stream_chat_completion(messages, temperature: Optional[float] = None, max_attempts=3,
+                                 model: Optional[str] = None,
+                                 chat_id: Optional[int] = None,
+                                 priority: int = PRIORITY_SCHREIBEN,
+                                 feature: str = "other", max_tokens: Optional[int] = None,
+                                 timeout: Optional[float] = None,
+                                 served: Optional[Dict[str, object]] = None) -> AsyncIterator[str]:
+    """
+    نسخهٔ استریم: تکه‌های متن را به محض رسیدن yield می‌کند.
+    ریترای فقط تا قبل از اولین توکن؛ بعد از آن خطا بالا می‌رود (متن نصفه تکرار نشود).
+    اسلات scheduler تا پایان استریم نگه داشته می‌شود.
+    مهلت مسیر تا رسیدن اولین توکن سخت است؛ بعد از آن فقط فاصلهٔ بین تکه‌ها محدود است
+    تا پاسخی که در حال نمایش است وسط کار قطع نشود.
+    served مثل chat_completion پر می‌شود (قبل از اولین تکه).
+    """
+    model, temperature, max_tokens, deadline = _resolve(feature, model, temperature, max_tokens, timeout)
+    est = _estimate_tokens(messages)
+    t0 = time.monotonic()
+    attempt = 0
+    while True:
+        started = False
+        if _remaining(deadline) <= 0:
+            e = asyncio.TimeoutError(f"no first token within deadline for {feature}")
+            metrics.inc("ai_deadline_exceeded_total", feature=feature, model=model)
+            ai_usage.record_call(feature, model, time.monotonic() - t0, max(1, attempt), error=e)
+            raise e
+        try:
+            target = _route(model)
+        except CircuitOpenError as e:
+            ai_usage.record_call(feature, model, time.monotonic() - t0, attempt + 1, error=e)
+            raise
+        try:
+            async with scheduler.slot(priority, chat_id, tokens=est) as slot:
+                t_call = time.monotonic()
+                try:
+                    stream = await get_client().chat.completions.create(
+                        model=target,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        timeout=max(1.0, _remaining(deadline)),
+                        stream=True,
+                        stream_options={"include_usage": True},
+                    )
+                    async for chunk in stream:
+                        if getattr(chunk, "usage", None):
+                            slot["tokens"] = chunk.usage.total_tokens
+                            ai_usage.record_usage(feature, target, chunk.usage)
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            if not started:
+                                ttft = time.monotonic() - t_call
+                                # برای استریم، کُندی با زمان تا اولین توکن سنجیده می‌شود
+                                _breaker(target).record(True, ttft)
+                                metrics.observe("ai_ttft_seconds", time.monotonic() - t0, feature=feature, model=target)
+                                _mark_served(served, model, target)
+                            started = True
+                            yield delta
+                except Exception as e:
+                    if not started:
+                        _breaker(target).record(not _is_provider_failure(e), time.monotonic() - t_call)
+                    raise
+            ai_usage.record_call(feature, target, time.monotonic() - t0, attempt + 1)
+            return
+        except Exception as e:
+            if started:
+                ai_usage.record_call(feature, target, time.monotonic() - t0, attempt + 1, error=e)
+                raise
+            pause = _retry_after(e)
+            if pause:
+                scheduler.throttle(pause)
+            attempt += 1
+            if attempt >= max_attempts:
+                log.exception(f"OpenAI stream failed after {attempt} attempts")
+                ai_usage.record_call(feature, target, time.monotonic() - t0, attempt, error=e)
+                raise
+            base = min(10, 2 ** attempt)
+            wait = min(base + random.uniform(0.2, 0.5) * base, max(0.0, _remaining(deadline)))
+            log.warning(f"OpenAI stream error: {e}. retrying in {wait:.1f}s (attempt {attempt})")
+            await asyncio.sleep(wait)
+
+def dedup_stats() -> Dict[str, int]:
+    """چند فراخوانی واقعی رفت و چندتا به فراخوانیِ در جریان وصل شدند."""
+    snap = metrics.snapshot()["counters"]
+    total = lambda name: int(sum(c["value"] for c in snap.get(name, [])))
+    return {"calls": total("ai_calls_total"), "deduplicated": total("ai_dedup_total"), "inflight": len(_inflight)}
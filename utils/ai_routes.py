@@ -0,0 +1,60 @@
+# utils/ai_routes.py
+import os
+import logging
+from typing import Dict, NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+log = logging.getLogger("AIRoutes")
+
+# مدل پیش‌فرض؛ تنها جایی که OPENAI_MODEL خوانده می‌شود
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+
+class Route(NamedTuple):
+    model: str
+    max_tokens: Optional[int]
+    temperature: float
+    timeout: float       # مهلت سخت کل فراخوانی (صف + ریترای‌ها) به ثانیه
+
+
+# پیش‌فرض‌ها برای هر feature؛ هر فیلد با AI_ROUTE_<FEATURE>_<FIELD> قابل تغییر است،
+# مثلاً AI_ROUTE_DICTIONARY_MODEL=gpt-4.1-nano یا AI_ROUTE_SCHREIBEN_TEXT_TIMEOUT=120
+_DEFAULTS: Dict[str, Dict[str, object]] = {
+    "dictionary":      {"max_tokens": 700,  "temperature": 0.2, "timeout": 20},
+    "grammar":         {"max_tokens": 1800, "temperature": 0.3, "timeout": 60},
+    "grammar_pregen":  {"max_tokens": 1800, "temperature": 0.3, "timeout": 180},
+    "grammar_prefetch": {"max_tokens": 1800, "temperature": 0.3, "timeout": 120},
+    "schreiben_text":  {"max_tokens": 2500, "temperature": 0.3, "timeout": 90},
+    "schreiben_diff":  {"max_tokens": 1200, "temperature": 0.2, "timeout": 60},
+    "schreiben_image": {"max_tokens": 2500, "temperature": 0.2, "timeout": 120},
+    "other":           {"max_tokens": None, "temperature": 0.3, "timeout": 90},
+}
+
+def _env(feature: str, field: str) -> Optional[str]:
+    return os.getenv(f"AI_ROUTE_{feature.upper()}_{field}") or None
+
+def _build(feature: str, d: Dict[str, object]) -> Route:
+    max_tokens = _env(feature, "MAX_TOKENS")
+    temperature = _env(feature, "TEMPERATURE")
+    timeout = _env(feature, "TIMEOUT")
+    return Route(
+        model=_env(feature, "MODEL") or OPENAI_MODEL,
+        max_tokens=int(max_tokens) if max_tokens else d["max_tokens"],
+        temperature=float(temperature) if temperature else d["temperature"],
+        timeout=float(timeout) if timeout else d["timeout"],
+    )
+
+ROUTES: Dict[str, Route] = {name: _build(name, d) for name, d in _DEFAULTS.items()}
+
+def route_for(feature: str) -> Route:
+    """تنظیمات مدل برای یک feature؛ ناشناخته‌ها به «other» می‌روند."""
+    return ROUTES.get(feature) or ROUTES["other"]
+
+def describe() -> str:
+    """خلاصهٔ یک‌خطی برای هر مسیر (لاگ شروع برنامه)."""
+    return "\n".join(
+        f"{name:<16} model={r.model} max_tokens={r.max_tokens} temp={r.temperature} timeout={r.timeout:g}s"
+        for name, r in ROUTES.items()
+    )
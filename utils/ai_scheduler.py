@@ -0,0 +1,196 @@
+# utils/ai_scheduler.py
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+from utils import metrics
+
+log = logging.getLogger("AIScheduler")
+
+# خط‌های اولویت: عدد کمتر = زودتر
+PRIORITY_INTERACTIVE = 0   # دیکشنری، صفحهٔ گرامرِ درخواستی کاربر
+PRIORITY_SCHREIBEN   = 1   # تصحیح متن/عکس
+PRIORITY_BACKGROUND  = 2   # pre-generation و prefetch
+LANES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_SCHREIBEN: "schreiben", PRIORITY_BACKGROUND: "background"}
+
+# در حالت supervisor هر worker فقط 1/N سقف‌های سراسریِ حساب (OpenAI و تلگرام) را دارد؛
+# supervisor این را قبل از ساختن workerها تنظیم می‌کند
+BOT_WORKER_COUNT = max(1, int(os.getenv("BOT_WORKER_COUNT", "1")))
+
+def per_worker(total: float) -> float:
+    """سهم این پردازه از یک سقف سراسری."""
+    return total / BOT_WORKER_COUNT
+
+
+class TokenBucket:
+    """سطل توکن ساده: rate واحد در ثانیه، حداکثر capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, n: float) -> float:
+        """چند ثانیه تا در دسترس بودن n واحد (0 یعنی همین حالا)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        n = min(n, self.capacity)  # درخواست بزرگ‌تر از ظرفیت هرگز نباید برای همیشه گیر کند
+        return 0.0 if self.tokens >= n else (n - self.tokens) / self.rate
+
+    def take(self, n: float):
+        if self.rate > 0:
+            self._refill()
+            self.tokens -= min(n, self.capacity)
+
+    def adjust(self, delta: float):
+        """اصلاح بعد از مصرف واقعی (مثبت = بیشتر از تخمین مصرف شد)."""
+        if self.rate > 0:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class AIScheduler:
+    """
+    حاکم هم‌زمانی فراخوانی‌های مدل:
+    - سقف سراسری فراخوانی‌های هم‌زمان و سقف برای هر chat_id
+    - نرخ درخواست در دقیقه و توکن در دقیقه (token bucket)
+    - اولویت سخت بین خط‌ها؛ در هر خط FIFO
+    یک چت که به سقف خودش رسیده جلوی بقیه را نمی‌گیرد.
+    """
+
+    def __init__(self, max_concurrency: int = 16, per_chat: int = 2,
+                 rpm: float = 500, tpm: float = 200_000, burst_seconds: float = 5.0):
+        self.max_concurrency = max_concurrency
+        self.per_chat = per_chat
+        self.req_bucket = TokenBucket(rpm / 60.0, max(1.0, rpm / 60.0 * burst_seconds))
+        self.tok_bucket = TokenBucket(tpm / 60.0, max(1.0, tpm / 60.0 * burst_seconds))
+        self._running = 0
+        self._per_chat: Dict[int, int] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future, Optional[int], float]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._paused_until = 0.0
+        metrics.register_gauge("ai_scheduler", self.stats)
+
+    @classmethod
+    def from_env(cls) -> "AIScheduler":
+        return cls(
+            max_concurrency=max(1, int(per_worker(int(os.getenv("AI_MAX_CONCURRENCY", "16"))))),
+            per_chat=int(os.getenv("AI_MAX_PER_CHAT", "2")),  # هر چت فقط روی یک worker است
+            rpm=per_worker(float(os.getenv("AI_RPM", "500"))),
+            tpm=per_worker(float(os.getenv("AI_TPM", "200000"))),
+        )
+
+    # ---------- public ----------
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE, chat_id: Optional[int] = None, tokens: float = 0,
+                   ticket: Optional[Dict[str, object]] = None):
+        """
+        async with scheduler.slot(PRIORITY_SCHREIBEN, chat_id, tokens=est) as s:
+            ...
+            s["tokens"] = actual   # اختیاری: اصلاح سطل توکن با مصرف واقعی
+        ticket: dict اختیاری تا درخواستِ در صف بعداً با promote() جلو بیفتد.
+        """
+        t0 = time.monotonic()
+        await self._acquire(priority, chat_id, tokens, ticket)
+        metrics.observe("ai_queue_wait_seconds", time.monotonic() - t0, lane=LANES.get(priority, str(priority)))
+        info = {"tokens": None}
+        try:
+            yield info
+        finally:
+            if info["tokens"] is not None:
+                self.tok_bucket.adjust(info["tokens"] - tokens)
+            self._release(chat_id)
+
+    def promote(self, ticket: Dict[str, object], priority: int):
+        """درخواستی که هنوز در صف است به خط بالاتر می‌رود (مثلاً کاربر به prefetch پیوست)."""
+        fut = ticket.get("fut")
+        if fut is None or fut.done():
+            return
+        for i, (prio, seq, f, chat_id, tokens) in enumerate(self._waiters):
+            if f is fut:
+                if prio > priority:
+                    self._waiters[i] = (priority, seq, f, chat_id, tokens)
+                    heapq.heapify(self._waiters)
+                    self._dispatch()
+                return
+
+    def throttle(self, seconds: float):
+        """بعد از 429 از سمت سرویس: همهٔ خط‌ها تا seconds ثانیه صبر کنند."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        log.warning("AI scheduler paused for %.1fs after provider rate limit", seconds)
+
+    def stats(self) -> Dict[str, object]:
+        queued = {name: 0 for name in LANES.values()}
+        for prio, _, fut, _, _ in self._waiters:
+            if not fut.done():
+                queued[LANES.get(prio, str(prio))] = queued.get(LANES.get(prio, str(prio)), 0) + 1
+        return {"running": self._running, "queued": queued, "chats_active": len(self._per_chat)}
+
+    # ---------- internals ----------
+    async def _acquire(self, priority: int, chat_id: Optional[int], tokens: float,
+                       ticket: Optional[Dict[str, object]] = None):
+        fut = asyncio.get_running_loop().create_future()
+        if ticket is not None:
+            ticket["fut"] = fut
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut, chat_id, tokens))
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # اگر هم‌زمان با لغو، اسلات داده شده بود، پسش بده
+            if fut.done() and not fut.cancelled():
+                self._release(chat_id)
+            raise
+
+    def _release(self, chat_id: Optional[int]):
+        self._running -= 1
+        if chat_id is not None:
+            n = self._per_chat.get(chat_id, 1) - 1
+            if n <= 0:
+                self._per_chat.pop(chat_id, None)
+            else:
+                self._per_chat[chat_id] = n
+        self._dispatch()
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        blocked: list = []
+        wait = 0.0
+        while self._waiters and self._running < self.max_concurrency:
+            item = heapq.heappop(self._waiters)
+            _, _, fut, chat_id, tokens = item
+            if fut.done():
+                continue
+            if chat_id is not None and self._per_chat.get(chat_id, 0) >= self.per_chat:
+                blocked.append(item)  # این چت پر است؛ نفر بعدی
+                continue
+            wait = max(self._paused_until - time.monotonic(),
+                       self.req_bucket.wait_time(1), self.tok_bucket.wait_time(tokens))
+            if wait > 0:
+                blocked.append(item)  # اولویت سخت: بقیه هم منتظر نرخ بمانند
+                break
+            self.req_bucket.take(1)
+            self.tok_bucket.take(tokens)
+            self._running += 1
+            if chat_id is not None:
+                self._per_chat[chat_id] = self._per_chat.get(chat_id, 0) + 1
+            fut.set_result(None)
+        for item in blocked:
+            heapq.heappush(self._waiters, item)
+        if wait > 0:
+            self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
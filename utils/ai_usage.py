@@ -0,0 +1,105 @@
+# utils/ai_usage.py
+import os
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from utils import metrics
+
+log = logging.getLogger("AIUsage")
+
+# قیمت هر ۱ میلیون توکن به دلار: (ورودی، ورودیِ cache‌شده، خروجی)
+# با AI_PRICES قابل تغییر است: {"gpt-4o-mini": [0.15, 0.075, 0.6], ...}
+_DEFAULT_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o":      (2.50, 1.25, 10.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+}
+
+def _load_prices() -> Dict[str, Tuple[float, float, float]]:
+    prices = dict(_DEFAULT_PRICES)
+    raw = os.getenv("AI_PRICES")
+    if raw:
+        try:
+            prices.update({k: tuple(v) for k, v in json.loads(raw).items()})
+        except Exception:
+            log.warning("AI_PRICES is not valid JSON; using defaults")
+    return prices
+
+PRICES = _load_prices()
+
+def _price(model: str) -> Optional[Tuple[float, float, float]]:
+    if model in PRICES:
+        return PRICES[model]
+    # نسخه‌های تاریخ‌دار مثل gpt-4o-mini-2024-07-18
+    for name in sorted(PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            return PRICES[name]
+    return None
+
+def record_usage(feature: str, model: str, usage) -> None:
+    """usage پاسخ OpenAI (prompt/completion/cached tokens) + هزینهٔ تخمینی."""
+    if not usage:
+        return
+    prompt = getattr(usage, "prompt_tokens", 0) or 0
+    completion = getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+    metrics.inc("ai_tokens_total", prompt, feature=feature, model=model, kind="prompt")
+    metrics.inc("ai_tokens_total", completion, feature=feature, model=model, kind="completion")
+    metrics.inc("ai_tokens_total", cached, feature=feature, model=model, kind="cached")
+    p = _price(model)
+    if p:
+        cost = ((prompt - cached) * p[0] + cached * p[1] + completion * p[2]) / 1_000_000
+        metrics.inc("ai_cost_usd", cost, feature=feature, model=model)
+
+def record_call(feature: str, model: str, seconds: float, attempts: int, error: Optional[BaseException] = None):
+    """یک فراخوانی کامل (شامل صف و ریترای‌ها)."""
+    outcome = "ok" if error is None else "error"
+    metrics.inc("ai_requests_total", feature=feature, model=model, outcome=outcome)
+    metrics.observe("ai_latency_seconds", seconds, feature=feature, model=model)
+    if attempts > 1:
+        metrics.inc("ai_retries_total", attempts - 1, feature=feature, model=model)
+    if error is not None:
+        metrics.inc("ai_errors_total", feature=feature, model=model, error=type(error).__name__)
+
+def summary() -> List[Dict[str, object]]:
+    """جمع‌بندی برای هر (feature, model): تعداد، توکن، هزینه، صدک‌های latency، ریترای و خطا."""
+    snap = metrics.snapshot()
+    rows: Dict[Tuple[str, str], Dict[str, object]] = {}
+
+    def row(labels) -> Dict[str, object]:
+        k = (labels.get("feature", "-"), labels.get("model", "-"))
+        return rows.setdefault(k, {
+            "feature": k[0], "model": k[1], "calls": 0, "errors": 0, "retries": 0,
+            "prompt": 0, "completion": 0, "cached": 0, "cost": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0,
+        })
+
+    for c in snap["counters"].get("ai_requests_total", []):
+        row(c["labels"])["calls"] += int(c["value"])
+    for c in snap["counters"].get("ai_errors_total", []):
+        row(c["labels"])["errors"] += int(c["value"])
+    for c in snap["counters"].get("ai_retries_total", []):
+        row(c["labels"])["retries"] += int(c["value"])
+    for c in snap["counters"].get("ai_tokens_total", []):
+        row(c["labels"])[c["labels"]["kind"]] += int(c["value"])
+    for c in snap["counters"].get("ai_cost_usd", []):
+        row(c["labels"])["cost"] += c["value"]
+    for h in snap["histograms"].get("ai_latency_seconds", []):
+        r = row(h["labels"])
+        r.update(p50=h["p50"], p95=h["p95"], p99=h["p99"])
+    return sorted(rows.values(), key=lambda r: -float(r["cost"]))
+
+def format_summary() -> str:
+    rows = summary()
+    if not rows:
+        return "AI usage: no calls yet."
+    lines = ["AI usage by feature (since start):"]
+    for r in rows:
+        lines.append(
+            f"- {r['feature']} [{r['model']}]: calls={r['calls']} err={r['errors']} retries={r['retries']} | "
+            f"tokens in={r['prompt']} (cached {r['cached']}) out={r['completion']} | "
+            f"cost=${r['cost']:.4f} | latency p50={r['p50']:.2f}s p95={r['p95']:.2f}s p99={r['p99']:.2f}s"
+        )
+    return "\n".join(lines)
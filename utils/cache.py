@@ -0,0 +1,173 @@
+# utils/cache.py
+import os, json, time, sqlite3, hashlib, threading, logging
+from typing import Any, Dict, Optional
+
+log = logging.getLogger("Cache")
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+CACHE_DB = os.getenv("CACHE_DB", os.path.join(DATA_DIR, "cache.db"))
+# چند ثانیه پشت قفل SQLite (پردازهٔ دیگری در حال نوشتن) صبر کنیم؛ بعدش کش رد می‌شود
+CACHE_DB_TIMEOUT = float(os.getenv("CACHE_DB_TIMEOUT", "2"))
+
+# هر namespace (grammar، dictionary، ...) ردیف‌های خودش را در یک جدول مشترک دارد
+_conns: Dict[str, sqlite3.Connection] = {}
+_locks: Dict[str, threading.Lock] = {}
+_conns_lock = threading.Lock()
+
+# accessed_at فقط اگر قدیمی‌تر از این باشد به‌روز می‌شود (هر hit یک نوشتن نباشد)
+_TOUCH_EVERY = 60.0
+_EVICT_EVERY = 64
+
+def _connect(path: str):
+    with _conns_lock:
+        conn = _conns.get(path)
+        if conn is None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            # در حالت supervisor چند پردازه روی همین فایل می‌نویسند
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                                   timeout=CACHE_DB_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (ns, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (ns, accessed_at)")
+            _conns[path] = conn
+            _locks[path] = threading.Lock()
+        return conn, _locks[path]
+
+def make_key(*parts: Any) -> str:
+    """کلید پایدار از چند جزء (مثلاً topic, lang, model, prompt_version)."""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def fingerprint(text: str, n: int = 12) -> str:
+    """نسخهٔ کوتاه یک پرامپت؛ با تغییر متن، کلیدهای قدیمی خودبه‌خود بی‌اثر می‌شوند."""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:n]
+
+
+class DiskCache:
+    """
+    کش پایدار LRU + TTL روی SQLite.
+    - max_entries: سقف ردیف‌های این namespace (قدیمی‌ترین دسترسی‌ها حذف می‌شوند)
+    - ttl: عمر هر ردیف به ثانیه (None = بدون انقضا)
+    - stale_ttl: ردیف منقضی تا این سن نگه داشته می‌شود تا اگر سرویس مدل در دسترس نبود
+      با get(..., allow_stale=True) سرو شود (پیش‌فرض: دو برابر ttl)
+    مقدارها JSON-serializable هستند.
+    خطای SQLite (مثلاً database is locked) هرگز به درخواست نمی‌رسد: get = miss، set = no-op.
+    """
+
+    def __init__(self, namespace: str, max_entries: int = 1000, ttl: Optional[float] = None,
+                 path: Optional[str] = None, stale_ttl: Optional[float] = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl if stale_ttl is not None else (ttl * 2 if ttl is not None else None)
+        self.path = path or CACHE_DB
+        self._sets = 0
+
+    def _db(self):
+        return _connect(self.path)
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def _failed(self, op: str, e: Exception):
+        log.warning("Cache[%s]: %s failed (%s); skipping cache", self.namespace, op, e)
+
+    def get(self, key: str, allow_stale: bool = False) -> Optional[Any]:
+        now = time.time()
+        try:
+            conn, lock = self._db()
+            with lock:
+                row = conn.execute(
+                    "SELECT value, created_at, accessed_at FROM cache WHERE ns=? AND key=?",
+                    (self.namespace, key),
+                ).fetchone()
+                if not row:
+                    return None
+                value, created_at, accessed_at = row
+                if self._expired(created_at, now):
+                    if not allow_stale:
+                        return None
+                    if self.stale_ttl is not None and now - created_at > self.stale_ttl:
+                        conn.execute("DELETE FROM cache WHERE ns=? AND key=?", (self.namespace, key))
+                        return None
+                if now - accessed_at > _TOUCH_EVERY:
+                    try:
+                        conn.execute("UPDATE cache SET accessed_at=? WHERE ns=? AND key=?",
+                                     (now, self.namespace, key))
+                    except sqlite3.Error as e:
+                        self._failed("touch", e)  # hit معتبر است؛ فقط LRU به‌روز نشد
+        except sqlite3.Error as e:
+            self._failed("get", e)
+            return None
+        try:
+            return json.loads(value)
+        except Exception:
+            log.warning("Cache[%s]: corrupt entry dropped", self.namespace)
+            self.delete(key)
+            return None
+
+    def is_fresh(self, key: str) -> bool:
+        try:
+            conn, lock = self._db()
+            with lock:
+                row = conn.execute(
+                    "SELECT created_at FROM cache WHERE ns=? AND key=?", (self.namespace, key)
+                ).fetchone()
+        except sqlite3.Error as e:
+            self._failed("is_fresh", e)
+            return False
+        return bool(row) and not self._expired(row[0], time.time())
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False)
+        try:
+            conn, lock = self._db()
+            with lock:
+                conn.execute(
+                    "INSERT INTO cache (ns, key, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(ns, key) DO UPDATE SET value=excluded.value, "
+                    "created_at=excluded.created_at, accessed_at=excluded.accessed_at",
+                    (self.namespace, key, payload, now, now),
+                )
+                self._sets += 1
+                if self._sets % _EVICT_EVERY == 0:
+                    self._evict_locked(conn)
+        except sqlite3.Error as e:
+            self._failed("set", e)
+
+    def _evict_locked(self, conn: sqlite3.Connection):
+        if self.stale_ttl is not None:
+            conn.execute("DELETE FROM cache WHERE ns=? AND created_at < ?",
+                         (self.namespace, time.time() - self.stale_ttl))
+        conn.execute(
+            "DELETE FROM cache WHERE ns=? AND key IN ("
+            " SELECT key FROM cache WHERE ns=? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.max_entries),
+        )
+
+    def delete(self, key: str):
+        try:
+            conn, lock = self._db()
+            with lock:
+                conn.execute("DELETE FROM cache WHERE ns=? AND key=?", (self.namespace, key))
+        except sqlite3.Error as e:
+            self._failed("delete", e)
+
+    def clear(self) -> int:
+        """حذف همهٔ ردیف‌های این namespace؛ تعداد حذف‌شده را برمی‌گرداند."""
+        conn, lock = self._db()
+        with lock:
+            cur = conn.execute("DELETE FROM cache WHERE ns=?", (self.namespace,))
+            return cur.rowcount
+
+    def __len__(self) -> int:
+        conn, lock = self._db()
+        with lock:
+            return conn.execute("SELECT COUNT(*) FROM cache WHERE ns=?", (self.namespace,)).fetchone()[0]
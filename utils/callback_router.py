@@ -0,0 +1,107 @@
+# utils/callback_router.py
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from utils import metrics
+from utils.memory import get_user
+from utils.safe_telegram import safe_answer, safe_send
+
+log = logging.getLogger("CallbackRouter")
+
+Handler = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]
+
+
+class Route(NamedTuple):
+    name: str        # الگوی ثبت‌شده، مثلاً "vocab:quiz:opt" (برچسب متریک)
+    handler: Handler
+    nargs: int       # تعداد دقیق بخش‌های بعد از الگو (مثلاً 1 برای vocab:quiz:opt:<i>)
+
+
+class _Node:
+    __slots__ = ("children", "route")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.route: Optional[Route] = None
+
+
+_UNROUTED_MSG_FA = "❓ دستور ناشناخته است."
+_UNROUTED_MSG_DE = "❓ Unbekannter Befehl."
+
+
+async def noop(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """دکمه‌های فقط‌نمایشی (noop:…)؛ answer در dispatch کافی است."""
+
+
+def parse(data: str) -> Tuple[str, str, List[str]]:
+    """callback_data → (namespace, action, args)، مثلاً "vocab:quiz:opt:2" → ("vocab", "quiz", ["opt", "2"])."""
+    parts = (data or "").split(":")
+    return parts[0], (parts[1] if len(parts) > 1 else ""), parts[2:]
+
+
+class CallbackRouter:
+    """
+    یک CallbackQueryHandler برای همهٔ دکمه‌ها: callback_data یک بار روی «:» شکسته می‌شود
+    و در یک trie از بخش‌ها دنبال طولانی‌ترین الگوی ثبت‌شده گشته می‌شود؛ هزینه به تعداد
+    بخش‌ها بستگی دارد، نه به تعداد هندلرها. بخش‌های باقی‌مانده در context.args می‌آیند.
+    هر callback قبل از اجرا answer می‌شود تا دکمه از حالت انتظار دربیاید.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+
+    def add(self, pattern: str, handler: Handler, nargs: int = 0):
+        node = self._root
+        for seg in pattern.split(":"):
+            node = node.children.setdefault(seg, _Node())
+        if node.route is not None:
+            raise ValueError(f"callback route {pattern!r} is already registered")
+        node.route = Route(pattern, handler, nargs)
+
+    def match(self, data: str) -> Tuple[Optional[Route], List[str]]:
+        parts = (data or "").split(":")
+        node, best, args = self._root, None, []
+        for depth, seg in enumerate(parts):
+            node = node.children.get(seg)
+            if node is None:
+                break
+            rest = parts[depth + 1:]
+            if node.route is not None and node.route.nargs == len(rest):
+                best, args = node.route, rest
+        return best, args
+
+    def routes(self) -> List[str]:
+        out, stack = [], [self._root]
+        while stack:
+            node = stack.pop()
+            if node.route is not None:
+                out.append(node.route.name)
+            stack.extend(node.children.values())
+        return sorted(out)
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        cq = update.callback_query
+        if not cq:
+            return
+        await safe_answer(update)
+        route, args = self.match(cq.data)
+        if route is None:
+            # مثلاً دکمهٔ پیام قدیمی که دیگر مسیری ندارد
+            metrics.inc("callback_unrouted_total", namespace=parse(cq.data)[0])
+            log.debug("No callback route for %r", cq.data)
+            try:
+                lang = get_user(update.effective_chat.id).get("language", "fa")
+            except Exception:
+                lang = "fa"
+            await safe_send(update, context, _UNROUTED_MSG_FA if lang == "fa" else _UNROUTED_MSG_DE)
+            return
+        context.args = args
+        t0 = time.monotonic()
+        try:
+            return await route.handler(update, context)
+        finally:
+            metrics.observe("callback_seconds", time.monotonic() - t0, route=route.name)
@@ -0,0 +1,105 @@
+# utils/circuit_breaker.py
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, Tuple
+
+from utils import metrics
+
+log = logging.getLogger("Circuit")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """سرویس فعلاً در دسترس فرض نمی‌شود؛ بدون انتظار و ریترای شکست بخور."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker بر اساس پنجرهٔ آخرین فراخوانی‌ها:
+    - اگر نرخ خطا >= error_rate یا نرخ کُندی (بیش از slow_seconds) >= slow_rate شود، باز می‌شود
+    - در حالت باز، همهٔ درخواست‌ها فوراً رد می‌شوند (allow() == False)
+    - بعد از cooldown یک probe در پس‌زمینه اجرا می‌شود (half-open)؛
+      موفق → بسته، ناموفق → دوباره باز با cooldown دوبرابر (تا سقف)
+    """
+
+    def __init__(self, name: str, probe: Optional[Callable[[], Awaitable[object]]] = None,
+                 window: int = 20, min_calls: int = 8, error_rate: float = 0.5,
+                 slow_seconds: float = 25.0, slow_rate: float = 0.8,
+                 cooldown: float = 30.0, max_cooldown: float = 300.0):
+        self.name = name
+        self.probe = probe
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._calls: Deque[Tuple[bool, bool]] = deque(maxlen=window)  # (ok, slow)
+        self._probe_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, name: str, probe=None) -> "CircuitBreaker":
+        return cls(
+            name, probe,
+            window=int(os.getenv("CB_WINDOW", "20")),
+            min_calls=int(os.getenv("CB_MIN_CALLS", "8")),
+            error_rate=float(os.getenv("CB_ERROR_RATE", "0.5")),
+            slow_seconds=float(os.getenv("CB_SLOW_SECONDS", "25")),
+            slow_rate=float(os.getenv("CB_SLOW_RATE", "0.8")),
+            cooldown=float(os.getenv("CB_COOLDOWN", "30")),
+        )
+
+    def allow(self) -> bool:
+        return self.state == CLOSED
+
+    def record(self, ok: bool, seconds: float):
+        if self.state != CLOSED:
+            return  # نتیجهٔ درخواست‌هایی که قبل از باز شدن رفته بودند
+        self._calls.append((ok, seconds >= self.slow_seconds))
+        n = len(self._calls)
+        if n < self.min_calls:
+            return
+        errors = sum(1 for ok_, _ in self._calls if not ok_)
+        slow = sum(1 for _, slow_ in self._calls if slow_)
+        if errors / n >= self.error_rate or slow / n >= self.slow_rate:
+            self._trip(f"errors={errors}/{n} slow={slow}/{n}")
+
+    def _trip(self, reason: str):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._calls.clear()
+        metrics.inc("ai_circuit_trips_total", circuit=self.name)
+        log.warning("Circuit %s OPEN (%s); probing in %.0fs", self.name, reason, self.cooldown)
+        self._schedule_probe()
+
+    def _schedule_probe(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = loop.create_task(self._probe_loop())
+
+    async def _probe_loop(self):
+        while self.state != CLOSED:
+            await asyncio.sleep(self.cooldown)
+            self.state = HALF_OPEN
+            try:
+                if self.probe is not None:
+                    await self.probe()
+            except Exception as e:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                log.warning("Circuit %s probe failed (%s); next probe in %.0fs", self.name, e, self.cooldown)
+                continue
+            self.state = CLOSED
+            self.cooldown = self.base_cooldown
+            log.info("Circuit %s CLOSED (probe ok)", self.name)
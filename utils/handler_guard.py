@@ -1,12 +1,28 @@
 # utils/handler_guard.py
+import os
 import logging
 from functools import wraps
 from telegram import Update
-from telegram.ext import ContextTypes
+from telegram.ext import ContextTypes, ApplicationHandlerStop
 from .safe_telegram import safe_send
+from .circuit_breaker import CircuitOpenError
 
 log = logging.getLogger("Guard")
 
+# وقتی circuit سرویس مدل باز است (fail-fast) پیام متفاوتی نشان داده می‌شود
+_CIRCUIT_MSG_FA = "⏳ سرویس هوش مصنوعی موقتاً در دسترس نیست؛ چند دقیقهٔ دیگر دوباره امتحان کن."
+_CIRCUIT_MSG_DE = "⏳ Der KI-Dienst ist vorübergehend nicht erreichbar. Bitte in ein paar Minuten erneut versuchen."
+
+# شناسه‌های چت مدیران، جداشده با کاما (ADMIN_CHAT_IDS=123,456)
+ADMIN_CHAT_IDS = {int(x) for x in os.getenv("ADMIN_CHAT_IDS", "").replace(" ", "").split(",") if x}
+
+def circuit_message(lang: str) -> str:
+    """پیام «سرویس مدل موقتاً در دسترس نیست» به زبان کاربر."""
+    return _CIRCUIT_MSG_FA if lang == "fa" else _CIRCUIT_MSG_DE
+
+def is_admin(chat_id: int) -> bool:
+    return chat_id in ADMIN_CHAT_IDS
+
 def guard(user_friendly_msg_fa="⚠️ خطای موقت رخ داد؛ دوباره تلاش کن.",
           user_friendly_msg_de="⚠️ Ein vorübergehender Fehler ist aufgetreten. Bitte erneut versuchen."):
     def deco(func):
@@ -14,14 +30,33 @@ def guard(user_friendly_msg_fa="⚠️ خطای موقت رخ داد؛ دوبا
         async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
             try:
                 return await func(update, context, *args, **kwargs)
+            except ApplicationHandlerStop:
+                raise  # کنترل جریان PTB است، نه خطا
             except Exception as e:
-                log.exception(f"Handler error in {func.__name__}: {e}")
+                if isinstance(e, CircuitOpenError):
+                    log.warning(f"Handler {func.__name__} failed fast: {e}")
+                else:
+                    log.exception(f"Handler error in {func.__name__}: {e}")
                 try:
                     from utils.memory import get_user
                     lang = get_user(update.effective_chat.id).get("language", "fa")
                 except Exception:
                     lang = "fa"
-                msg = user_friendly_msg_fa if lang == "fa" else user_friendly_msg_de
+                if isinstance(e, CircuitOpenError):
+                    msg = circuit_message(lang)
+                else:
+                    msg = user_friendly_msg_fa if lang == "fa" else user_friendly_msg_de
                 await safe_send(update, context, msg)
         return wrapper
     return deco
+
+def admin_only(func):
+    """هندلرهای مدیریتی: برای غیرمدیرها بی‌صدا نادیده گرفته می‌شوند."""
+    @wraps(func)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+        chat = update.effective_chat
+        if not chat or not is_admin(chat.id):
+            log.warning(f"Admin command {func.__name__} denied for chat {getattr(chat, 'id', None)}")
+            return
+        return await func(update, context, *args, **kwargs)
+    return wrapper
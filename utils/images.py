@@ -0,0 +1,62 @@
+# utils/images.py
+import os
+import io
+import base64
+import asyncio
+import logging
+from typing import Sequence, Tuple
+
+from telegram import Bot, PhotoSize
+
+from utils import metrics
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow اختیاری است؛ بدونش بایت‌های JPEG تلگرام همان‌طور فرستاده می‌شوند
+    Image = ImageOps = None
+
+log = logging.getLogger("Images")
+
+# کوچک‌ترین PhotoSize که ضلع بلندش حداقل این باشد (متن هنوز خوانا است). تلگرام معمولاً
+# 90/320/800/1280 می‌سازد؛ 800 یعنی به‌جای نسخهٔ 1280 همان 800 دانلود می‌شود
+IMAGE_MIN_SIDE = int(os.getenv("IMAGE_MIN_SIDE", "800"))
+# بعد از دانلود، ضلع بلند حداکثر این می‌شود (وقتی فقط سایز بزرگ‌تری موجود بود)
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1024"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+def pick_photo(sizes: Sequence[PhotoSize], min_side: int = IMAGE_MIN_SIDE) -> PhotoSize:
+    """کوچک‌ترین سایزی که به min_side می‌رسد؛ اگر هیچ‌کدام نرسید، بزرگ‌ترین."""
+    ordered = sorted(sizes, key=lambda p: p.width * p.height)
+    for p in ordered:
+        if max(p.width, p.height) >= min_side:
+            return p
+    return ordered[-1]
+
+def _reencode(data: bytes, max_side: int = IMAGE_MAX_SIDE, quality: int = IMAGE_JPEG_QUALITY) -> Tuple[bytes, str]:
+    """کوچک‌سازی + JPEG دوباره (CPU-bound؛ در thread اجرا می‌شود)."""
+    if Image is None:
+        return data, "image/jpeg"
+    with Image.open(io.BytesIO(data)) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        if max(im.size) > max_side:
+            im.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        im.save(out, format="JPEG", quality=quality, optimize=True)
+    encoded = out.getvalue()
+    # اگر دوباره‌سازی بزرگ‌ترش کرد، همان اصلی بهتر است
+    return (encoded, "image/jpeg") if len(encoded) < len(data) else (data, "image/jpeg")
+
+async def photo_data_url(bot: Bot, photo: PhotoSize) -> str:
+    """
+    دانلود عکس از طریق استخر HTTP خودِ bot (بدون قرار دادن توکن در URL)،
+    کوچک‌سازی در thread و برگرداندن data URL (base64) برای ارسال inline به مدل.
+    """
+    file = await bot.get_file(photo.file_id)
+    raw = bytes(await file.download_as_bytearray())
+    data, mime = await asyncio.to_thread(_reencode, raw)
+    metrics.observe("image_bytes", len(raw), stage="downloaded")
+    metrics.observe("image_bytes", len(data), stage="sent")
+    log.debug("Photo %s: %dx%d, %d → %d bytes", photo.file_unique_id, photo.width, photo.height, len(raw), len(data))
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
@@ -1,8 +1,19 @@
 # utils/memory.py
-import json, os
-from typing import Dict, Any
+import json, os, sqlite3, threading, tempfile, atexit, logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Iterator
 
-STATE_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "user_state.json")
+log = logging.getLogger("Memory")
+
+DATA_DIR   = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+STATE_FILE = os.path.join(DATA_DIR, "user_state.json")
+STATE_DB   = os.getenv("STATE_DB", os.path.join(DATA_DIR, "user_state.db"))
+# 'sqlite' (پیش‌فرض، یک ردیف برای هر chat_id) یا 'json' (فایل قدیمی)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite").lower()
+# کش write-back: هر چند ثانیه کاربران تغییرکرده یک‌جا ذخیره می‌شوند
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "2.0"))
+STATE_CACHE_MAX      = int(os.getenv("STATE_CACHE_MAX", "50000"))
 
 default_state = {
     "language": "fa",        # 'fa' or 'de'
@@ -18,42 +29,268 @@ default_state = {
     "grammar_progress": {"level": None, "index": 0, "history": []}
 }
 
-def _load_all() -> Dict[str, Any]:
-    if not os.path.exists(STATE_FILE):
-        return {}
+def _copy(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return json.loads(json.dumps(doc))  # deep copy (همان نرمال‌سازی دیسک)
+
+def _fresh_default() -> Dict[str, Any]:
+    return _copy(default_state)
+
+# =========================
+# Storage engines
+# =========================
+class _JsonStore:
+    """ذخیره‌سازی قدیمی: کل کاربران در یک فایل JSON؛ نوشتن اتمیک با فایل موقت + rename."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._data = self._load_all()
+
+    def _load_all(self) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            # هرگز با {} ادامه نده؛ اولین flush همهٔ کاربران را پاک می‌کرد
+            raise RuntimeError(f"User state file is unreadable: {self.path}") from e
+
+    def _save_all(self, data: Dict[str, Any]):
+        folder = os.path.dirname(self.path)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".user_state.", suffix=".tmp", dir=folder)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except Exception:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def load(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        doc = self._data.get(chat_id)
+        return _copy(doc) if doc is not None else None
+
+    def save_many(self, docs: Dict[str, Dict[str, Any]]):
+        self._data.update(docs)
+        self._save_all(self._data)
+
+
+class _SqliteStore:
+    """SQLite در حالت WAL؛ هر chat_id یک ردیف، پس هزینهٔ هر نوشتن مستقل از تعداد کاربران است."""
+
+    def __init__(self, path: str, legacy_json: Optional[str] = None):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        # timeout: در حالت supervisor چند پردازه روی همین فایل می‌نویسند (هر کدام چت‌های خودش)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            " chat_id TEXT PRIMARY KEY,"
+            " doc TEXT NOT NULL,"
+            " updated_at REAL NOT NULL DEFAULT (strftime('%s','now')))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if legacy_json:
+            self._migrate_from_json(legacy_json)
+
+    def _migrate_from_json(self, json_path: str):
+        """مهاجرت یک‌باره از user_state.json؛ ردیف‌های موجود در DB دست نمی‌خورند."""
+        with self._lock:
+            done = self._conn.execute("SELECT value FROM meta WHERE key='json_migrated'").fetchone()
+            if done or not os.path.exists(json_path):
+                return
+            try:
+                with open(json_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception:
+                # فایل خراب را علامت نمی‌زنیم تا بعد از اصلاح دوباره امتحان شود
+                log.exception("State migration: cannot read %s; skipping", json_path)
+                return
+            rows = [(str(k), json.dumps(v, ensure_ascii=False)) for k, v in (data or {}).items()]
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR IGNORE INTO users (chat_id, doc) VALUES (?, ?)", rows)
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (json_path,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            log.info("State migration: imported %d users from %s", len(rows), json_path)
+
+    def load(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT doc FROM users WHERE chat_id=?", (chat_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_many(self, docs: Dict[str, Dict[str, Any]]):
+        rows = [(k, json.dumps(v, ensure_ascii=False)) for k, v in docs.items()]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO users (chat_id, doc, updated_at) VALUES (?, ?, strftime('%s','now')) "
+                    "ON CONFLICT(chat_id) DO UPDATE SET doc=excluded.doc, updated_at=excluded.updated_at",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def _get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if STATE_BACKEND == "json":
+                    _store = _JsonStore(STATE_FILE)
+                else:
+                    _store = _SqliteStore(STATE_DB, legacy_json=STATE_FILE)
+    return _store
+
+def open_store():
+    """ساخت/مهاجرت فوری DB (مثلاً در supervisor، یک بار قبل از اجرای workerها)."""
+    return _get_store()
+
+# =========================
+# Write-back cache
+# =========================
+# خواندن‌ها از حافظه سرو می‌شوند؛ نوشتن فقط سند را dirty می‌کند و
+# یک thread پس‌زمینه هر STATE_FLUSH_INTERVAL ثانیه آن‌ها را دسته‌ای ذخیره می‌کند.
+_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_dirty: set = set()
+_inflight: set = set()   # در حال نوشتن؛ نباید evict و دوباره از دیسک خوانده شوند
+_cache_lock = threading.RLock()
+_flush_lock = threading.Lock()
+_flusher: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+def _cached(key: str) -> Optional[Dict[str, Any]]:
+    """سند کش‌شده (بدون کپی) یا بارگذاری یک‌باره از موتور ذخیره‌سازی."""
+    doc = _cache.get(key)
+    if doc is not None:
+        _cache.move_to_end(key)
+        return doc
+    doc = _get_store().load(key)
+    if doc is not None:
+        _cache[key] = doc
+        _evict()
+    return doc
+
+def _evict():
+    # فقط سندهای تمیز (ذخیره‌شده) از کش بیرون می‌روند
+    if len(_cache) <= STATE_CACHE_MAX:
+        return
+    for key in list(_cache.keys()):
+        if len(_cache) <= STATE_CACHE_MAX:
+            break
+        if key not in _dirty and key not in _inflight:
+            del _cache[key]
+
+def _put(key: str, doc: Dict[str, Any]):
+    _cache[key] = doc
+    _cache.move_to_end(key)
+    _dirty.add(key)
+    _evict()
+    _ensure_flusher()
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None or STATE_FLUSH_INTERVAL <= 0:
+        return
+    _flusher = threading.Thread(target=_flush_loop, name="state-flusher", daemon=True)
+    _flusher.start()
+
+def _flush_loop():
+    while not _stop.wait(STATE_FLUSH_INTERVAL):
+        try:
+            flush()
+        except Exception:
+            log.exception("State flush failed; will retry")
+
+def flush() -> int:
+    """کاربران dirty را یک‌جا ذخیره می‌کند و تعدادشان را برمی‌گرداند."""
+    with _flush_lock:
+        with _cache_lock:
+            if not _dirty:
+                return 0
+            keys = list(_dirty)
+            _dirty.clear()
+            _inflight.update(keys)
+            docs = {k: _copy(_cache[k]) for k in keys if k in _cache}
+        try:
+            _get_store().save_many(docs)
+        except Exception:
+            with _cache_lock:
+                _dirty.update(keys)
+            raise
+        finally:
+            with _cache_lock:
+                _inflight.difference_update(keys)
+        return len(docs)
+
+def shutdown():
+    """توقف thread پس‌زمینه و flush نهایی (در خروج برنامه صدا زده می‌شود)."""
+    _stop.set()
     try:
-        with open(STATE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        flush()
     except Exception:
-        return {}
+        log.exception("Final state flush failed")
 
-def _save_all(data: Dict[str, Any]):
-    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
-    with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+atexit.register(shutdown)
 
+# =========================
+# Public API
+# =========================
 def get_user(chat_id: int) -> Dict[str, Any]:
-    data = _load_all()
-    u = data.get(str(chat_id))
-    if not u:
-        return json.loads(json.dumps(default_state))  # deep copy
+    with _cache_lock:
+        u = _cached(str(chat_id))
+        if not u:
+            return _fresh_default()
+        u = _copy(u)
     # تضمین backward compatibility
     for k,v in default_state.items():
         if k not in u:
             u[k] = json.loads(json.dumps(v))
     return u
 
+@contextmanager
+def update_user(chat_id: int) -> Iterator[Dict[str, Any]]:
+    """
+    تراکنش read-modify-write:
+        with update_user(chat_id) as u:
+            u["daily_streak"] += 1
+            u["last_daily"] = today
+    همهٔ تغییرات روی یک کپی جمع می‌شوند و در پایان بلوک یک‌بار ثبت می‌شوند.
+    اگر داخل بلوک خطا رخ دهد، هیچ تغییری ثبت نمی‌شود.
+    """
+    u = get_user(chat_id)
+    yield u
+    with _cache_lock:
+        _put(str(chat_id), _copy(u))
+
 def set_user(chat_id: int, key: str, value):
-    data = _load_all()
-    u = data.get(str(chat_id), json.loads(json.dumps(default_state)))
-    u[key] = value
-    data[str(chat_id)] = u
-    _save_all(data)
+    with _cache_lock:
+        u = _cached(str(chat_id)) or _fresh_default()
+        u[key] = _copy({"v": value})["v"]
+        _put(str(chat_id), u)
 
 def set_user_bulk(chat_id: int, updates: Dict[str, Any]):
-    data = _load_all()
-    u = data.get(str(chat_id), json.loads(json.dumps(default_state)))
-    for k,v in updates.items():
-        u[k] = v
-    data[str(chat_id)] = u
-    _save_all(data)
+    with _cache_lock:
+        u = _cached(str(chat_id)) or _fresh_default()
+        for k,v in _copy(updates).items():
+            u[k] = v
+        _put(str(chat_id), u)
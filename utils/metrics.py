@@ -0,0 +1,92 @@
+# utils/metrics.py
+import threading
+from collections import deque
+from typing import Callable, Dict, Tuple, Any
+
+# ساده و درون‌پردازه‌ای: شمارنده‌ها، نمونه‌های اخیر (برای صدک) و gaugeهای callable
+_RESERVOIR = 1024
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_samples: Dict[Tuple[str, Tuple], Dict[str, Any]] = {}
+_gauges: Dict[str, Callable[[], Any]] = {}
+
+def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, Tuple]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name: str, value: float = 1, **labels):
+    """افزایش یک شمارنده، مثلاً inc("updates_total", shard=3)."""
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+def observe(name: str, value: float, **labels):
+    """ثبت یک نمونه (مثلاً latency) برای محاسبهٔ count/sum/صدک‌ها."""
+    k = _key(name, labels)
+    with _lock:
+        s = _samples.get(k)
+        if s is None:
+            s = _samples[k] = {"count": 0, "sum": 0.0, "max": 0.0, "recent": deque(maxlen=_RESERVOIR)}
+        s["count"] += 1
+        s["sum"] += value
+        s["max"] = max(s["max"], value)
+        s["recent"].append(value)
+
+def register_gauge(name: str, fn: Callable[[], Any]):
+    """gauge در لحظهٔ snapshot صدا زده می‌شود (مثلاً عمق صف‌ها)."""
+    with _lock:
+        _gauges[name] = fn
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    vals = sorted(values)
+    idx = min(len(vals) - 1, max(0, int(round(q * (len(vals) - 1)))))
+    return vals[idx]
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        counters = {k: v for k, v in _counters.items()}
+        samples = {k: (s["count"], s["sum"], s["max"], list(s["recent"])) for k, s in _samples.items()}
+        gauges = dict(_gauges)
+    out: Dict[str, Any] = {"counters": {}, "histograms": {}, "gauges": {}}
+    for (name, labels), v in counters.items():
+        out["counters"].setdefault(name, []).append({"labels": dict(labels), "value": v})
+    for (name, labels), (count, total, mx, recent) in samples.items():
+        out["histograms"].setdefault(name, []).append({
+            "labels": dict(labels),
+            "count": count,
+            "avg": total / count if count else 0.0,
+            "p50": percentile(recent, 0.50),
+            "p95": percentile(recent, 0.95),
+            "p99": percentile(recent, 0.99),
+            "max": mx,
+        })
+    for name, fn in gauges.items():
+        try:
+            out["gauges"][name] = fn()
+        except Exception as e:
+            out["gauges"][name] = f"error: {e}"
+    return out
+
+def _fmt_labels(labels: Dict[str, Any]) -> str:
+    return "{" + ",".join(f"{k}={v}" for k, v in labels.items()) + "}" if labels else ""
+
+def format_snapshot(skip_prefixes: Tuple[str, ...] = ()) -> str:
+    """متن خوانا از همهٔ متریک‌ها (برای لاگ یا دستور مدیریتی /stats)."""
+    snap = snapshot()
+    keep = lambda name: not name.startswith(skip_prefixes) if skip_prefixes else True
+    lines = []
+    for name, items in sorted(snap["counters"].items()):
+        if keep(name):
+            for c in items:
+                lines.append(f"{name}{_fmt_labels(c['labels'])} = {c['value']:g}")
+    for name, items in sorted(snap["histograms"].items()):
+        if keep(name):
+            for h in items:
+                lines.append(f"{name}{_fmt_labels(h['labels'])} n={h['count']} "
+                             f"p50={h['p50']:.3f} p95={h['p95']:.3f} p99={h['p99']:.3f} max={h['max']:.3f}")
+    for name, value in sorted(snap["gauges"].items()):
+        if keep(name):
+            lines.append(f"{name} = {value}")
+    return "\n".join(lines)
@@ -0,0 +1,182 @@
+# utils/outbox.py
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from telegram.error import RetryAfter
+
+from utils import metrics
+from utils.ai_scheduler import TokenBucket, per_worker
+
+log = logging.getLogger("Outbox")
+
+T = TypeVar("T")
+
+# خط‌های اولویت ارسال: عدد کمتر = زودتر
+PRIORITY_INTERACTIVE = 0   # پاسخ مستقیم به پیام/دکمهٔ کاربر
+PRIORITY_BROADCAST   = 1   # یادآوری‌ها و پیام‌های گروهی به چند کاربر
+LANES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BROADCAST: "broadcast"}
+
+# حدود تلگرام: حدود ۳۰ پیام در ثانیه برای کل ربات، ۱ پیام در ثانیه در هر چت
+# (با کمی burst)، و ۲۰ پیام در دقیقه در گروه‌ها
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3"))
+TG_GROUP_PER_MIN = float(os.getenv("TG_GROUP_PER_MIN", "20"))
+# چند بار بعد از RetryAfter دوباره بفرستیم
+TG_SEND_ATTEMPTS = int(os.getenv("TG_SEND_ATTEMPTS", "3"))
+
+# سطل‌های پرِ چت‌های بی‌کار از این تعداد به بعد دور ریخته می‌شوند
+_MAX_IDLE_BUCKETS = 5000
+
+
+def _seconds(retry_after) -> float:
+    """retry_after در PTB 21 عدد است و در نسخه‌های بعدی timedelta."""
+    if hasattr(retry_after, "total_seconds"):
+        return float(retry_after.total_seconds())
+    return float(retry_after or 1)
+
+
+class OutboundDispatcher:
+    """
+    صف ارسال پیام به تلگرام:
+    - سطل توکن سراسری و یک سطل برای هر chat_id (گروه‌ها با نرخ دقیقه‌ای)
+    - اولویت سخت بین خط‌ها؛ در هر خط FIFO
+    - بعد از RetryAfter همان چت تا زمان اعلام‌شده مکث می‌کند و ارسال دوباره تلاش می‌شود
+    چتی که به سقف خودش رسیده جلوی ارسال به بقیه را نمی‌گیرد.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 group_per_min: float = 20, attempts: int = 3):
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_min / 60.0
+        self.attempts = max(1, attempts)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._paused: Dict[int, float] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future, Optional[int]]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        metrics.register_gauge("tg_outbox", self.stats)
+
+    @classmethod
+    def from_env(cls) -> "OutboundDispatcher":
+        return cls(
+            global_rate=per_worker(TG_GLOBAL_RATE),  # سقف کل ربات بین workerها تقسیم می‌شود
+            chat_rate=TG_CHAT_RATE,
+            chat_burst=TG_CHAT_BURST,
+            group_per_min=TG_GROUP_PER_MIN,
+            attempts=TG_SEND_ATTEMPTS,
+        )
+
+    # ---------- public ----------
+    async def send(self, chat_id: Optional[int], call: Callable[[], Awaitable[T]],
+                   priority: int = PRIORITY_INTERACTIVE) -> T:
+        """
+        await outbox.send(chat_id, lambda: bot.send_message(chat_id, text))
+        call هر بار یک coroutine تازه می‌سازد تا بعد از RetryAfter دوباره صدا زده شود.
+        """
+        lane = LANES.get(priority, str(priority))
+        for attempt in range(1, self.attempts + 1):
+            t0 = time.monotonic()
+            await self._acquire(priority, chat_id)
+            metrics.observe("tg_send_queue_seconds", time.monotonic() - t0, lane=lane)
+            try:
+                result = await call()
+            except RetryAfter as e:
+                pause = _seconds(e.retry_after)
+                metrics.inc("tg_sends_total", lane=lane, outcome="retry_after")
+                self.pause(chat_id, pause)
+                if attempt >= self.attempts:
+                    raise
+                log.warning("Telegram RetryAfter %.0fs for chat %s (attempt %d/%d)",
+                            pause, chat_id, attempt, self.attempts)
+                continue
+            except Exception:
+                metrics.inc("tg_sends_total", lane=lane, outcome="error")
+                raise
+            metrics.inc("tg_sends_total", lane=lane, outcome="ok")
+            return result
+
+    def pause(self, chat_id: Optional[int], seconds: float):
+        """مکث ارسال به یک چت (یا کل ربات وقتی chat_id معلوم نیست)."""
+        until = time.monotonic() + seconds
+        key = chat_id if chat_id is not None else 0
+        self._paused[key] = max(self._paused.get(key, 0.0), until)
+
+    def stats(self) -> Dict[str, object]:
+        queued = {name: 0 for name in LANES.values()}
+        for prio, _, fut, _ in self._waiters:
+            if not fut.done():
+                name = LANES.get(prio, str(prio))
+                queued[name] = queued.get(name, 0) + 1
+        now = time.monotonic()
+        return {"queued": queued, "chats": len(self._chats),
+                "paused": sum(1 for t in self._paused.values() if t > now)}
+
+    # ---------- internals ----------
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            if chat_id < 0:  # گروه/کانال
+                b = TokenBucket(self.group_rate, max(1.0, self.chat_burst))
+            else:
+                b = TokenBucket(self.chat_rate, max(1.0, self.chat_burst))
+            self._chats[chat_id] = b
+            if len(self._chats) > _MAX_IDLE_BUCKETS:
+                self._evict_idle()
+        return b
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for cid in [c for c, b in self._chats.items() if b.wait_time(b.capacity) == 0]:
+            del self._chats[cid]
+        for cid in [c for c, t in self._paused.items() if t <= now]:
+            del self._paused[cid]
+
+    async def _acquire(self, priority: int, chat_id: Optional[int]):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut, chat_id))
+        self._dispatch()
+        await fut
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        blocked: list = []
+        wait = 0.0
+        next_wake = float("inf")
+        while self._waiters:
+            item = heapq.heappop(self._waiters)
+            _, _, fut, chat_id = item
+            if fut.done():
+                continue
+            if chat_id is not None:
+                chat_wait = max(self._paused.get(chat_id, 0.0) - now, self._bucket(chat_id).wait_time(1))
+                if chat_wait > 0:
+                    blocked.append(item)  # این چت باید صبر کند؛ نفر بعدی
+                    next_wake = min(next_wake, chat_wait)
+                    continue
+            wait = max(self._paused.get(0, 0.0) - now, self.global_bucket.wait_time(1))
+            if wait > 0:
+                blocked.append(item)  # اولویت سخت: بقیه هم منتظر سقف سراسری بمانند
+                next_wake = min(next_wake, wait)
+                break
+            self.global_bucket.take(1)
+            if chat_id is not None:
+                self._bucket(chat_id).take(1)
+            fut.set_result(None)
+        for item in blocked:
+            heapq.heappush(self._waiters, item)
+        if next_wake != float("inf"):
+            self._timer = asyncio.get_running_loop().call_later(next_wake, self._dispatch)
+
+
+outbox = OutboundDispatcher.from_env()
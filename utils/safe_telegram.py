@@ -1,10 +1,16 @@
+import os
 import logging
 from typing import Optional, Iterable
 from telegram import Update, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 
+from utils.outbox import outbox, PRIORITY_INTERACTIVE
+
 log = logging.getLogger("SafeTG")
 TG_LIMIT = 4096
+# کوییزها (واژگان، MCQ روزانه، تعیین سطح): بازخورد + سؤال بعدی در یک ویرایش همان پیام
+QUIZ_EDIT_IN_PLACE = os.getenv("QUIZ_EDIT_IN_PLACE", "1") == "1"
 
 def _chunks(s: str, n: int) -> Iterable[str]:
     for i in range(0, len(s), n):
@@ -15,17 +21,56 @@ async def safe_send(
     context: ContextTypes.DEFAULT_TYPE,
     text: str,
     parse_mode: Optional[str] = "Markdown",
-    reply_markup: Optional[InlineKeyboardMarkup] = None
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    priority: int = PRIORITY_INTERACTIVE,
 ):
-
+    """ارسال از طریق صف outbox (سقف نرخ تلگرام + RetryAfter)؛ متن بلند چند پیام می‌شود."""
     try:
         chat_id = update.effective_chat.id
         for part in _chunks(text, TG_LIMIT):
-            if update.callback_query:
-                await context.bot.send_message(chat_id=chat_id, text=part, parse_mode=parse_mode, reply_markup=reply_markup)
-                reply_markup = None  # فقط پیام اول دکمه داشته باشد
+            if update.callback_query or not update.message:
+                call = lambda p=part, kb=reply_markup: context.bot.send_message(
+                    chat_id=chat_id, text=p, parse_mode=parse_mode, reply_markup=kb)
             else:
-                await update.message.reply_text(part, parse_mode=parse_mode, reply_markup=reply_markup)
-                reply_markup = None
+                call = lambda p=part, kb=reply_markup: update.message.reply_text(
+                    p, parse_mode=parse_mode, reply_markup=kb)
+            await outbox.send(chat_id, call, priority=priority)
+            reply_markup = None  # فقط پیام اول دکمه داشته باشد
     except Exception as e:
         log.exception(f"Telegram send error: {e}")
+
+async def safe_answer(update: Update, text: Optional[str] = None):
+    """تأیید فوری callback (توقف چرخش دکمه)؛ خطای query قدیمی/تکراری نادیده گرفته می‌شود."""
+    cq = update.callback_query
+    if not cq:
+        return
+    try:
+        await cq.answer(text)
+    except Exception as e:
+        log.debug(f"callback answer failed: {e}")
+
+async def safe_edit(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    text: str,
+    parse_mode: Optional[str] = "Markdown",
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+):
+    """
+    ویرایش پیامِ دکمه‌دار همین callback به‌جای پیام تازه. اگر ویرایش ممکن نبود
+    (پیام خیلی قدیمی/حذف‌شده یا متن بلندتر از TG_LIMIT) به safe_send برمی‌گردد.
+    """
+    cq = update.callback_query
+    if not cq or not cq.message or len(text) > TG_LIMIT:
+        await safe_send(update, context, text, parse_mode=parse_mode, reply_markup=reply_markup)
+        return
+    try:
+        await outbox.send(update.effective_chat.id, lambda: cq.edit_message_text(
+            text=text, parse_mode=parse_mode, reply_markup=reply_markup))
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return
+        log.warning(f"Edit failed ({e}); sending a new message instead")
+        await safe_send(update, context, text, parse_mode=parse_mode, reply_markup=reply_markup)
+    except Exception as e:
+        log.exception(f"Telegram edit error: {e}")
@@ -1,15 +1,22 @@
 import datetime as dt
-from typing import Tuple
-from utils.memory import get_user, set_user
+from typing import Tuple, Dict, Any, Optional
+from utils.memory import get_user, update_user
 
 WELCOME_BACK_HOURS = 5
 
-def touch_user(chat_id: int, context_name: str = None):
-    """آخرین فعالیت و آخرین کانتکست را ثبت می‌کند."""
-    now = dt.datetime.utcnow().isoformat()
-    set_user(chat_id, "last_activity", now)
+def touch_user(chat_id: int, context_name: str = None, user: Optional[Dict[str, Any]] = None):
+    """
+    آخرین فعالیت و آخرین کانتکست را ثبت می‌کند.
+    اگر user (سندِ باز در یک update_user) داده شود، فقط همان سند تغییر می‌کند
+    و ثبت نهایی با تراکنشِ هندلر انجام می‌شود.
+    """
+    if user is None:
+        with update_user(chat_id) as u:
+            touch_user(chat_id, context_name, user=u)
+        return
+    user["last_activity"] = dt.datetime.utcnow().isoformat()
     if context_name:
-        set_user(chat_id, "last_context", context_name)
+        user["last_context"] = context_name
 
 def should_show_welcome_back(chat_id: int) -> bool:
     """اگر آخرین فعالیت بیش از WELCOME_BACK_HOURS قبل بوده باشد، True."""
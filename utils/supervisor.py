@@ -0,0 +1,241 @@
+# utils/supervisor.py
+import os
+import json
+import queue
+import signal
+import asyncio
+import logging
+import multiprocessing as mp
+from typing import Any, Callable, Dict, List, Optional
+
+from telegram import Bot, Update
+from telegram.request import HTTPXRequest
+
+from utils import metrics
+
+log = logging.getLogger("Supervisor")
+
+# تعداد پردازه‌های worker؛ هر چت همیشه به همان worker می‌رود (chat_id % WORKERS)
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 2)))
+# ورودی آپدیت‌ها در supervisor: polling (getUpdates) یا webhook (سرور aiohttp)
+SUPERVISOR_INGRESS = os.getenv("SUPERVISOR_INGRESS", "polling").strip().lower()
+# سقف صف هر worker و آپدیت‌های در جریانش؛ در webhook پر بودن = 503، در polling = صبر
+WORKER_QUEUE_MAX = int(os.getenv("WORKER_QUEUE_MAX", "1000"))
+# مهلت گذاشتن پیام توقف (None) در صف هر worker هنگام خاموش شدن
+_STOP_PUT_TIMEOUT = 5.0
+
+_CHAT_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post",
+                "business_message", "edited_business_message",
+                "my_chat_member", "chat_member", "chat_join_request",
+                "message_reaction", "message_reaction_count", "chat_boost", "removed_chat_boost")
+_USER_FIELDS = ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query", "poll_answer")
+
+def route_key(data: Dict[str, Any]) -> int:
+    """chat_id آپدیت خام (JSON)؛ همان کلید ترتیب در ChatOrderedUpdateProcessor."""
+    for field in _CHAT_FIELDS:
+        obj = data.get(field)
+        if obj and obj.get("chat"):
+            return int(obj["chat"]["id"])
+    cq = data.get("callback_query")
+    if cq:
+        msg = cq.get("message") or {}
+        if msg.get("chat"):
+            return int(msg["chat"]["id"])
+        return int((cq.get("from") or {}).get("id", 0))
+    for field in _USER_FIELDS:
+        obj = data.get(field)
+        if obj:
+            user = obj.get("from") or obj.get("user") or {}
+            return int(user.get("id", 0))
+    return 0
+
+
+# =========================
+# Worker process
+# =========================
+def _worker_main(index: int, inbox: "mp.Queue", build_app: Callable[..., Any]):
+    """
+    یک worker: Application خودش (کش وضعیت کاربر، کش‌ها، scheduler مدل) را دارد و فقط
+    آپدیت‌های چت‌های سهم خودش را می‌گیرد؛ پس بین پردازه‌ها قفلی روی utils/memory لازم نیست.
+    """
+    # Ctrl+C را supervisor مدیریت می‌کند؛ worker با پیام None از صف متوقف می‌شود
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    mp.current_process().name = f"worker-{index}"
+    asyncio.run(_worker_loop(index, inbox, build_app))
+
+async def _worker_loop(index: int, inbox: "mp.Queue", build_app: Callable[..., Any]):
+    app = build_app(update_queue=asyncio.Queue(maxsize=WORKER_QUEUE_MAX))
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+    except (NotImplementedError, RuntimeError):
+        pass
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    log.info("Worker %d started (pid %d)", index, os.getpid())
+    processor = app.update_processor
+    try:
+        while not stop.is_set():
+            # PTB صف خودش را فوراً به task تبدیل می‌کند؛ پس تا وقتی این worker پر است از
+            # صف بین‌پردازه‌ای برندار تا آن صف پر شود و فشار به supervisor برسد
+            if hasattr(processor, "wait_below"):
+                await processor.wait_below(WORKER_QUEUE_MAX)
+            # get بلاک‌کننده در thread تا event loop آزاد بماند؛ هر ثانیه stop بررسی می‌شود
+            try:
+                raw = await loop.run_in_executor(None, inbox.get, True, 1.0)
+            except queue.Empty:
+                continue
+            if raw is None:
+                break
+            try:
+                update = Update.de_json(json.loads(raw), app.bot)
+            except Exception:
+                log.exception("Worker %d: bad update payload dropped", index)
+                continue
+            if update is not None:
+                await app.update_queue.put(update)
+    finally:
+        log.info("Worker %d stopping…", index)
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+# =========================
+# Supervisor
+# =========================
+class Supervisor:
+    """
+    N پردازهٔ worker را اجرا می‌کند، هر آپدیت را با chat_id % N به صف worker مربوط
+    می‌فرستد و workerهای از کار افتاده را دوباره بالا می‌آورد (با همان صف).
+    """
+
+    def __init__(self, build_app: Callable[..., Any], workers: int = WORKERS):
+        self.build_app = build_app
+        self.n = max(1, workers)
+        # workerها env را به ارث می‌برند: سقف‌های سراسری OpenAI/تلگرام بین آن‌ها تقسیم می‌شود
+        os.environ["BOT_WORKER_COUNT"] = str(self.n)
+        self.ctx = mp.get_context("spawn")  # fork با threadها و event loop امن نیست
+        self.queues: List["mp.Queue"] = [self.ctx.Queue(maxsize=WORKER_QUEUE_MAX) for _ in range(self.n)]
+        self.procs: List[Optional[mp.Process]] = [None] * self.n
+        self.stop = asyncio.Event()
+        metrics.register_gauge("supervisor", self.stats)
+
+    # ---------- workers ----------
+    def _spawn(self, i: int):
+        p = self.ctx.Process(target=_worker_main, args=(i, self.queues[i], self.build_app),
+                             name=f"worker-{i}", daemon=False)
+        p.start()
+        self.procs[i] = p
+
+    async def _watch(self):
+        while not self.stop.is_set():
+            for i, p in enumerate(self.procs):
+                if p is not None and not p.is_alive():
+                    metrics.inc("supervisor_worker_restarts_total", worker=i)
+                    log.error("Worker %d exited with code %s; restarting", i, p.exitcode)
+                    self._spawn(i)
+            try:
+                await asyncio.wait_for(self.stop.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        depth = []
+        for q in self.queues:
+            try:
+                depth.append(q.qsize())
+            except NotImplementedError:  # macOS
+                depth.append(-1)
+        return {"workers": self.n, "alive": sum(1 for p in self.procs if p and p.is_alive()), "queue_depth": depth}
+
+    # ---------- routing ----------
+    def _target(self, data: Dict[str, Any]) -> int:
+        return route_key(data) % self.n
+
+    def route_nowait(self, data: Dict[str, Any]) -> bool:
+        """برای webhook: False = صف آن worker پر است (503)."""
+        i = self._target(data)
+        try:
+            self.queues[i].put_nowait(json.dumps(data, ensure_ascii=False))
+        except queue.Full:
+            return False
+        metrics.inc("supervisor_routed_total", worker=i)
+        return True
+
+    async def route(self, data: Dict[str, Any]):
+        """برای polling: اگر صف پر است صبر کن (بدون بلاک کردن event loop)."""
+        i = self._target(data)
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.queues[i].put, json.dumps(data, ensure_ascii=False))
+        metrics.inc("supervisor_routed_total", worker=i)
+
+    # ---------- ingress ----------
+    async def _poll(self, token: str):
+        bot = Bot(token, get_updates_request=HTTPXRequest(read_timeout=40.0, connect_timeout=30.0))
+        async with bot:
+            await bot.delete_webhook()
+            offset = None
+            while not self.stop.is_set():
+                try:
+                    updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log.warning("getUpdates failed: %s; retrying in 3s", e)
+                    await asyncio.sleep(3)
+                    continue
+                for u in updates:
+                    await self.route(u.to_dict())
+                    offset = u.update_id + 1
+
+    async def _webhook(self, token: str):
+        from utils.webhook import make_web_app, start_site, register_webhook, require_secret
+        require_secret()
+        runner = await start_site(make_web_app(self.route_nowait, self.stats))
+        try:
+            async with Bot(token) as bot:
+                await register_webhook(bot)
+            await self.stop.wait()
+        finally:
+            await runner.cleanup()
+
+    async def run(self, token: str):
+        from utils.webhook import stop_on_signals
+        stop_on_signals(self.stop)
+        for i in range(self.n):
+            self._spawn(i)
+        log.info("Supervisor started %d workers (ingress: %s)", self.n, SUPERVISOR_INGRESS)
+        watcher = asyncio.create_task(self._watch())
+        ingress = asyncio.create_task(self._webhook(token) if SUPERVISOR_INGRESS == "webhook" else self._poll(token))
+        try:
+            await self.stop.wait()
+        finally:
+            ingress.cancel()
+            await asyncio.gather(ingress, return_exceptions=True)
+            await watcher
+            await self._shutdown_workers()
+
+    async def _shutdown_workers(self, timeout: float = 30.0):
+        loop = asyncio.get_running_loop()
+        for i, q in enumerate(self.queues):
+            # worker مرده/گیرکرده با صف پر: بعد از مهلت، سراغ join/terminate برو
+            try:
+                await loop.run_in_executor(None, q.put, None, True, _STOP_PUT_TIMEOUT)
+            except queue.Full:
+                log.warning("Worker %d queue still full after %.0fs; skipping stop message", i, _STOP_PUT_TIMEOUT)
+        for i, p in enumerate(self.procs):
+            if p is None:
+                continue
+            await loop.run_in_executor(None, p.join, timeout)
+            if p.is_alive():
+                log.warning("Worker %d did not stop in %.0fs; terminating", i, timeout)
+                p.terminate()
+        log.info("All workers stopped.")
@@ -0,0 +1,77 @@
+# utils/text_diff.py
+import re
+import html
+import difflib
+from typing import Iterable, List
+
+# کلمه / فاصله / علامت: فاصله‌ها توکن جدا هستند تا چیدمان متن حفظ شود
+_TOKEN = re.compile(r"\s+|\w+|[^\w\s]", re.UNICODE)
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text or "")
+
+def _wrap(tag: str, text: str) -> str:
+    """فقط هستهٔ متن داخل تگ؛ فاصله‌های دو طرف بیرون می‌مانند."""
+    core = text.strip()
+    if not core:
+        return ""
+    lead = text[: len(text) - len(text.lstrip())]
+    trail = text[len(text.rstrip()):]
+    return f"{html.escape(lead, quote=False)}<{tag}>{html.escape(core, quote=False)}</{tag}>{html.escape(trail, quote=False)}"
+
+def render_diff_html(original: str, corrected: str) -> str:
+    """
+    diff کلمه‌به‌کلمه به HTML تلگرام: حذف‌شده <s>…</s>، اضافه‌شده <b>…</b>.
+    فقط تغییر فاصله‌ها علامت نمی‌خورد.
+    """
+    a, b = tokenize(original), tokenize(corrected)
+    # autojunk=False: در متن‌های بلند، فاصله و «die» نباید junk حساب شوند
+    sm = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    out: List[str] = []
+    for op, i1, i2, j1, j2 in sm.get_opcodes():
+        old, new = "".join(a[i1:i2]), "".join(b[j1:j2])
+        if op == "equal":
+            out.append(html.escape(old, quote=False))
+            continue
+        if not old.strip() and not new.strip():
+            out.append(html.escape(new, quote=False))
+            continue
+        deleted, inserted = _wrap("s", old), _wrap("b", new)
+        out.append(deleted + (" " if deleted and inserted and not new[:1].isspace() else "") + inserted)
+        if not inserted and new:  # فقط فاصله‌ای که جایگزین شد
+            out.append(html.escape(new, quote=False))
+    return "".join(out)
+
+def changed_ratio(original: str, corrected: str) -> float:
+    """سهم توکن‌های تغییرکرده (0..1)؛ برای لاگ/متریک."""
+    a, b = tokenize(original), tokenize(corrected)
+    if not a and not b:
+        return 0.0
+    return 1.0 - difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+def pack_blocks(blocks: Iterable[str], limit: int) -> List[str]:
+    """
+    چسباندن بلوک‌های HTML (هر کدام با تگ‌های بسته) در پیام‌هایی تا سقف limit،
+    بدون بریدن وسط یک تگ. بلوکِ تنهایی بزرگ‌تر از limit روی خط‌جدید بریده می‌شود.
+    """
+    parts: List[str] = []
+    cur = ""
+    for block in blocks:
+        if not block:
+            continue
+        candidate = f"{cur}\n\n{block}" if cur else block
+        if len(candidate) <= limit:
+            cur = candidate
+            continue
+        if cur:
+            parts.append(cur)
+        cur = ""
+        while len(block) > limit:
+            cut = block.rfind("\n", 0, limit)
+            cut = cut if cut > 0 else limit
+            parts.append(block[:cut])
+            block = block[cut:].lstrip("\n")
+        cur = block
+    if cur:
+        parts.append(cur)
+    return parts
@@ -0,0 +1,132 @@
+# utils/update_processor.py
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from utils import metrics
+
+log = logging.getLogger("Updates")
+
+
+class _ChatSlot:
+    __slots__ = ("lock", "refs")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # FIFO: آپدیت‌های یک چت به ترتیب ورود اجرا می‌شوند
+        self.refs = 0
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    آپدیت‌های یک chat_id همیشه به ترتیب و پشت‌سرهم اجرا می‌شوند،
+    اما چت‌های مختلف کاملاً مستقل و موازی پردازش می‌شوند.
+
+    - concurrency: سقف هندلرهای هم‌زمان (semaphore سراسری)
+    - max_pending: سقف کل آپدیت‌های منتظر + در حال اجرا
+
+    هر چت یک قفل FIFO دارد که با اولین آپدیت ساخته و بعد از آخرین آپدیت دور ریخته
+    می‌شود؛ پس دو ضربهٔ سریع روی یک دکمه هرگز هم‌زمان روی وضعیت یک کاربر
+    read-modify-write نمی‌کنند، و چتی که منتظر مدل است جلوی چت دیگری را نمی‌گیرد.
+
+    in_flight تعداد آپدیت‌هایی است که PTB تحویل داده و هنوز تمام نشده‌اند (شامل
+    آن‌هایی که پشت semaphore خودِ PTB منتظرند)؛ webhook و worker برای backpressure
+    از آن استفاده می‌کنند، چون update_queueِ PTB فوراً خالی می‌شود.
+    """
+
+    def __init__(self, concurrency: int = 32, max_pending: int = 1024):
+        if concurrency < 1:
+            raise ValueError("concurrency must be >= 1")
+        super().__init__(max_concurrent_updates=max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self._sem = asyncio.Semaphore(concurrency)
+        self._chats: Dict[int, _ChatSlot] = {}
+        self._in_flight = 0
+        self._running = 0
+        self._processed = 0
+        self._peak = 0
+        self._changed = asyncio.Event()
+        metrics.register_gauge("updates", self.stats)
+
+    # ---------- routing ----------
+    @staticmethod
+    def chat_key(update: object) -> int:
+        key: Optional[int] = None
+        if isinstance(update, Update):
+            if update.effective_chat:
+                key = update.effective_chat.id
+            elif update.effective_user:
+                key = update.effective_user.id
+            else:
+                key = update.update_id
+        return key or 0
+
+    # ---------- backpressure ----------
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def wait_below(self, limit: int):
+        """تا وقتی in_flight کمتر از limit شود صبر کن."""
+        while self._in_flight >= limit:
+            self._changed.clear()
+            await self._changed.wait()
+
+    # ---------- BaseUpdateProcessor ----------
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        self._in_flight += 1
+        self._peak = max(self._peak, self._in_flight)
+        try:
+            await super().process_update(update, coroutine)
+        finally:
+            self._in_flight -= 1
+            self._changed.set()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        # آپدیت‌های در حال اجرا تمام شوند (مثل join صف‌ها در نسخهٔ قبل)
+        while self._in_flight:
+            self._changed.clear()
+            await self._changed.wait()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.chat_key(update)
+        slot = self._chats.get(key)
+        if slot is None:
+            slot = self._chats[key] = _ChatSlot()
+        slot.refs += 1
+        enqueued = time.monotonic()
+        started = False
+        try:
+            async with slot.lock:
+                async with self._sem:
+                    metrics.observe("update_queue_wait_seconds", time.monotonic() - enqueued)
+                    started = True
+                    self._running += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self._running -= 1
+                        self._processed += 1
+        finally:
+            if not started and hasattr(coroutine, "close"):
+                coroutine.close()  # لغو قبل از اجرا: هشدار «never awaited» نده
+            slot.refs -= 1
+            if slot.refs == 0:
+                self._chats.pop(key, None)
+
+    # ---------- metrics ----------
+    def stats(self) -> Dict[str, int]:
+        """آپدیت‌های در جریان/در حال اجرا، چت‌های دارای آپدیت، بیشینه و تعداد پردازش‌شده."""
+        return {
+            "in_flight": self._in_flight,
+            "running": self._running,
+            "chats": len(self._chats),
+            "peak": self._peak,
+            "processed": self._processed,
+        }
@@ -0,0 +1,160 @@
+# utils/webhook.py
+import os
+import hmac
+import json
+import signal
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from utils import metrics
+
+log = logging.getLogger("Webhook")
+
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = "/" + os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+# آدرس عمومی (پشت load balancer/پراکسی)؛ خالی = setWebhook صدا زده نمی‌شود (مثلاً تست محلی یا چند worker)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()
+# تلگرام همین را در هدر X-Telegram-Bot-Api-Secret-Token می‌فرستد؛ با WEBHOOK_URL اجباری است
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# سقف آپدیت‌های پذیرفته‌شده و هنوز تمام‌نشده (صف + در حال پردازش)؛ بالاتر از آن 503
+# برمی‌گردد و تلگرام بعداً دوباره می‌فرستد
+WEBHOOK_QUEUE_MAX = int(os.getenv("WEBHOOK_QUEUE_MAX", "2000"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def make_update_queue() -> asyncio.Queue:
+    """صف محدود برای ApplicationBuilder().update_queue(...)."""
+    return asyncio.Queue(maxsize=WEBHOOK_QUEUE_MAX)
+
+def require_secret():
+    """آدرس عمومی بدون secret یعنی هر کسی می‌تواند آپدیت جعلی POST کند؛ اجرا نشو."""
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET must be set when WEBHOOK_URL is public")
+
+def _check_secret(request: web.Request) -> bool:
+    if not WEBHOOK_SECRET:
+        return True
+    given = request.headers.get(_SECRET_HEADER, "")
+    return hmac.compare_digest(given.encode("utf-8"), WEBHOOK_SECRET.encode("utf-8"))
+
+# sink: JSON آپدیت را می‌گیرد؛ True = پذیرفته شد، False = صف پر است (503)
+Sink = Callable[[Dict[str, Any]], bool]
+
+def app_sink(app: Application) -> Tuple[Sink, Callable[[], Dict[str, int]]]:
+    """
+    sink پیش‌فرض: Update.de_json و put_nowait در update_queueِ همین Application.
+    PTB صف را فوراً خالی می‌کند و برای هر آپدیت task می‌سازد، پس پذیرش بر اساس
+    صف + in_flightِ ChatOrderedUpdateProcessor است، نه فقط طول صف.
+    """
+    queue: asyncio.Queue = app.update_queue
+    processor = app.update_processor
+
+    def backlog() -> int:
+        return queue.qsize() + getattr(processor, "in_flight", 0)
+
+    def sink(data: Dict[str, Any]) -> bool:
+        if backlog() >= WEBHOOK_QUEUE_MAX:
+            return False
+        update = Update.de_json(data, app.bot)
+        if update is None:
+            raise ValueError("empty update")
+        try:
+            queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    return sink, lambda: {"depth": backlog(), "max": WEBHOOK_QUEUE_MAX}
+
+def make_web_app(sink: Sink, depth: Callable[[], Dict[str, int]]) -> web.Application:
+    """
+    سرور aiohttp: هر POST فقط اعتبارسنجی و به sink داده می‌شود و بلافاصله 200 می‌گیرد؛
+    پردازش واقعی پشت sink انجام می‌شود (update fetcherِ Application، یا workerها در حالت supervisor).
+    """
+    async def handle_update(request: web.Request) -> web.Response:
+        if not _check_secret(request):
+            metrics.inc("webhook_updates_total", outcome="forbidden")
+            return web.Response(status=403)
+        try:
+            data = await request.json(loads=json.loads)
+            accepted = sink(data)
+        except Exception:
+            metrics.inc("webhook_updates_total", outcome="bad_request")
+            return web.Response(status=400)
+        if not accepted:
+            metrics.inc("webhook_updates_total", outcome="queue_full")
+            log.warning("Webhook queue full (%s); asking Telegram to retry", depth())
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        metrics.inc("webhook_updates_total", outcome="accepted")
+        return web.Response(status=200)
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"ok": True, "queue": depth()})
+
+    metrics.register_gauge("webhook_queue", depth)
+    web_app = web.Application(client_max_size=1 << 20)
+    web_app.router.add_post(WEBHOOK_PATH, handle_update)
+    web_app.router.add_get("/healthz", health)
+    return web_app
+
+async def start_site(web_app: web.Application) -> web.AppRunner:
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT).start()
+    log.info("Webhook listening on %s:%d%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+    return runner
+
+async def register_webhook(bot):
+    """setWebhook فقط وقتی WEBHOOK_URL تنظیم شده است."""
+    if not WEBHOOK_URL:
+        log.info("WEBHOOK_URL is empty; not calling setWebhook (local/test mode)")
+        return
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=Update.ALL_TYPES,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+    log.info("Telegram webhook set to %s%s", WEBHOOK_URL.rstrip("/"), WEBHOOK_PATH)
+
+def stop_on_signals(stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # ویندوز
+
+async def serve(app: Application, stop: Optional[asyncio.Event] = None):
+    """
+    چرخهٔ عمر کامل در حالت webhook (معادل run_polling): initialize → post_init → start →
+    سرور HTTP → (setWebhook) → انتظار برای SIGINT/SIGTERM → توقف مرتب.
+    """
+    require_secret()
+    stop = stop or asyncio.Event()
+    stop_on_signals(stop)
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    runner = await start_site(make_web_app(*app_sink(app)))
+    try:
+        await register_webhook(app.bot)
+        await stop.wait()
+    finally:
+        log.info("Webhook stopping…")
+        await runner.cleanup()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)